@@ -29,8 +29,8 @@ The actual work is done in two main libraries:
 
 import sys
 
-if sys.version_info < (3, 6):
-    version_error = " Python version must be 3.6 or higher\n\
+if sys.version_info < (3, 7):
+    version_error = " Python version must be 3.7 or higher\n\
             Your current version of python is {}.{}\n\
             Please try again with python3.".format(
         sys.version_info.major, sys.version_info.minor
@@ -39,24 +39,26 @@ if sys.version_info < (3, 6):
 import argparse
 import configparser
 import os
-import zulip
+from pathlib import Path
 
-from lib.common import stream_validator, exit_immediately
+from lib.cache_format import check_compression, check_format
+from lib.common import exit_immediately, remove_temp_files, stream_validator
 
-# Most of the heavy lifting is done by the following modules:
+# Most of the heavy lifting is done by lib/populate.py and
+# lib/website.py.  We import those (and the modules for the other
+# flags) only in the phases that use them, so that `-b` doesn't load
+# the code for fetching, snapshots, uploads and so on.
 
-from lib.populate import populate_all, populate_incremental
-
-from lib.website import build_website
-
-from lib.sitemap import build_sitemap
+from lib import metrics, timing
 
 try:
     import settings
 except ModuleNotFoundError:
-    # TODO: Add better instructions.
-    exit_immediately(
-        """
+    # (--orgs doesn't need one; we complain in `run` otherwise)
+    settings = None
+
+# TODO: Add better instructions.
+NO_SETTINGS_ERROR = """
     We can't find settings.py.
 
     Please copy default_settings.py to settings.py
@@ -65,7 +67,6 @@ except ModuleNotFoundError:
     For testing, you can often leave the default settings,
     but you will still want to review them first.
     """
-    )
 
 NO_JSON_DIR_ERROR_WRITE = """
 We cannot find a place to write JSON files.
@@ -92,6 +93,15 @@ Please run the below command:
 
 mkdir {}"""
 
+NO_ZULIP_URL_ERROR = """
+We cannot figure out the URL of your Zulip organization.
+
+Either put a zuliprc file in this directory, or set
+zulip_url in settings.py (or the ZULIP_URL environment
+variable)."""
+
+ZULIPRC = "./zuliprc"
+
 
 def get_json_directory(for_writing):
     json_dir = settings.json_directory
@@ -126,18 +136,100 @@ def get_html_directory():
     return settings.html_directory
 
 
-def get_client_info():
-    config_file = "./zuliprc"
-    client = zulip.Client(config_file=config_file)
+def get_client():
+    # We only import zulip here, since building the website
+    # doesn't need a client (or even a zuliprc).
+    import zulip
+
+    return zulip.Client(config_file=ZULIPRC)
+
+
+def get_zulip_url():
+    zulip_url = getattr(settings, "zulip_url", None)
+    if zulip_url:
+        return zulip_url
+
+    if not os.path.exists(ZULIPRC):
+        exit_immediately(NO_ZULIP_URL_ERROR)
 
     # It would be convenient if the Zulip client object
     # had a `site` field, but instead I just re-read the file
     # directly to get it.
     config = configparser.RawConfigParser()
-    config.read(config_file)
-    zulip_url = config.get("api", "site")
+    config.read(ZULIPRC)
+    return config.get("api", "site")
+
+
+def get_upload_auth():
+    # Uploads in a private organization need the bot's credentials;
+    # without a zuliprc we try without any.
+    if not os.path.exists(ZULIPRC):
+        return None
+    config = configparser.RawConfigParser()
+    config.read(ZULIPRC)
+    from lib.uploads import basic_auth
+
+    return basic_auth(config.get("api", "email"), config.get("api", "key"))
+
 
-    return client, zulip_url
+def check_flags(results):
+    """
+    Complains about flags that don't work together, before we do any
+    work (like starting a staging build).
+    """
+    if results.pipeline:
+        if not (results.i and results.b):
+            exit_immediately("--pipeline needs both -i and -b.")
+        if results.bundle or results.by_month or results.mirror_uploads:
+            exit_immediately(
+                "--pipeline doesn't work with --bundle, --by-month or --mirror-uploads."
+            )
+    if results.bundle and (
+        results.staging or results.by_month or results.mirror_uploads
+    ):
+        exit_immediately(
+            "--bundle doesn't work with --staging, --by-month or --mirror-uploads."
+        )
+    if results.by_month and results.views:
+        exit_immediately("--views doesn't work with --by-month yet.")
+
+
+def run_orgs(results):
+    unsupported = [
+        flag
+        for flag in [
+            "snapshot",
+            "pack_snapshot",
+            "restore_snapshot",
+            "migrate_cache",
+            "verify",
+            "export",
+            "stats",
+            "serve",
+            "staging",
+            "bundle",
+            "by_month",
+            "mirror_uploads",
+            "pipeline",
+        ]
+        if getattr(results, flag)
+    ]
+    if unsupported:
+        flags = ", ".join("--" + flag.replace("_", "-") for flag in unsupported)
+        exit_immediately(f"{flags} doesn't work with --orgs yet.")
+
+    from lib.orgs import archive_orgs, read_orgs
+
+    mode = "t" if results.t else "i" if results.i else None
+    return archive_orgs(
+        read_orgs(results.orgs),
+        mode,
+        results.b,
+        os.path.dirname(os.path.realpath(__file__)),
+        results.views,
+        not results.no_sitemap,
+        results.jobs,
+    )
 
 
 def run():
@@ -153,6 +245,55 @@ def run():
         default=False,
         help="Don't build sitemap files",
     )
+    parser.add_argument(
+        "--staging",
+        action="store_true",
+        default=False,
+        help="With -b, build into a new directory and then swap it in for the html directory",
+    )
+    parser.add_argument(
+        "--bundle",
+        metavar="FILE",
+        help="With -b, write the website into FILE (.tar, .tar.gz, .tgz or .zip) instead of the html directory",
+    )
+    parser.add_argument(
+        "--by-month",
+        action="store_true",
+        default=False,
+        help="With -b, split the website up by month, and leave the months that are over alone",
+    )
+    parser.add_argument(
+        "--views",
+        action="store_true",
+        default=False,
+        help="With -b, also build the author, per-day and topic stats pages",
+    )
+    parser.add_argument(
+        "--mirror-uploads",
+        action="store_true",
+        default=False,
+        help="With -b, download the uploads and images that messages link to into the website, and link to those",
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        const=4000,
+        default=None,
+        type=int,
+        metavar="PORT",
+        help="Serve the website on PORT (default: 4000), rendering pages from the json archive as they're asked for",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="The address --serve listens on (default: 127.0.0.1, only this machine; 0.0.0.0 for everyone)",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        default=False,
+        help="With -i and -b, render the topics that got new messages while fetching the rest (and leave the other topic pages alone)",
+    )
     parser.add_argument(
         "-t", action="store_true", default=False, help="Make a clean json archive"
     )
@@ -163,59 +304,372 @@ def run():
         help="Incrementally update the json archive",
     )
 
+    parser.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="Read the json archive from snapshot FILE, with only the files that changed since in the json directory",
+    )
+    parser.add_argument(
+        "--pack-snapshot",
+        metavar="FILE",
+        help="Pack the json archive into snapshot FILE (after -t/-i)",
+    )
+    parser.add_argument(
+        "--restore-snapshot",
+        metavar="FILE",
+        help="Unpack snapshot FILE into the json directory (before -t/-i/-b)",
+    )
+
+    parser.add_argument(
+        "--migrate-cache",
+        metavar="DIR",
+        help="Copy the json archive to DIR in the cache_format/cache_compression from settings.py, and check the copy",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="How many processes to use for --migrate-cache and --verify (default: one per CPU), or threads for --mirror-uploads (default: 8) and --pipeline (default: 2), or fetch threads for --orgs (default: one per org)",
+    )
+    parser.add_argument(
+        "--verify",
+        nargs="?",
+        const=True,
+        default=None,
+        metavar="FILE",
+        help="Check the json archive and the website against each other, and print (and save as JSON to FILE) a repair plan",
+    )
+
+    parser.add_argument(
+        "--export",
+        metavar="FILE",
+        help="Write every message in the json archive (id, stream, topic, sender, timestamp, content length) to FILE, as Parquet if it ends with .parquet, else as Arrow",
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="FILE",
+        help="Print message volumes per stream and per period from FILE (from --export)",
+    )
+    parser.add_argument(
+        "--period",
+        # (lib/export.py's PERIODS)
+        choices=["day", "month", "year"],
+        default="month",
+        help="The period for --stats (default: month)",
+    )
+    parser.add_argument(
+        "--stats-file",
+        metavar="FILE",
+        help="Save the --stats volumes (also per stream and period) as JSON to FILE",
+    )
+
+    parser.add_argument(
+        "--orgs",
+        metavar="FILE",
+        help="Do -t/-i/-b for every organization listed in the YAML file FILE, with its own settings and zuliprc (see lib/orgs.py)",
+    )
+
+    parser.add_argument(
+        "--timings",
+        nargs="?",
+        const=True,
+        default=None,
+        metavar="FILE",
+        help="Report time and memory spent in each phase (and save them as JSON to FILE)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Like --timings, but also save a cProfile for each phase to DIR",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write run counters to FILE at the end (Prometheus format if FILE ends with .prom, else JSON)",
+    )
+
     results = parser.parse_args()
 
     if results.t and results.i:
         print("Cannot perform both a total and incremental update. Use -t or -i.")
         exit(1)
 
-    if not (results.t or results.i or results.b):
+    if not (
+        results.t
+        or results.i
+        or results.b
+        or results.pack_snapshot
+        or results.restore_snapshot
+        or results.migrate_cache
+        or results.verify
+        or results.export
+        or results.stats
+        or results.serve
+    ):
         print("\nERROR!\n\nYou have not specified any work to do.\n")
         parser.print_help()
         exit(1)
 
+    check_flags(results)
+
+    timings_file = None
+    if results.profile:
+        timing.enable(profile_dir=results.profile)
+        timings_file = Path(results.profile) / "timings.json"
+    elif results.timings:
+        timing.enable()
+    if isinstance(results.timings, str):
+        timings_file = results.timings
+
+    if results.metrics:
+        metrics.enable()
+
+    if results.orgs:
+        failed = run_orgs(results)
+        timing.finish(timings_file)
+        if results.metrics:
+            modes = [flag for flag in ("t", "i", "b") if getattr(results, flag)]
+            metrics.write_metrics(results.metrics, modes)
+        if failed:
+            exit_immediately(f"These organizations failed: {', '.join(failed)}")
+        return
+
+    if settings is None:
+        exit_immediately(NO_SETTINGS_ERROR)
+
     json_root = get_json_directory(for_writing=results.t)
 
+    if results.restore_snapshot:
+        from lib.snapshot import restore_snapshot
+
+        with timing.phase("snapshot"):
+            restore_snapshot(results.restore_snapshot, json_root)
+
+    if results.snapshot:
+        from lib.snapshot import open_snapshot
+
+        json_root = open_snapshot(results.snapshot, json_root)
+
     # The directory where this archive.py is located
     repo_root = os.path.dirname(os.path.realpath(__file__))
 
-    if results.b:
+    if results.b and not results.bundle:
         md_root = get_html_directory()
+        remove_temp_files(md_root)
 
     if results.t or results.i:
         is_valid_stream_name = stream_validator(settings)
+        remove_temp_files(json_root)
+
+    if results.t or results.i or results.migrate_cache:
+        # Older settings.py files don't have these.
+        cache_format = getattr(settings, "cache_format", "json")
+        cache_compression = getattr(settings, "cache_compression", None)
+        check_format(cache_format)
+        check_compression(cache_compression)
 
-    client, zulip_url = get_client_info()
+    if results.t or results.i:
+        client = get_client()
+
+    pipeline = None
+    if results.pipeline:
+        from lib.pipeline import PipelinedBuild
+        from lib.staging import start_staging
+        from lib.views import Views
+
+        build_root = md_root
+        if results.staging:
+            build_root = start_staging(md_root)
+        pipeline = PipelinedBuild(
+            json_root,
+            build_root,
+            settings.site_url,
+            settings.html_root,
+            settings.title,
+            get_zulip_url(),
+            settings.zulip_icon_url,
+            repo_root,
+            settings.page_head_html,
+            settings.page_footer_html,
+            Views(json_root) if results.views else None,
+            results.jobs,
+        )
 
     if results.t:
+        from lib.populate import populate_all
+
         populate_all(
             client,
             json_root,
             is_valid_stream_name,
+            cache_format,
+            cache_compression,
         )
 
     elif results.i:
+        from lib.populate import populate_incremental
+
         populate_incremental(
             client,
             json_root,
             is_valid_stream_name,
+            cache_format,
+            cache_compression,
+            None if pipeline is None else pipeline.topic_updated,
         )
 
-    if results.b:
-        build_website(
+    if results.pack_snapshot:
+        from lib.snapshot import pack_snapshot
+
+        with timing.phase("snapshot"):
+            pack_snapshot(json_root, results.pack_snapshot)
+
+    if results.migrate_cache:
+        from lib.migrate import migrate_cache
+
+        migrate_cache(
+            json_root,
+            results.migrate_cache,
+            cache_format,
+            cache_compression,
+            results.jobs,
+        )
+
+    if results.verify:
+        from lib.verify import verify
+
+        md_root = settings.html_directory
+        if not md_root.is_dir():
+            print(f"{md_root} doesn't exist; only checking the json archive")
+            md_root = None
+        verify(
             json_root,
             md_root,
             settings.site_url,
             settings.html_root,
+            results.jobs,
+            results.verify if isinstance(results.verify, str) else None,
+        )
+
+    if results.export:
+        from lib.export import export_cache
+
+        export_cache(json_root, results.export)
+
+    if results.stats:
+        from lib.export import print_stats
+
+        print_stats(results.stats, results.period, results.stats_file)
+
+    if results.b and pipeline is not None:
+        pipeline.finish()
+    elif results.b:
+        zulip_url = get_zulip_url()
+        if results.bundle:
+            from lib.files import open_sink
+
+            md_root = build_root = open_sink(results.bundle)
+        else:
+            build_root = md_root
+        if results.staging:
+            from lib.staging import start_staging
+
+            build_root = start_staging(md_root)
+        uploads = None
+        if results.mirror_uploads:
+            from lib.uploads import UploadMirror
+
+            uploads = UploadMirror(
+                json_root,
+                build_root,
+                zulip_url,
+                get_upload_auth(),
+                results.jobs,
+            )
+        if results.by_month:
+            from lib.partitions import build_partitioned_website
+
+            build_partitioned_website(
+                json_root,
+                build_root,
+                settings.site_url,
+                settings.html_root,
+                settings.title,
+                zulip_url,
+                settings.zulip_icon_url,
+                repo_root,
+                settings.page_head_html,
+                settings.page_footer_html,
+                uploads,
+            )
+        else:
+            from lib.website import build_website
+
+            views = None
+            if results.views:
+                from lib.views import Views
+
+                views = Views(json_root)
+            build_website(
+                json_root,
+                build_root,
+                settings.site_url,
+                settings.html_root,
+                settings.title,
+                zulip_url,
+                settings.zulip_icon_url,
+                repo_root,
+                settings.page_head_html,
+                settings.page_footer_html,
+                uploads,
+                views,
+            )
+
+    if results.b:
+        if not results.no_sitemap:
+            from lib.sitemap import build_sink_sitemap, build_sitemap
+
+            if results.staging:
+                from lib.staging import unlink_sitemaps
+
+                unlink_sitemaps(build_root)
+            with timing.phase("sitemap"):
+                if results.bundle:
+                    build_sink_sitemap(settings.site_url, build_root)
+                else:
+                    build_sitemap(
+                        settings.site_url, build_root.as_posix(), build_root.as_posix()
+                    )
+        if results.staging:
+            from lib.staging import finish_staging
+
+            finish_staging(md_root, build_root)
+        if results.bundle:
+            build_root.sink.close()
+
+    if results.serve:
+        from lib.serve import serve
+
+        serve(
+            results.serve,
+            json_root,
+            settings.site_url,
+            settings.html_root,
             settings.title,
-            zulip_url,
+            get_zulip_url(),
             settings.zulip_icon_url,
             repo_root,
             settings.page_head_html,
             settings.page_footer_html,
+            results.host,
         )
-        if not results.no_sitemap:
-            build_sitemap(settings.site_url, md_root.as_posix(), md_root.as_posix())
+
+    timing.finish(timings_file)
+
+    if results.metrics:
+        modes = [flag for flag in ("t", "i", "b") if getattr(results, flag)]
+        metrics.write_metrics(results.metrics, modes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end benchmark for the archive pipeline, run against a
+synthetic JSON cache (see benchmarks/synthetic.py).
+
+Run it from the repo root:
+
+    python -m benchmarks.bench_archive --messages 100000 --output bench.json
+
+Each phase runs in a fresh interpreter, so that the peak RSS we
+report belongs to that phase alone.  The phases are:
+
+    generate:     write the synthetic JSON cache
+    build:        build_website() into an empty html directory
+    sitemap:      build_sitemap() over the built website
+    incremental:  populate_incremental() with a fake Zulip client
+    rebuild:      build_website() again, after the incremental update
+
+For every phase we report wall time, CPU time, peak RSS, and the
+number (and total size) of files the phase wrote.  Results are
+saved as JSON; pass `--compare old.json` to compare against the
+results from an earlier commit.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import default_shape
+
+PHASES = ["generate", "build", "sitemap", "incremental", "rebuild"]
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+SITE_URL = "http://127.0.0.1:4000"
+HTML_ROOT = "archive"
+ZULIP_URL = "https://example.zulipchat.com/"
+PAGE_HEAD_HTML = (
+    '<html>\n<head><meta charset="utf-8"><title>Zulip Chat Archive</title></head>\n'
+)
+PAGE_FOOTER_HTML = "\n</html>"
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def run_build(json_root, md_root):
+    from lib.website import build_website
+
+    build_website(
+        json_root,
+        md_root,
+        SITE_URL,
+        HTML_ROOT,
+        "Benchmark Archive",
+        ZULIP_URL,
+        SITE_URL + "/assets/img/zulip.svg",
+        str(REPO_ROOT),
+        PAGE_HEAD_HTML,
+        PAGE_FOOTER_HTML,
+    )
+
+
+def run_phase(phase, config, queue):
+    # We run in a spawned interpreter; `write_css` reads style.css
+    # relative to the current directory.
+    os.chdir(REPO_ROOT)
+
+    json_root = Path(config["json_root"])
+    md_root = Path(config["md_root"])
+    shape = config["shape"]
+
+    # Keep the phase's own chatter out of the benchmark report.
+    sys.stdout = open(os.devnull, "w")
+
+    rss_before = peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    extra = {}
+
+    if phase == "generate":
+        from benchmarks.synthetic import generate_cache
+
+        extra = generate_cache(
+            json_root, shape, config["cache_format"], config["cache_compression"]
+        )
+
+    elif phase in ("build", "rebuild"):
+        run_build(json_root, md_root)
+
+    elif phase == "sitemap":
+        from lib.sitemap import build_sitemap
+
+        build_sitemap(SITE_URL, md_root.as_posix(), md_root.as_posix())
+
+    elif phase == "incremental":
+        from benchmarks.synthetic import FakeClient
+        from lib.files import read_zulip_stream_info
+        from lib.populate import populate_incremental
+
+        stream_info = read_zulip_stream_info(json_root)
+        streams = stream_info["streams"].values()
+        first_id = max(s["latest_id"] for s in streams)
+        first_timestamp = int(time.time())
+        client = FakeClient(shape, config["new_messages"], first_id, first_timestamp)
+        populate_incremental(
+            client,
+            json_root,
+            lambda stream: True,
+            config["cache_format"],
+            config["cache_compression"],
+        )
+
+    queue.put(
+        dict(
+            wall_seconds=time.perf_counter() - wall_start,
+            cpu_seconds=time.process_time() - cpu_start,
+            peak_rss_mb=peak_rss_mb(),
+            baseline_rss_mb=rss_before,
+            **extra,
+        )
+    )
+
+
+def files_written_since(root, start_ns):
+    count = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(root):
+        for fn in filenames:
+            st = os.stat(os.path.join(dirpath, fn))
+            if st.st_mtime_ns >= start_ns:
+                count += 1
+                size += st.st_size
+    return count, size
+
+
+def measure(phase, config):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    start_ns = time.time_ns()
+    proc = ctx.Process(target=run_phase, args=(phase, config, queue))
+    proc.start()
+    # We can't just join the process first (a big enough result can
+    # block it on the queue), nor just wait for the result (if the
+    # phase fails, it never comes).
+    while True:
+        # (checked before we wait, so that a result put just before
+        # the process exited still gets picked up)
+        alive = proc.is_alive()
+        try:
+            result = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            if not alive:
+                result = None
+                break
+    proc.join()
+    if proc.exitcode != 0 or result is None:
+        raise Exception(f"phase {phase} failed with exit code {proc.exitcode}")
+
+    out_dir = (
+        config["json_root"]
+        if phase in ("generate", "incremental")
+        else config["md_root"]
+    )
+    files, size = files_written_since(out_dir, start_ns)
+    result["files_written"] = files
+    result["bytes_written"] = size
+    return result
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=REPO_ROOT,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(
+        f"{'phase':<12} {'wall (s)':>10} {'cpu (s)':>10} {'peak RSS (MB)':>14} "
+        f"{'files':>8} {'MB written':>11}"
+    )
+    for phase, r in results.items():
+        print(
+            f"{phase:<12} {r['wall_seconds']:>10.2f} {r['cpu_seconds']:>10.2f} "
+            f"{r['peak_rss_mb']:>14.1f} {r['files_written']:>8} "
+            f"{r['bytes_written'] / (1024 * 1024):>11.1f}"
+        )
+
+
+def print_comparison(old, new):
+    print(f"\ncompared to {old.get('commit')} (new / old):")
+    for phase, r in new["results"].items():
+        if phase not in old["results"]:
+            continue
+        o = old["results"][phase]
+        ratios = []
+        for key in ("wall_seconds", "cpu_seconds", "peak_rss_mb", "bytes_written"):
+            if o.get(key):
+                ratios.append(f"{key}={r[key] / o[key]:.2f}x")
+        print(f"{phase:<12} " + " ".join(ratios))
+    if old.get("shape") != new["shape"]:
+        print("WARNING: the archive shapes differ, so the comparison is apples/oranges")
+
+
+def run():
+    shape = default_shape()
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the archive pipeline on a synthetic archive."
+    )
+    for key, value in shape.items():
+        parser.add_argument(
+            "--" + key.replace("_", "-"),
+            type=type(value),
+            default=value,
+            help=f"(default: {value})",
+        )
+    parser.add_argument(
+        "--new-messages",
+        type=int,
+        default=500,
+        help="new messages per stream for the incremental phase (default: 500)",
+    )
+    parser.add_argument(
+        "--cache-format",
+        default="json",
+        help="format for the JSON cache (see lib/cache_format.py)",
+    )
+    parser.add_argument(
+        "--cache-compression",
+        help="gzip or zstd compression for the JSON cache (default: none)",
+    )
+    parser.add_argument(
+        "--phases",
+        default=",".join(PHASES),
+        help="comma-separated list of phases to run (default: all)",
+    )
+    parser.add_argument(
+        "--workdir",
+        help="where to put the synthetic cache and website (default: a temp dir)",
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="compare against an earlier results file")
+
+    args = parser.parse_args()
+
+    for key in shape:
+        shape[key] = getattr(args, key)
+
+    phases = args.phases.split(",")
+    for phase in phases:
+        if phase not in PHASES:
+            parser.error(f"unknown phase {phase}; choose from {', '.join(PHASES)}")
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="zulip-archive-bench-"))
+    json_root = workdir / "zulip_json"
+    md_root = workdir / "archive"
+    if "generate" in phases:
+        shutil.rmtree(json_root, ignore_errors=True)
+        json_root.mkdir(parents=True)
+    if "build" in phases:
+        shutil.rmtree(md_root, ignore_errors=True)
+        md_root.mkdir(parents=True)
+
+    config = dict(
+        json_root=str(json_root),
+        md_root=str(md_root),
+        shape=shape,
+        new_messages=args.new_messages,
+        cache_format=args.cache_format,
+        cache_compression=args.cache_compression,
+    )
+
+    print(f"working in {workdir}")
+    results = {}
+    for phase in phases:
+        print(f"running {phase}...", flush=True)
+        results[phase] = measure(phase, config)
+
+    report = dict(
+        commit=git_commit(),
+        time=time.time(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        shape=shape,
+        new_messages=args.new_messages,
+        cache_format=args.cache_format,
+        cache_compression=args.cache_compression,
+        results=results,
+    )
+
+    print()
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+    if not args.workdir:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Measure load/dump throughput of the cache formats (and
+compressions) in lib/cache_format.py on the largest topics
+of an archive.
+
+Run it from the repo root, against your real cache:
+
+    python -m benchmarks.bench_cache_format --json-root ../zulip_json
+
+or, without --json-root, against a synthetic cache with a few
+large topics.  Formats whose libraries aren't installed
+(orjson, msgpack, zstandard) are skipped.
+"""
+
+import argparse
+import heapq
+import io
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import default_shape, generate_cache
+from lib import cache_format
+from lib.files import read_zulip_stream_info, read_zulip_topic_data
+from lib.url import sanitize, sanitize_stream
+
+
+def largest_topic_paths(json_root, count):
+    streams = read_zulip_stream_info(json_root)["streams"]
+    topics = (
+        (topic["size"], stream_name, topic_name)
+        for stream_name, stream in streams.items()
+        for topic_name, topic in read_zulip_topic_data(
+            json_root, stream_name, stream
+        ).items()
+    )
+    return [
+        json_root
+        / sanitize_stream(stream_name, streams[stream_name]["id"])
+        / (sanitize(topic_name) + ".json")
+        for _, stream_name, topic_name in heapq.nlargest(count, topics)
+    ]
+
+
+def available_formats():
+    formats = ["json", "compact-json"]
+    if cache_format.orjson is not None:
+        formats.append("orjson")
+    if cache_format.msgpack is not None:
+        formats.append("msgpack")
+    return formats
+
+
+def available_compressions():
+    compressions = [None, "gzip"]
+    if cache_format.zstandard is not None:
+        compressions.append("zstd")
+    return compressions
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def dump_bytes(messages, fmt, compression):
+    out = io.BytesIO()
+    cache_format.dump_file(messages, out, fmt, compression)
+    return out.getvalue()
+
+
+def bench_format(fmt, compression, topics, repeat):
+    dump_seconds = 0.0
+    load_seconds = 0.0
+    size = 0
+    for messages in topics:
+        data = dump_bytes(messages, fmt, compression)
+        size += len(data)
+        dump_seconds += best_time(
+            lambda: dump_bytes(messages, fmt, compression), repeat
+        )
+        load_seconds += best_time(lambda: cache_format.loads(data), repeat)
+    return dict(size=size, dump_seconds=dump_seconds, load_seconds=load_seconds)
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description="Benchmark cache formats on the largest topics."
+    )
+    parser.add_argument(
+        "--json-root", help="cache to read topics from (default: synthetic)"
+    )
+    parser.add_argument(
+        "--topics", type=int, default=10, help="how many of the largest topics to use"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.json_root:
+        json_root = Path(args.json_root)
+    else:
+        tmp_dir = Path(tempfile.mkdtemp(prefix="zulip-archive-bench-"))
+        json_root = tmp_dir
+        shape = default_shape()
+        shape.update(messages=50000, topics=100, skew=1.2)
+        print("generating a synthetic cache...")
+        generate_cache(json_root, shape)
+
+    try:
+        paths = largest_topic_paths(json_root, args.topics)
+        topics = [cache_format.load_file(path) for path in paths]
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    num_messages = sum(len(t) for t in topics)
+    print(f"{len(topics)} topics, {num_messages} messages\n")
+
+    results = {}
+    for fmt in available_formats():
+        for compression in available_compressions():
+            name = fmt if compression is None else f"{fmt}+{compression}"
+            results[name] = bench_format(fmt, compression, topics, args.repeat)
+    json_size = results["json"]["size"]
+
+    print(
+        f"{'format':<20} {'size (MB)':>10} {'vs json':>8} "
+        f"{'dump (s)':>10} {'load (s)':>10} {'load msgs/s':>12}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<20} {r['size'] / (1024 * 1024):>10.2f} "
+            f"{r['size'] / json_size:>7.0%} "
+            f"{r['dump_seconds']:>10.3f} {r['load_seconds']:>10.3f} "
+            f"{num_messages / r['load_seconds']:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+"""
+Load test for `archive.py --serve` (see lib/serve.py).
+
+Point it at a running server:
+
+    python -m benchmarks.loadtest http://127.0.0.1:4000/archive/
+
+or leave out the URL, and it serves a synthetic archive (see
+benchmarks/synthetic.py) itself:
+
+    python -m benchmarks.loadtest --messages 100000 --threads 16
+
+First we crawl the pages linked from the start URL (up to --pages of
+them), and then --threads clients ask for random pages among those,
+over keep-alive connections, for --duration seconds.  We report
+requests per second, latency percentiles, and how often the server's
+page cache had the page (its X-Cache header).  Results are saved as
+JSON with --output.
+"""
+
+import argparse
+import http.client
+import json
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import deque
+from pathlib import Path
+
+from benchmarks.synthetic import default_shape
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+HTML_ROOT = "archive"
+ZULIP_URL = "https://example.zulipchat.com/"
+PAGE_HEAD_HTML = (
+    '<html>\n<head><meta charset="utf-8"><title>Zulip Chat Archive</title></head>\n'
+)
+PAGE_FOOTER_HTML = "\n</html>"
+
+HREF_RE = re.compile(r'href="([^"#]+)"')
+
+
+class Client:
+    """
+    A keep-alive connection to the server, which reconnects if the
+    server closes it.
+    """
+
+    def __init__(self, netloc):
+        self.netloc = netloc
+        self.conn = None
+
+    def get(self, path):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.netloc, timeout=30)
+            try:
+                self.conn.request("GET", path)
+                response = self.conn.getresponse()
+                return response.status, response.getheader("X-Cache"), response.read()
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def crawl(start_url, max_pages):
+    """
+    Returns the paths of up to `max_pages` pages under `start_url`,
+    breadth first.
+    """
+    start = urllib.parse.urlsplit(start_url)
+    prefix = start.path.rsplit("/", 1)[0] + "/"
+    client = Client(start.netloc)
+    seen = {start.path}
+    queue = deque([start.path])
+    pages = []
+    while queue and len(pages) < max_pages:
+        path = queue.popleft()
+        status, _, body = client.get(path)
+        if status != 200:
+            continue
+        pages.append(path)
+        page_url = urllib.parse.urlunsplit(start._replace(path=path))
+        for href in HREF_RE.findall(body.decode("utf-8", "replace")):
+            url = urllib.parse.urlsplit(urllib.parse.urljoin(page_url, href))
+            if (
+                url.netloc == start.netloc
+                and url.path.startswith(prefix)
+                and url.path.endswith((".html", "/"))
+                and url.path not in seen
+            ):
+                seen.add(url.path)
+                queue.append(url.path)
+    client.close()
+    return start.netloc, pages
+
+
+def hammer(netloc, pages, num_threads, duration, seed):
+    """
+    Asks for random pages from `num_threads` threads for `duration`
+    seconds; returns the latencies (in seconds), the number of errors,
+    and the number of cache hits.
+    """
+    deadline = time.perf_counter() + duration
+    results = []
+
+    def worker(i):
+        rng = random.Random(seed + i)
+        client = Client(netloc)
+        latencies = []
+        errors = 0
+        hits = 0
+        while time.perf_counter() < deadline:
+            path = rng.choice(pages)
+            start = time.perf_counter()
+            try:
+                status, cache_status, _ = client.get(path)
+            except (http.client.HTTPException, OSError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+            elif cache_status == "hit":
+                hits += 1
+        client.close()
+        results.append((latencies, errors, hits))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(t for latencies, _, _ in results for t in latencies)
+    errors = sum(errors for _, errors, _ in results)
+    hits = sum(hits for _, _, hits in results)
+    return latencies, errors, hits
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def start_synthetic_server(workdir, shape):
+    """
+    Writes a synthetic cache to `workdir` and serves it from a thread;
+    returns the server and the URL of its main page.
+    """
+    from benchmarks.synthetic import generate_cache
+    from lib.serve import ArchiveServer
+
+    json_root = workdir / "zulip_json"
+    json_root.mkdir(parents=True)
+    print(f"writing a synthetic archive to {json_root}...", flush=True)
+    generate_cache(json_root, shape)
+
+    server = ArchiveServer(
+        ("127.0.0.1", 0),
+        json_root,
+        None,
+        HTML_ROOT,
+        "Load Test Archive",
+        ZULIP_URL,
+        None,
+        REPO_ROOT,
+        PAGE_HEAD_HTML,
+        PAGE_FOOTER_HTML,
+    )
+    # The pages link to site_url, which we only know once we have a port.
+    server.site_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{server.site_url}/{HTML_ROOT}/index.html"
+
+
+def run():
+    shape = default_shape()
+
+    parser = argparse.ArgumentParser(
+        description="Measure how many requests per second archive.py --serve handles."
+    )
+    parser.add_argument(
+        "url",
+        nargs="?",
+        help="the main page of a running server (default: serve a synthetic archive)",
+    )
+    for key, value in shape.items():
+        parser.add_argument(
+            "--" + key.replace("_", "-"),
+            type=type(value),
+            default=value,
+            help=f"for the synthetic archive (default: {value})",
+        )
+    parser.add_argument(
+        "--threads", type=int, default=8, help="concurrent clients (default: 8)"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=10,
+        help="seconds to run for (default: 10)",
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=1000,
+        help="how many pages to crawl and then ask for (default: 1000)",
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+
+    args = parser.parse_args()
+
+    for key in shape:
+        shape[key] = getattr(args, key)
+
+    server = None
+    workdir = None
+    url = args.url
+    if url is None:
+        workdir = Path(tempfile.mkdtemp(prefix="zulip-archive-loadtest-"))
+        server, url = start_synthetic_server(workdir, shape)
+
+    try:
+        print(f"crawling {url}...", flush=True)
+        netloc, pages = crawl(url, args.pages)
+        if not pages:
+            sys.exit(f"no pages found at {url}")
+        print(
+            f"asking for {len(pages)} pages from {args.threads} threads for {args.duration}s...",
+            flush=True,
+        )
+        latencies, errors, hits = hammer(
+            netloc, pages, args.threads, args.duration, shape["seed"]
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(workdir)
+
+    requests = len(latencies)
+    report = dict(
+        url=url,
+        pages=len(pages),
+        threads=args.threads,
+        duration=args.duration,
+        requests=requests,
+        errors=errors,
+        requests_per_second=requests / args.duration,
+        cache_hit_ratio=hits / requests if requests else 0,
+        p50_ms=percentile(latencies, 0.50) * 1000,
+        p95_ms=percentile(latencies, 0.95) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+    )
+    if args.url is None:
+        report["shape"] = shape
+
+    print()
+    print(f"requests:      {requests} ({errors} errors)")
+    print(f"requests/s:    {report['requests_per_second']:.1f}")
+    print(f"cache hits:    {report['cache_hit_ratio']:.1%}")
+    print(
+        f"latency (ms):  p50 {report['p50_ms']:.2f}  p95 {report['p95_ms']:.2f}  p99 {report['p99_ms']:.2f}"
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    run()
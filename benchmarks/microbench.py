@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmarks for the hot functions in lib/html.py, lib/url.py
+and lib/populate.py, plus a regression gate.
+
+Run it from the repo root:
+
+    # record a baseline (do this on the commit you trust)
+    python -m benchmarks.microbench --save
+
+    # later, fail (exit code 1) if anything got slower than the
+    # baseline by more than the threshold
+    python -m benchmarks.microbench --check --threshold 0.25
+
+The baseline lives in benchmarks/microbench_baseline.json unless
+you pass `--baseline`.  Timings are machine-specific, so store the
+baseline on the same machine that runs the check.  (CI has no fixed
+machine, so it saves a baseline from the base commit in the same job
+and checks against that; see .github/workflows/test.yml.)
+
+Every run also times a fixed pure-Python calibration loop.  If you
+have to compare across machines, pass `--normalize` to compare
+timings divided by the calibration time, so that a machine that is
+twice as slow overall doesn't look like a 2x regression.  (This is
+noisier than comparing raw timings on the same machine.)
+"""
+
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+from benchmarks.synthetic import (
+    default_shape,
+    synthetic_message,
+    synthetic_stream,
+    topic_name,
+)
+from lib.html import format_message_html, topic_list_html
+from lib.populate import dump_topic_messages, separate_results
+from lib.url import sanitize, sanitize_stream
+
+BENCHMARKS = [
+    "format_message_html",
+    "sanitize",
+    "sanitize_stream",
+    "topic_list_html",
+    "dump_topic_messages",
+    "separate_results",
+]
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "microbench_baseline.json"
+
+SITE_URL = "http://127.0.0.1:4000"
+ZULIP_URL = "https://example.zulipchat.com/"
+ZULIP_ICON_URL = SITE_URL + "/assets/img/zulip.svg"
+
+
+def make_messages(count, num_topics):
+    rng = random.Random(7)
+    shape = default_shape()
+    messages = []
+    for i in range(count):
+        msg = synthetic_message(rng, shape, i + 1, 1600000000 + 37 * i)
+        msg["subject"] = topic_name(0, rng.randrange(num_topics))
+        messages.append(msg)
+    return messages
+
+
+def calibration():
+    total = 0
+    for i in range(100000):
+        total += i % 7
+    return total
+
+
+def make_benchmarks(tmp_dir):
+    """
+    Returns a dict mapping benchmark names to zero-argument
+    callables.  Each callable does one "unit" of realistic work.
+    """
+    stream = synthetic_stream(0)
+    messages = make_messages(10000, 200)
+    topic_messages = messages[:1000]
+    topic_names = [topic_name(0, i) for i in range(1000)]
+    topic_data = {
+        name: dict(size=i + 1, latest_date=1600000000 + 1000 * ((i * 7919) % 2000))
+        for i, name in enumerate(topic_names)
+    }
+    msg = messages[0]
+
+    def bench_format_message_html():
+        format_message_html(
+            SITE_URL,
+            "archive",
+            ZULIP_URL,
+            ZULIP_ICON_URL,
+            stream["name"],
+            stream["stream_id"],
+            msg["subject"],
+            msg,
+        )
+
+    def bench_sanitize():
+        for name in topic_names[:100]:
+            sanitize(name)
+
+    def bench_sanitize_stream():
+        for i in range(100):
+            sanitize_stream(stream["name"], i)
+
+    def bench_topic_list_html():
+        topic_list_html(topic_data)
+
+    def bench_dump_topic_messages():
+        dump_topic_messages(tmp_dir, stream, "bench topic", topic_messages)
+
+    def bench_separate_results():
+        separate_results(messages)
+
+    return dict(
+        calibration=calibration,
+        format_message_html=bench_format_message_html,
+        sanitize=bench_sanitize,
+        sanitize_stream=bench_sanitize_stream,
+        topic_list_html=bench_topic_list_html,
+        dump_topic_messages=bench_dump_topic_messages,
+        separate_results=bench_separate_results,
+    )
+
+
+def time_one(func, repeat):
+    """
+    Returns the best per-call time in seconds.  We take the min
+    over several repeats, since noise only ever makes things slower.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run_benchmarks(names, repeat):
+    tmp_dir = Path(tempfile.mkdtemp(prefix="zulip-archive-microbench-"))
+    try:
+        benchmarks = make_benchmarks(tmp_dir)
+        results = {}
+        for name in ["calibration"] + names:
+            results[name] = time_one(benchmarks[name], repeat)
+            print(f"{name:<24} {results[name] * 1e6:>12.2f} us", flush=True)
+        return results
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def compare(baseline, results, threshold, normalize):
+    """
+    Returns a list of (name, ratio) pairs for benchmarks that are
+    slower than the baseline by more than `threshold` (0.25 means 25%).
+    """
+    if normalize:
+        base_cal = baseline["results"]["calibration"]
+        cal = results["calibration"]
+    else:
+        base_cal = cal = 1e-6
+    regressions = []
+
+    print(f"\n{'benchmark':<24} {'baseline':>12} {'now':>12} {'ratio':>8}")
+    for name, seconds in results.items():
+        if name == "calibration" or name not in baseline["results"]:
+            continue
+        old = baseline["results"][name] / base_cal
+        new = seconds / cal
+        ratio = new / old
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+            flag = "  REGRESSION"
+        print(f"{name:<24} {old:>12.3f} {new:>12.3f} {ratio:>7.2f}x{flag}")
+    return regressions
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for hot functions.")
+    parser.add_argument(
+        "--save", action="store_true", help="save the results as the new baseline"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="fail if we regressed vs. the baseline"
+    )
+    parser.add_argument(
+        "--baseline",
+        default=str(DEFAULT_BASELINE),
+        help="baseline file (default: benchmarks/microbench_baseline.json)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed slowdown before --check fails, as a fraction (default: 0.25)",
+    )
+    parser.add_argument(
+        "--normalize",
+        action="store_true",
+        help="compare timings relative to the calibration loop",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="timing repeats per benchmark"
+    )
+    parser.add_argument(
+        "--only",
+        help="comma-separated benchmarks to run (default: all of "
+        + ", ".join(BENCHMARKS)
+        + ")",
+    )
+
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else BENCHMARKS
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+
+    results = run_benchmarks(names, args.repeat)
+
+    baseline_path = Path(args.baseline)
+
+    if args.check:
+        if not baseline_path.exists():
+            print(
+                f"\nERROR\n There is no baseline at {baseline_path}.\n"
+                " Run with --save on a known-good commit first."
+            )
+            sys.exit(1)
+        with baseline_path.open(encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold, args.normalize)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed beyond the threshold:")
+            for name, ratio in regressions:
+                print(f"    {name}: {ratio:.2f}x slower")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+    if args.save:
+        with baseline_path.open("w", encoding="utf-8") as f:
+            json.dump(
+                dict(time=time.time(), results=results), f, indent=4, sort_keys=True
+            )
+        print(f"\nSaved baseline to {baseline_path}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,239 @@
+"""
+Generate synthetic JSON caches for benchmarking.
+
+The caches produced here have exactly the layout that
+`populate_all` writes (see the docstring at the top of
+lib/files.py), because we write them with the same
+`dump_topic_messages` and `dump_stream_index` helpers.
+That means a synthetic cache can be fed to `archive.py -b`,
+`populate_incremental`, or any of the benchmark scripts.
+
+The shape of the archive is controlled by a handful of knobs:
+
+    streams:        number of streams
+    topics:         number of topics per stream
+    messages:       total number of messages in the archive
+    skew:           Zipf exponent for topic sizes (0 means every
+                    topic is roughly the same size; 1.0 or more
+                    gives a few huge topics and a long tail)
+    body_size:      approximate size of a typical message body (bytes)
+    large_fraction: fraction of messages that get a body that is
+                    roughly 10x the typical size (code blocks, long posts)
+
+Everything is deterministic for a given `seed`.
+"""
+
+import random
+import time
+
+from lib.populate import dump_stream_index, dump_topic_messages
+
+# Messages are spaced out by this many seconds, so that
+# latest_date values are realistic and strictly increasing.
+SECONDS_PER_MESSAGE = 37
+
+WORDS = """
+    lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod
+    tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam
+    quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo
+    consequat duis aute irure in reprehenderit voluptate velit esse cillum
+    eu fugiat nulla pariatur excepteur sint occaecat cupidatat non proident
+""".split()
+
+SENDERS = [
+    "Alice Zulipson",
+    "Bob Streamer",
+    "Carol Topical",
+    "Dan Narrow",
+    "Eve Emoji 🐢",
+    "Frank O'Reilly",
+    "Grace <Hopper>",
+    "Heidi Ünicode",
+]
+
+
+def default_shape():
+    return dict(
+        streams=5,
+        topics=200,
+        messages=10000,
+        skew=1.0,
+        body_size=300,
+        large_fraction=0.02,
+        seed=42,
+    )
+
+
+def topic_sizes(num_topics, num_messages, skew):
+    """
+    Split num_messages over num_topics following a Zipf-like
+    distribution.  Every topic gets at least one message.
+    """
+    weights = [1.0 / (rank + 1) ** skew for rank in range(num_topics)]
+    total_weight = sum(weights)
+    spare = max(num_messages - num_topics, 0)
+    sizes = [1 + int(spare * w / total_weight) for w in weights]
+
+    # Hand out the rounding leftovers to the biggest topics.
+    leftover = max(num_messages - sum(sizes), 0)
+    for i in range(leftover):
+        sizes[i % num_topics] += 1
+    return sizes
+
+
+def message_body(rng, body_size):
+    words = []
+    length = 0
+    while length < body_size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    text = " ".join(words)
+    return f"<p>{text}</p>"
+
+
+def large_message_body(rng, body_size):
+    paragraphs = [message_body(rng, body_size) for _ in range(10)]
+    code = "\n".join(
+        f"<span class='n'>{rng.choice(WORDS)}</span> = {i}"
+        for i in range(body_size // 5)
+    )
+    paragraphs.append(f'<div class="codehilite"><pre>{code}</pre></div>')
+    return "\n".join(paragraphs)
+
+
+def stream_name(stream_index):
+    return f"stream {stream_index} ✨"
+
+
+def topic_name(stream_index, topic_index):
+    # Include some characters that need sanitizing.
+    return f"topic {stream_index}.{topic_index}: what/why? ({topic_index % 7})"
+
+
+def synthetic_stream(stream_index):
+    # This mimics the stream objects returned by the Zulip API.
+    return {
+        "name": stream_name(stream_index),
+        "stream_id": 1000 + stream_index,
+        "invite_only": False,
+        "is_web_public": True,
+    }
+
+
+def synthetic_message(rng, shape, msg_id, timestamp):
+    if rng.random() < shape["large_fraction"]:
+        content = large_message_body(rng, shape["body_size"])
+    else:
+        content = message_body(rng, shape["body_size"])
+    return {
+        "content": content,
+        "id": msg_id,
+        "sender_full_name": rng.choice(SENDERS),
+        "timestamp": timestamp,
+    }
+
+
+def generate_cache(json_root, shape, cache_format="json", cache_compression=None):
+    """
+    Write a synthetic cache to json_root and return some
+    counts describing what we wrote.
+
+    Topics are written one at a time, so memory use is bounded
+    by the size of the largest topic, even for 10M messages.
+    """
+    rng = random.Random(shape["seed"])
+
+    num_streams = shape["streams"]
+    num_topics = shape["topics"]
+    per_stream = max(shape["messages"] // num_streams, num_topics)
+    sizes = topic_sizes(num_topics, per_stream, shape["skew"])
+
+    # Start the archive far enough in the past that every message
+    # has a distinct timestamp before "now".
+    total = per_stream * num_streams
+    start_time = int(time.time()) - total * SECONDS_PER_MESSAGE
+
+    msg_id = 0
+    streams_data = {}
+    for stream_index in range(num_streams):
+        stream = synthetic_stream(stream_index)
+        topic_data = {}
+        latest_id = 0
+        for topic_index, size in enumerate(sizes):
+            name = topic_name(stream_index, topic_index)
+            messages = []
+            for _ in range(size):
+                msg_id += 1
+                timestamp = start_time + msg_id * SECONDS_PER_MESSAGE
+                messages.append(synthetic_message(rng, shape, msg_id, timestamp))
+            dump_topic_messages(
+                json_root, stream, name, messages, cache_format, cache_compression
+            )
+            topic_data[name] = dict(size=size, latest_date=messages[-1]["timestamp"])
+            latest_id = messages[-1]["id"]
+
+        streams_data[stream["name"]] = dict(
+            id=stream["stream_id"],
+            latest_id=latest_id,
+            topic_data=topic_data,
+        )
+
+    dump_stream_index(
+        json_root,
+        dict(streams=streams_data, time=time.time()),
+        cache_format,
+        cache_compression,
+    )
+
+    return dict(
+        streams=num_streams,
+        topics=num_streams * num_topics,
+        messages=msg_id,
+        largest_topic=max(sizes),
+    )
+
+
+class FakeClient:
+    """
+    A stand-in for zulip.Client that serves new messages for
+    the streams created by `generate_cache`, so we can time
+    `populate_incremental` without a network connection.
+
+    New messages go to the most recent topics of each stream,
+    plus one brand new topic per stream.
+    """
+
+    def __init__(self, shape, new_messages_per_stream, first_id, first_timestamp):
+        rng = random.Random(shape["seed"] + 1)
+        self.streams = [synthetic_stream(i) for i in range(shape["streams"])]
+        self.messages = {}
+        msg_id = first_id
+        for stream_index, stream in enumerate(self.streams):
+            msgs = []
+            for i in range(new_messages_per_stream):
+                msg_id += 1
+                if i % 10 == 9:
+                    subject = f"new topic {stream_index}"
+                else:
+                    subject = topic_name(stream_index, i % 3)
+                timestamp = first_timestamp + (msg_id - first_id) * SECONDS_PER_MESSAGE
+                msg = synthetic_message(rng, shape, msg_id, timestamp)
+                msg["subject"] = subject
+                msgs.append(msg)
+            self.messages[stream["name"]] = msgs
+
+    def get_streams(self, **kwargs):
+        return dict(result="success", streams=self.streams)
+
+    def get_messages(self, request):
+        stream_name = request["narrow"][0]["operand"]
+        anchor = request["anchor"]
+        num_after = request["num_after"]
+        msgs = [m for m in self.messages.get(stream_name, []) if m["id"] >= anchor]
+        batch = msgs[:num_after]
+        return dict(
+            result="success",
+            messages=batch,
+            found_newest=len(batch) == len(msgs),
+        )
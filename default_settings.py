@@ -9,7 +9,6 @@
 # are in your Python path.
 
 import os
-import yaml
 from pathlib import Path
 
 """
@@ -48,6 +47,14 @@ else:
     zulip_icon_url = os.getenv("ZULIP_ICON_URL", None)
 
 
+"""
+Set the URL of your Zulip organization.  By default we read it
+from the `site` field of your zuliprc, but setting it here (or via
+ZULIP_URL) lets you build the website (`archive.py -b`) on a machine
+that has no zuliprc.
+"""
+zulip_url = os.getenv("ZULIP_URL")
+
 """
 Set the HTML title of your Zulip archive here.
 """
@@ -74,6 +81,27 @@ you may prefer another directory structure.
 
 json_directory = Path(os.getenv("JSON_DIRECTORY", "../zulip_json"))
 
+"""
+How to encode the files in json_directory.  The default, "json",
+is indented JSON that is easy to read and diff.  For big archives,
+"compact-json" is about half the size, "orjson" is compact and much
+faster to write (pip3 install orjson), and "msgpack" is smaller and
+faster still (pip3 install msgpack).
+
+You can change this at any time; we detect the format of each file
+when we read it, and files get rewritten in the new format as they
+get updated.
+"""
+cache_format = os.getenv("CACHE_FORMAT", "json")
+
+"""
+Optionally compress every file in json_directory, with "gzip" or
+"zstd" (pip3 install zstandard).  zstd is a lot faster than gzip at
+about the same size.  As with cache_format, you can change this at
+any time.
+"""
+cache_compression = os.getenv("CACHE_COMPRESSION") or None
+
 """
 We write HTML to here.
 """
@@ -143,20 +171,43 @@ excluded:
   - checkins
   - development help
 
+We read `streams.yaml` from the current directory.  (With --orgs,
+from the directory of each organization's settings file; see
+lib/orgs.py.)
 """
+streams_yaml = "streams.yaml"
 
-try:
-    with open("streams.yaml") as f:
-        streams = yaml.load(f, Loader=yaml.BaseLoader)
-        if "included" not in streams or not streams["included"]:
-            raise Exception(
-                "Please specify the streams to be included under `included` section in streams.yaml file"
-            )
-        included_streams = streams["included"]
 
-        excluded_streams = []
-        if "excluded" in streams and streams["excluded"]:
-            excluded_streams = streams["excluded"]
+def load_streams_yaml():
+    # We import yaml here (rather than at the top), since only
+    # fetching from Zulip needs streams.yaml.
+    import yaml
 
-except FileNotFoundError:
-    raise Exception("Missing streams.yaml file")
+    try:
+        with open(streams_yaml) as f:
+            streams = yaml.load(f, Loader=yaml.BaseLoader)
+            if "included" not in streams or not streams["included"]:
+                raise Exception(
+                    "Please specify the streams to be included under `included` section in streams.yaml file"
+                )
+            included_streams = streams["included"]
+
+            excluded_streams = []
+            if "excluded" in streams and streams["excluded"]:
+                excluded_streams = streams["excluded"]
+
+    except FileNotFoundError:
+        raise Exception(f"Missing streams.yaml file ({streams_yaml})")
+
+    return included_streams, excluded_streams
+
+
+def __getattr__(name):
+    # streams.yaml is read the first time somebody asks for
+    # included_streams or excluded_streams, so that building the
+    # website doesn't need it.
+    if name in ("included_streams", "excluded_streams"):
+        global included_streams, excluded_streams
+        included_streams, excluded_streams = load_streams_yaml()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
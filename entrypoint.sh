@@ -10,6 +10,7 @@ archive_branch=$6
 github_personal_access_token=$7
 zuliprc=$INPUT_ZULIPRC
 site_url=$INPUT_SITE_URL
+json_snapshot=${INPUT_JSON_SNAPSHOT:-false}
 
 github_personal_access_token=${github_personal_access_token:-NOT_SET}
 
@@ -28,6 +29,7 @@ git config --global --add safe.directory "$GITHUB_WORKSPACE"
 checked_out_repo_path="$(pwd)"
 html_dir_path=$checked_out_repo_path
 json_dir_path="${checked_out_repo_path}/zulip_json"
+snapshot_path="${checked_out_repo_path}/zulip_json.zip"
 img_dir_path="${checked_out_repo_path}/assets/img"
 streams_config_file_path="${checked_out_repo_path}/streams.yaml"
 initial_sha="$(git rev-parse HEAD)"
@@ -86,19 +88,33 @@ export JSON_DIRECTORY=$json_dir_path
 export HTML_ROOT=""
 export ZULIP_ICON_URL="${site_url}/assets/img/zulip.svg"
 
-if [ ! -d $json_dir_path ]; then
+if [ -f $snapshot_path ]; then
+    # The JSON cache is kept as a single snapshot file (see
+    # instructions.md), so we only write out the files that change,
+    # and fold them back into the snapshot.
     mkdir -p $json_dir_path
+    python3 archive.py -i -b --snapshot $snapshot_path --pack-snapshot $snapshot_path
+    rm -rf $json_dir_path
+else
+    if [ ! -d $json_dir_path ]; then
+        mkdir -p $json_dir_path
 
-    mkdir -p $img_dir_path
-    cp assets/img/* $img_dir_path
+        mkdir -p $img_dir_path
+        cp assets/img/* $img_dir_path
 
-    python3 archive.py -t
-else
-    python3 archive.py -i
-fi
+        python3 archive.py -t
+    else
+        python3 archive.py -i
+    fi
 
+    python3 archive.py -b
 
-python3 archive.py -b
+    if [[ "$json_snapshot" == "true" ]]; then
+        # Switch over to a snapshot; later runs take the branch above.
+        python3 archive.py --pack-snapshot $snapshot_path
+        rm -rf $json_dir_path
+    fi
+fi
 
 cd ${checked_out_repo_path}
 
@@ -0,0 +1,330 @@
+"""
+This module decides how the files in the JSON cache (see
+lib/files.py for the layout) are encoded on disk.
+
+We support a few formats, selected by `cache_format` in settings.py:
+
+    json:          indented JSON with sorted keys.  This is the
+                   default, and what older versions always wrote.
+                   It's easy to read and diff, but it's big.
+    compact-json:  JSON without the whitespace (roughly half the size).
+    orjson:        compact JSON, written with the orjson library,
+                   which is several times faster than the json module.
+    msgpack:       MessagePack, which is smaller still and faster to
+                   parse.  Requires the msgpack library.
+
+File names do not depend on the format (topic files are always
+<topic>.json), and readers detect the format from the first byte
+of each file, so you can switch formats at any time: old files keep
+working, and files get rewritten in the new format as they get
+updated.
+
+If orjson is installed, we use it to parse JSON files no matter which
+format is selected, since it's just faster.
+
+Independently of the format, files can be compressed, selected by
+`cache_compression` in settings.py:
+
+    None:  no compression (the default)
+    gzip:  gzip, from the standard library
+    zstd:  Zstandard, which is much faster than gzip at a similar
+           ratio.  Requires the zstandard library.
+
+Compression is detected from the file's magic bytes, just like the
+format, and we decompress as we read, so a compressed topic is never
+held in memory in both its compressed and uncompressed forms.
+
+Topic files can get big, so `iter_file` lets you go through the
+messages in one without loading all of them at once.
+"""
+
+import codecs
+import gzip
+import io
+import json
+from contextlib import contextmanager
+
+from .common import exit_immediately
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ["json", "compact-json", "orjson", "msgpack"]
+
+COMPRESSIONS = [None, "gzip", "zstd"]
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# zstd level 3 is the library default, and a good speed/size
+# trade-off; gzip's default of 9 is slow for little gain, so we
+# use 6 like the gzip command line tool does.
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# JSON files start with a container (possibly after whitespace),
+# while MessagePack arrays and maps start with bytes in the
+# 0x80-0x9f or 0xdc-0xdf ranges, so the first byte is enough
+# to tell them apart.
+JSON_FIRST_BYTES = b"[{ \t\r\n"
+
+# `iter_file` parses JSON files smaller than this in one go (which is
+# faster, especially with orjson), and bigger ones an item at a time,
+# reading CHUNK_SIZE bytes at a time.
+STREAM_THRESHOLD = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+JSON_WHITESPACE = " \t\r\n"
+
+MISSING_LIBRARY_ERROR = """
+The {0} cache format needs the {0} library, which is not installed.
+
+Please run the below command:
+
+pip3 install {0}"""
+
+MSGPACK_CACHE_ERROR = """
+Some of your cache files are in the msgpack format, but the
+msgpack library is not installed.
+
+Please run the below command:
+
+pip3 install msgpack"""
+
+ZSTD_CACHE_ERROR = """
+Some of your cache files are compressed with zstd, but the
+zstandard library is not installed.
+
+Please run the below command:
+
+pip3 install zstandard"""
+
+
+def check_format(cache_format):
+    if cache_format not in FORMATS:
+        exit_immediately(
+            f"Unknown cache_format {cache_format!r}; use one of: {', '.join(FORMATS)}"
+        )
+    if cache_format == "orjson" and orjson is None:
+        exit_immediately(MISSING_LIBRARY_ERROR.format("orjson"))
+    if cache_format == "msgpack" and msgpack is None:
+        exit_immediately(MISSING_LIBRARY_ERROR.format("msgpack"))
+
+
+def check_compression(compression):
+    if compression not in COMPRESSIONS:
+        exit_immediately(
+            f"Unknown cache_compression {compression!r}; use None, gzip or zstd"
+        )
+    if compression == "zstd" and zstandard is None:
+        exit_immediately(ZSTD_CACHE_ERROR)
+
+
+def dumps(js, cache_format):
+    """
+    Returns the encoded bytes for `js`.
+    """
+    if cache_format == "json":
+        return json.dumps(js, ensure_ascii=False, sort_keys=True, indent=4).encode(
+            "utf-8"
+        )
+    if cache_format == "compact-json":
+        return json.dumps(
+            js, ensure_ascii=False, sort_keys=True, separators=(",", ":")
+        ).encode("utf-8")
+    if cache_format == "orjson":
+        return orjson.dumps(js, option=orjson.OPT_SORT_KEYS)
+    if cache_format == "msgpack":
+        return msgpack.packb(js, use_bin_type=True)
+    raise Exception("programming error")
+
+
+def is_json(data):
+    return data[:1] in JSON_FIRST_BYTES
+
+
+def decompress(data):
+    if data.startswith(GZIP_MAGIC):
+        return gzip.decompress(data)
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            exit_immediately(ZSTD_CACHE_ERROR)
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def loads(data):
+    """
+    Decodes bytes written by `dump_file`, in any format and with
+    any compression.
+    """
+    data = decompress(data)
+    if is_json(data):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data.decode("utf-8"))
+
+    if msgpack is None:
+        exit_immediately(MSGPACK_CACHE_ERROR)
+    return msgpack.unpackb(data, raw=False)
+
+
+@contextmanager
+def open_cache_file(path):
+    """
+    Opens a cache file for reading, and yields a binary file object
+    with its decompressed contents.  The file object supports peek().
+    """
+    with path.open("rb") as f:
+        magic = f.peek(4)[:4]
+        if magic.startswith(GZIP_MAGIC):
+            with gzip.GzipFile(fileobj=f, mode="rb") as gz:
+                yield gz
+        elif magic == ZSTD_MAGIC:
+            if zstandard is None:
+                exit_immediately(ZSTD_CACHE_ERROR)
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            with io.BufferedReader(reader) as zf:
+                yield zf
+        else:
+            yield f
+
+
+def load_stream(f):
+    if is_json(f.peek(1)):
+        # Both JSON parsers need the whole document in memory.
+        data = f.read()
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+    if msgpack is None:
+        exit_immediately(MSGPACK_CACHE_ERROR)
+    # max_buffer_size=0 means "no limit"; the default of 100MB is
+    # smaller than some of the topics out there.
+    unpacker = msgpack.Unpacker(f, raw=False, max_buffer_size=0)
+    return unpacker.unpack()
+
+
+def load_file(path):
+    with open_cache_file(path) as f:
+        return load_stream(f)
+
+
+def iter_stream(f):
+    """
+    Yields the items of the array in `f` (as opened by
+    `open_cache_file`) one at a time.
+    """
+    if not is_json(f.peek(1)):
+        if msgpack is None:
+            exit_immediately(MSGPACK_CACHE_ERROR)
+        unpacker = msgpack.Unpacker(f, raw=False, max_buffer_size=0)
+        for _ in range(unpacker.read_array_header()):
+            yield unpacker.unpack()
+        return
+
+    head = f.read(STREAM_THRESHOLD)
+    if len(head) < STREAM_THRESHOLD:
+        # We have the whole file already.
+        yield from (orjson.loads(head) if orjson is not None else json.loads(head))
+        return
+
+    yield from iter_json_array(head, f)
+
+
+def iter_json_array(head, f):
+    """
+    Parses a JSON array that starts with the bytes in `head` and
+    continues in `f`, yielding each item as soon as we have seen all
+    of it.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = utf8.decode(head)
+    pos = 0
+    eof = False
+    started = False
+    num_items = 0
+    need_item = True
+
+    while True:
+        while pos < len(buf) and buf[pos] in JSON_WHITESPACE:
+            pos += 1
+
+        need_more = pos == len(buf)
+        if not need_more:
+            c = buf[pos]
+            if not started:
+                if c != "[":
+                    raise ValueError("expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if c == "]" and (num_items == 0 or not need_item):
+                return
+            if not need_item:
+                if c != ",":
+                    raise ValueError(f"expected , or ] in JSON array, got {c!r}")
+                need_item = True
+                pos += 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # A number at the very end of buf might go on in
+                # the next chunk.
+                need_more = end == len(buf) and not eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                need_more = True
+            if not need_more:
+                yield item
+                num_items += 1
+                need_item = False
+                pos = end
+                continue
+
+        if eof:
+            raise ValueError("truncated JSON array")
+        chunk = f.read(CHUNK_SIZE)
+        eof = not chunk
+        buf = buf[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+
+def iter_file(path):
+    with open_cache_file(path) as f:
+        yield from iter_stream(f)
+
+
+def dump_file(js, outfile, cache_format, compression=None):
+    """
+    `outfile` must be opened in binary mode.
+    """
+    data = dumps(js, cache_format)
+    if compression == "gzip":
+        # We set filename and mtime, so that the same data always
+        # compresses to the same bytes (which keeps git diffs quiet).
+        with gzip.GzipFile(
+            filename="", mode="wb", fileobj=outfile, compresslevel=GZIP_LEVEL, mtime=0
+        ) as gz:
+            gz.write(data)
+    elif compression == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        with compressor.stream_writer(outfile, size=len(data), closefd=False) as zf:
+            zf.write(data)
+    else:
+        outfile.write(data)
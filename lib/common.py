@@ -1,4 +1,17 @@
 import os
+import shutil
+import threading
+from pathlib import Path
+
+# Files written by open_outfile that haven't been moved into place
+# yet (final path -> temp path); see `durability_barrier`.  (Pages
+# can get written from several threads; see lib/pipeline.py.)
+_pending = {}
+_pending_lock = threading.Lock()
+
+# We don't let too many files pile up between barriers (a big build
+# writes a page per topic).
+MAX_PENDING = 10000
 
 
 def exit_immediately(s):
@@ -6,11 +19,162 @@ def exit_immediately(s):
     exit(1)
 
 
-# Safely open dir/filename, creating dir if it doesn't exist
+# Safely open dir/filename, creating dir if it doesn't exist.
+# Text modes use utf-8; pass a binary mode like "wb" for bytes.
+#
+# We actually write to a temp file next to dir/filename, which
+# replaces dir/filename at the next `durability_barrier` after you
+# close it, so a crash (or a ^C) never leaves a half-written file
+# behind.
+#
+# (If dir is in an output sink, like a tar file, the file goes in
+# there instead; see lib/files.py.)
 def open_outfile(dir, filename, mode):
-    if not dir.exists():
-        os.makedirs(str(dir))
-    return (dir / filename).open(mode, encoding="utf-8")
+    if hasattr(dir, "open_outfile"):
+        return dir.open_outfile(filename, mode)
+    os.makedirs(dir, exist_ok=True)
+    return AtomicOutfile(dir / filename, mode)
+
+
+class AtomicOutfile:
+    def __init__(self, path, mode):
+        self.path = path
+        self.tmp_path = path.with_name("." + path.name + ".tmp")
+        if "b" in mode:
+            self._file = self.tmp_path.open(mode)
+        else:
+            self._file = self.tmp_path.open(mode, encoding="utf-8")
+
+    def __getattr__(self, attr):
+        # write, flush, name (the temp file's), etc.
+        return getattr(self._file, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._file.closed:
+            return
+        # The barrier below can move the temp file, so we take its
+        # size (for lib/metrics.py) now.
+        self._file.flush()
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._file.close()
+        # (keyed by the path's string, since paths like lib/snapshot.py's
+        # SnapshotPath don't compare equal to each other)
+        with _pending_lock:
+            _pending[os.fspath(self.path)] = self.tmp_path
+            full = len(_pending) >= MAX_PENDING
+        if full:
+            durability_barrier()
+
+
+def copy_outfile(src, dst):
+    """
+    Like shutil.copyfile, but goes through `open_outfile`.  (You can
+    pass it as copytree's copy_function.)
+    """
+    if isinstance(dst, str):
+        dst = Path(dst)
+    out = open_outfile(dst.parent, dst.name, "wb")
+    with open(src, "rb") as f:
+        shutil.copyfileobj(f, out)
+    out.close()
+    return dst
+
+
+def copy_outfiles(src_dir, dst_dir):
+    """
+    Copies the files in src_dir into dst_dir, like copytree with
+    `copy_outfile`, except that directories only get made by
+    `open_outfile` (so dst_dir can be in an output sink).
+    """
+    for dir_path, _, filenames in os.walk(src_dir):
+        rel_dir = Path(dir_path).relative_to(src_dir)
+        for filename in filenames:
+            copy_outfile(Path(dir_path) / filename, dst_dir / rel_dir / filename)
+
+
+def durability_barrier():
+    """
+    Moves every file closed since the last barrier into place, making
+    sure its contents are on disk first, so that even a power failure
+    can't leave us with a truncated file.
+
+    We do the syncing in batches here, rather than as each file gets
+    closed, because a run writes thousands of small files: by the
+    time we fsync them, most of their data is usually on its way to
+    disk already, and each directory only gets synced once per batch.
+    We still fsync each file, on purpose, rather than syncing the
+    whole file system once: Python's os module has no syncfs (and
+    os.sync would flush every file system on the machine), syncfs
+    flushes whatever else is dirty on that file system too, and Linux
+    before 5.8 doesn't tell syncfs's caller about write errors, which
+    would defeat the point of the barrier.
+
+    Call this before writing anything that refers to files you have
+    written (like stream_index.json), and at the end of each phase;
+    files that never get here are left as temp files, and the old
+    versions stay put.
+    """
+    with _pending_lock:
+        if not _pending:
+            return
+        pending = list(_pending.items())
+        _pending.clear()
+
+    for _, tmp_path in pending:
+        fsync_path(tmp_path)
+
+    for path, tmp_path in pending:
+        os.replace(tmp_path, path)
+
+    # And now make the renames themselves durable.
+    for directory in {os.path.dirname(path) for path, _ in pending}:
+        fsync_dir(directory)
+
+
+def is_temp_file(filename):
+    """
+    Whether `filename` is an `open_outfile` temp file.
+    """
+    return filename.startswith(".") and filename.endswith(".tmp")
+
+
+def remove_temp_files(root):
+    """
+    Deletes the temp files under `root` that a crashed (or ^C'ed) run
+    left behind, before they could be moved into place.  Call this
+    before writing anything there.
+    """
+    if hasattr(root, "open_outfile") or not os.path.isdir(root):
+        return
+    for dir_path, _, filenames in os.walk(root):
+        for filename in filenames:
+            if is_temp_file(filename):
+                os.remove(os.path.join(dir_path, filename))
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path):
+    # (Windows can't open a directory to fsync it.)
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 def stream_validator(settings):
@@ -6,3 +6,18 @@ from datetime import datetime
 def format_date1(ts):
     """Nov 05 2019 at 02:51"""
     return datetime.utcfromtimestamp(ts).strftime("%b %d %Y at %H:%M")
+
+
+def format_date_rfc3339(ts):
+    """2019-11-05T02:51:00Z (for Atom feeds)"""
+    return datetime.utcfromtimestamp(ts).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def format_month(month):
+    """2019/11 -> November 2019"""
+    return datetime.strptime(month, "%Y/%m").strftime("%B %Y")
+
+
+def format_day(ts):
+    """2019-11-05"""
+    return datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d")
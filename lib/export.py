@@ -0,0 +1,292 @@
+"""
+Loading the JSON cache into pandas by hand means reading every
+topic file and building one big list of dicts.  Instead:
+
+    python3 archive.py --export messages.parquet
+
+writes a table with one row per message, with these columns:
+
+    id              message id
+    stream          stream name
+    topic           topic name
+    sender          sender's full name
+    timestamp       when it was sent (UTC)
+    content_length  length of the (HTML) content
+
+as Parquet (for a .parquet file), or in the Arrow IPC file format
+(for anything else, like .arrow or .feather), both of which pandas,
+polars, DuckDB, etc. read directly.  We only hold CHUNK_ROWS
+messages in memory at a time.  This needs pyarrow (pip3 install
+pyarrow).
+
+And for quick numbers:
+
+    python3 archive.py --stats messages.parquet --period month
+
+prints how many messages (and how much content) each stream has,
+and how many messages there were each month (or day, or year),
+and saves the volume of each stream in each period as JSON with
+--stats-file.  This reads the table in batches, and does the
+counting with NumPy (pip3 install numpy).
+"""
+
+import json
+from pathlib import Path
+
+from .common import exit_immediately
+from .files import (
+    iter_zulip_messages_for_topic,
+    read_zulip_stream_info,
+    read_zulip_topic_data,
+)
+from .url import sanitize, sanitize_stream
+
+# pyarrow and numpy take a while to import, and nothing but --export
+# and --stats needs them, so `load_pyarrow` and `load_numpy` import
+# them when we get there.
+pyarrow = None
+numpy = None
+
+PYARROW_ERROR = """
+Exporting the cache needs the pyarrow library.
+
+Please run the below command:
+
+pip3 install pyarrow"""
+
+NUMPY_ERROR = """
+--stats needs the numpy library.
+
+Please run the below command:
+
+pip3 install numpy"""
+
+CHUNK_ROWS = 1 << 16
+
+# numpy datetime64 units
+PERIODS = dict(day="D", month="M", year="Y")
+
+
+def load_pyarrow():
+    global pyarrow
+    if pyarrow is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        exit_immediately(PYARROW_ERROR)
+
+
+def load_numpy():
+    global numpy
+    if numpy is not None:
+        return
+    try:
+        import numpy
+    except ImportError:
+        exit_immediately(NUMPY_ERROR)
+
+
+def schema():
+    return pyarrow.schema(
+        [
+            ("id", pyarrow.int64()),
+            ("stream", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ("topic", pyarrow.string()),
+            ("sender", pyarrow.string()),
+            ("timestamp", pyarrow.timestamp("s", tz="UTC")),
+            ("content_length", pyarrow.int32()),
+        ]
+    )
+
+
+def is_parquet(path):
+    return Path(path).suffix == ".parquet"
+
+
+def iter_message_rows(json_root, streams):
+    """
+    Yields a tuple per message, with the columns in `schema`, except
+    that the stream is its position in `streams`.
+    """
+    for stream_number, (stream_name, stream_data) in enumerate(streams.items()):
+        topic_data = read_zulip_topic_data(json_root, stream_name, stream_data)
+        sanitized_stream_name = sanitize_stream(stream_name, stream_data["id"])
+        for topic_name in topic_data:
+            for msg in iter_zulip_messages_for_topic(
+                json_root, sanitized_stream_name, sanitize(topic_name)
+            ):
+                yield (
+                    msg["id"],
+                    stream_number,
+                    topic_name,
+                    msg["sender_full_name"],
+                    msg["timestamp"],
+                    len(msg["content"]),
+                )
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_cache(json_root, out_path, chunk_rows=CHUNK_ROWS):
+    load_pyarrow()
+
+    out_path = Path(out_path)
+    tmp_path = out_path.with_name("." + out_path.name + ".tmp")
+    table_schema = schema()
+    if is_parquet(out_path):
+        writer = pyarrow.parquet.ParquetWriter(tmp_path, table_schema)
+    else:
+        writer = pyarrow.ipc.new_file(tmp_path, table_schema)
+
+    streams = read_zulip_stream_info(json_root)["streams"]
+    # Every batch uses the same dictionary of stream names (which the
+    # Arrow file format insists on).
+    stream_names = pyarrow.array(list(streams), type=pyarrow.string())
+
+    num_rows = 0
+    with writer:
+        for chunk in chunks(iter_message_rows(json_root, streams), chunk_rows):
+            columns = [
+                pyarrow.array(column, type=field.type)
+                for column, field in zip(zip(*chunk), table_schema)
+                if field.name != "stream"
+            ]
+            stream_column = pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array([row[1] for row in chunk], type=pyarrow.int32()),
+                stream_names,
+            )
+            columns.insert(1, stream_column)
+            batch = pyarrow.record_batch(columns, schema=table_schema)
+            writer.write_batch(batch)
+            num_rows += len(chunk)
+            print(f"exported {num_rows} messages")
+    # Like open_outfile, we only put the file in place once it's done.
+    tmp_path.replace(out_path)
+    print(f"wrote {num_rows} messages to {out_path}")
+
+
+def iter_batches(path, columns):
+    load_pyarrow()
+    if is_parquet(path):
+        yield from pyarrow.parquet.ParquetFile(path).iter_batches(columns=columns)
+        return
+    reader = pyarrow.ipc.open_file(path)
+    for i in range(reader.num_record_batches):
+        yield reader.get_batch(i).select(columns)
+
+
+def stream_codes(batch, stream_numbers):
+    """
+    Returns the stream of each row in `batch` as a number, from
+    `stream_numbers` (a dict mapping stream names to numbers, which we
+    add new streams to).
+    """
+    streams = batch.column("stream")
+    if not pyarrow.types.is_dictionary(streams.type):
+        streams = pyarrow.compute.dictionary_encode(streams)
+    lookup = numpy.array(
+        [
+            stream_numbers.setdefault(name, len(stream_numbers))
+            for name in streams.dictionary.to_pylist()
+        ],
+        dtype=numpy.int64,
+    )
+    return lookup[streams.indices.to_numpy(zero_copy_only=False)]
+
+
+def cache_stats(path, period="month"):
+    """
+    Returns message counts and content sizes per stream, per period,
+    and per (stream, period), from a file written by `export_cache`.
+    """
+    load_pyarrow()
+    load_numpy()
+
+    unit = PERIODS[period]
+    stream_numbers = {}
+    # (stream number, period) -> [messages, content length]
+    volumes = {}
+    for batch in iter_batches(path, ["stream", "timestamp", "content_length"]):
+        if batch.num_rows == 0:
+            continue
+        codes = stream_codes(batch, stream_numbers)
+        periods = (
+            batch.column("timestamp")
+            .to_numpy(zero_copy_only=False)
+            .astype(f"datetime64[{unit}]")
+            .astype(numpy.int64)
+        )
+        lengths = batch.column("content_length").to_numpy(zero_copy_only=False)
+
+        # Count each (stream, period) pair in the batch at once.
+        keys = numpy.stack([codes, periods], axis=1)
+        pairs, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = numpy.bincount(inverse, minlength=len(pairs))
+        sizes = numpy.bincount(inverse, weights=lengths, minlength=len(pairs))
+        for (code, p), count, size in zip(
+            pairs.tolist(), counts.tolist(), sizes.tolist()
+        ):
+            volume = volumes.setdefault((code, p), [0, 0])
+            volume[0] += count
+            volume[1] += int(size)
+
+    def period_name(p):
+        return str(numpy.datetime64(p, unit))
+
+    stream_names = {number: name for name, number in stream_numbers.items()}
+    by_stream = {}
+    by_period = {}
+    by_stream_period = {}
+    for (code, p), (count, size) in sorted(
+        volumes.items(), key=lambda item: item[0][1]
+    ):
+        stream_name = stream_names[code]
+        name = period_name(p)
+        for totals, key in [(by_stream, stream_name), (by_period, name)]:
+            total = totals.setdefault(key, dict(messages=0, content_length=0))
+            total["messages"] += count
+            total["content_length"] += size
+        by_stream_period.setdefault(stream_name, {})[name] = dict(
+            messages=count, content_length=size
+        )
+    return dict(
+        period=period,
+        streams=by_stream,
+        periods=by_period,
+        stream_periods=by_stream_period,
+    )
+
+
+def print_stats(path, period="month", stats_file=None):
+    stats = cache_stats(path, period)
+
+    print(f"\n{'stream':40} {'messages':>10} {'content':>14}")
+    for stream_name, total in sorted(
+        stats["streams"].items(), key=lambda item: -item[1]["messages"]
+    ):
+        print(
+            f"{stream_name[:40]:40} {total['messages']:>10} {total['content_length']:>14}"
+        )
+
+    print(f"\n{period:40} {'messages':>10} {'content':>14}")
+    for name, total in stats["periods"].items():
+        print(f"{name:40} {total['messages']:>10} {total['content_length']:>14}")
+
+    if stats_file is not None:
+        with open(stats_file, "w") as f:
+            json.dump(stats, f, indent=2)
+        print(f"\nwrote {stats_file}")
@@ -0,0 +1,212 @@
+"""
+Atom feeds of the newest messages, so that people (and feed
+readers) can see what's new without fetching the big stream pages.
+The build writes one feed per stream, and one for the whole site:
+
+    <md_root>
+        feed.xml
+        stream
+            213222-general
+                feed.xml
+
+Each feed has the newest FEED_SIZE messages.  To find them, we only
+look at the FEED_SIZE most recently updated topics (which we pick
+with a heap; see `recent_topics`), since no other topic can have one
+of the newest messages, and merge the ends of those topics.
+
+feeds.json remembers the `latest_id` of each stream as of the last
+time we wrote its feed, so we only rewrite the feeds of streams
+that got new messages since, and the site-wide feed if any of them
+did.
+"""
+
+import heapq
+import html
+import itertools
+import json
+import urllib.parse
+from collections import deque
+
+from .cache_format import load_file
+from .common import open_outfile
+from .date_helper import format_date_rfc3339
+from .files import iter_zulip_messages_for_topic
+from .uploads import rewrite_uploads
+from .url import (
+    archive_message_url,
+    archive_stream_url,
+    archive_uploads_url,
+    sanitize,
+    sanitize_stream,
+)
+from .zulip_data import merge_recent_topics
+from . import metrics
+
+FEED_SIZE = 50
+FEED_FILE = "feed.xml"
+STATE_FILE = "feeds.json"
+
+
+def read_feed_state(md_root):
+    path = md_root / STATE_FILE
+    if not path.exists():
+        return {}
+    return load_file(path)
+
+
+def write_feed_state(md_root, state):
+    out = open_outfile(md_root, STATE_FILE, "w")
+    json.dump(state, out, indent=2, sort_keys=True)
+    out.close()
+
+
+def newest_messages(json_root, topics, k):
+    """
+    `topics` is a list of (stream_name, stream_id, topic_name).
+    Returns the k newest messages in them, newest first, as
+    (stream_name, stream_id, topic_name, message).
+    """
+    tails = []
+    for stream_name, stream_id, topic_name in topics:
+        messages = iter_zulip_messages_for_topic(
+            json_root, sanitize_stream(stream_name, stream_id), sanitize(topic_name)
+        )
+        # Topics are in id order, and we only hold on to the last k.
+        tail = deque(messages, maxlen=k)
+        tails.append(
+            [
+                (msg["id"], stream_name, stream_id, topic_name, msg)
+                for msg in reversed(tail)
+            ]
+        )
+    newest = heapq.merge(*tails, key=lambda entry: entry[0], reverse=True)
+    return [entry[1:] for entry in itertools.islice(newest, k)]
+
+
+def atom_entry_xml(site_url, html_root, zulip_url, uploads, entry):
+    stream_name, stream_id, topic_name, msg = entry
+    url = archive_message_url(
+        site_url,
+        html_root,
+        sanitize_stream(stream_name, stream_id),
+        sanitize(topic_name),
+        msg["id"],
+    )
+    content = msg["content"]
+    if uploads:
+        content = rewrite_uploads(
+            content, uploads, archive_uploads_url(site_url, html_root)
+        )
+    sender = msg["sender_full_name"]
+    # Message content has links relative to the Zulip server.
+    return f"""\
+<entry>
+<title>{html.escape(sender)} in {html.escape(stream_name)} &gt; {html.escape(topic_name)}</title>
+<id>{html.escape(url)}</id>
+<link href="{html.escape(url)}"/>
+<updated>{format_date_rfc3339(msg["timestamp"])}</updated>
+<author><name>{html.escape(sender)}</name></author>
+<content type="html" xml:base="{html.escape(zulip_url)}">{html.escape(content)}</content>
+</entry>
+"""
+
+
+def atom_feed_xml(
+    feed_title, page_url, feed_url, site_url, html_root, zulip_url, uploads, entries
+):
+    # We use the newest message's time, rather than the time of the
+    # build, so that a feed with nothing new stays the same.
+    updated = entries[0][3]["timestamp"] if entries else 0
+    entries_xml = "".join(
+        atom_entry_xml(site_url, html_root, zulip_url, uploads, entry)
+        for entry in entries
+    )
+    return f"""\
+<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<title>{html.escape(feed_title)}</title>
+<id>{html.escape(feed_url)}</id>
+<link href="{html.escape(page_url)}"/>
+<link rel="self" href="{html.escape(feed_url)}"/>
+<updated>{format_date_rfc3339(updated)}</updated>
+{entries_xml}</feed>
+"""
+
+
+def write_feed(directory, feed_xml):
+    outfile = open_outfile(directory, FEED_FILE, "w")
+    outfile.write(feed_xml)
+    outfile.close()
+    metrics.record_file(outfile)
+
+
+def write_stream_feed(
+    json_root,
+    md_root,
+    site_url,
+    html_root,
+    title,
+    zulip_url,
+    stream_name,
+    stream_id,
+    recent,
+    uploads=None,
+):
+    """
+    `recent` is the stream's `recent_topics`.
+    """
+    sanitized_stream_name = sanitize_stream(stream_name, stream_id)
+    topics = [(stream_name, stream_id, topic_name) for _, topic_name in recent]
+    page_url = archive_stream_url(site_url, html_root, sanitized_stream_name)
+    feed_url = page_url[: -len("index.html")] + FEED_FILE
+    write_feed(
+        md_root / "stream" / sanitized_stream_name,
+        atom_feed_xml(
+            f"{stream_name} · {title}",
+            page_url,
+            feed_url,
+            site_url,
+            html_root,
+            zulip_url,
+            uploads,
+            newest_messages(json_root, topics, FEED_SIZE),
+        ),
+    )
+
+
+def write_site_feed(
+    json_root,
+    md_root,
+    site_url,
+    html_root,
+    title,
+    zulip_url,
+    streams,
+    recent_by_stream,
+    uploads=None,
+):
+    """
+    `recent_by_stream` maps stream names to their `recent_topics`
+    (with at least FEED_SIZE topics, if they have that many).
+    """
+    topics = [
+        (stream_name, streams[stream_name]["id"], topic_name)
+        for _, stream_name, topic_name in merge_recent_topics(
+            recent_by_stream, FEED_SIZE
+        )
+    ]
+    page_url = urllib.parse.urljoin(site_url, html_root) + "/index.html"
+    feed_url = page_url[: -len("index.html")] + FEED_FILE
+    write_feed(
+        md_root,
+        atom_feed_xml(
+            title,
+            page_url,
+            feed_url,
+            site_url,
+            html_root,
+            zulip_url,
+            uploads,
+            newest_messages(json_root, topics, FEED_SIZE),
+        ),
+    )
@@ -10,6 +10,9 @@ Here is an example structure for the JSON piece:
 
     <json_root>
         stream_index.json
+        stream_index
+            213222general.json
+            213224python.json
         213222general
             47413hello.json
             48863swimmingturtles.json
@@ -54,30 +57,100 @@ with spaces (hence the number prefix).  FWIW the number prefix
 for streams corresponds to the Zulip stream id, whereas the topic
 prefix is a random hash.  All that really matters is that they are
 unique.
-"""
 
-import json
+stream_index.json is a small manifest listing the streams, and the
+per-topic info for each stream lives in its own file under
+stream_index/, so that an incremental update only rewrites the
+files for streams that got new messages, and the build only has
+to load one stream's topic info at a time.  (Older caches have all
+the topic info inline in stream_index.json; we still read those,
+and `populate_incremental` converts them the next time it runs.)
+
+The website doesn't have to be a directory: with
+
+    python3 archive.py -b --bundle website.tar.gz
+
+the build writes every page straight into one tar (or zip) file,
+which is what you'd upload anyway, and never creates a file or
+directory per page.  For that, `open_sink` gives you an md_root
+(a `SinkPath`) that `open_outfile` writes into the archive.  The
+archive is written as we go, so we only ever hold one page in
+memory; it's put in place by `OutputSink.close` once it's done.
+"""
 
+import io
+import os
+import posixpath
+import tarfile
+import time
+import zipfile
 from pathlib import Path
 
-from .common import open_outfile
+from .cache_format import iter_file, load_file
+from .common import exit_immediately, fsync_path, open_outfile
+from .timing import phase
+from .url import sanitize_stream
 
 
 def read_zulip_stream_info(json_root):
     """
     stream_index.json
 
-    This JSON goes two levels deep, showing every stream, and
-    then within each stream, a bit of info for every topic in
-    the stream.  To get actual messages within a topic, you go
-    to other files deeper in the directory structure.
+    This JSON has a bit of info for every stream, including
+    `num_topics`.  To get info about the topics in a stream, use
+    `read_zulip_topic_data`.  To get actual messages within a topic,
+    you go to other files deeper in the directory structure.
+
+    (Despite the .json names, cache files may be in any of the
+    formats and compressions from lib/cache_format.py.)
     """
-    f = (json_root / Path("stream_index.json")).open("r", encoding="utf-8")
-    stream_info = json.load(f)
-    f.close()
+    with phase("index_load"):
+        stream_info = load_file(json_root / Path("stream_index.json"))
+
+    for stream_data in stream_info["streams"].values():
+        # Older caches keep topic_data inline, without num_topics.
+        if "num_topics" not in stream_data:
+            stream_data["num_topics"] = len(stream_data["topic_data"])
+
     return stream_info
 
 
+def stream_index_shard_path(json_root, stream_name, stream_id):
+    return (
+        json_root
+        / Path("stream_index")
+        / Path(sanitize_stream(stream_name, stream_id) + ".json")
+    )
+
+
+def read_zulip_topic_data(json_root, stream_name, stream_data):
+    """
+    stream_index/<stream>.json
+
+    This JSON has a bit of info for every topic in the stream:
+
+        {
+            'name': stream_name,
+            'id': stream_id,
+            'topic_data': {
+                topic_name: {
+                    size: num posts in topic,
+                    latest_date: time of latest post }}}
+
+    Returns just the topic_data part.  `stream_data` is the
+    stream's entry from stream_index.json.
+    """
+    if "topic_data" in stream_data:
+        # an older cache (or one we already loaded)
+        return stream_data["topic_data"]
+
+    with phase("index_load"):
+        shard = load_file(
+            stream_index_shard_path(json_root, stream_name, stream_data["id"])
+        )
+    return shard["topic_data"]
+
+
 def read_zulip_messages_for_topic(
     json_root, sanitized_stream_name, sanitized_topic_name
 ):
@@ -89,12 +162,34 @@ def read_zulip_messages_for_topic(
     json_path = (
         json_root / Path(sanitized_stream_name) / Path(sanitized_topic_name + ".json")
     )
-    f = json_path.open("r", encoding="utf-8")
-    messages = json.load(f)
-    f.close()
+    with phase("topic_read"):
+        messages = load_file(json_path)
     return messages
 
 
+def iter_zulip_messages_for_topic(
+    json_root, sanitized_stream_name, sanitized_topic_name
+):
+    """
+    Like `read_zulip_messages_for_topic`, but yields the messages one
+    at a time, so that we never hold all of a big topic in memory.
+    """
+    json_path = (
+        json_root / Path(sanitized_stream_name) / Path(sanitized_topic_name + ".json")
+    )
+    messages = iter_file(json_path)
+    # The first message is the one that reads the file: all of it, for
+    # most topics (see `iter_stream`), so we only time that.  For the
+    # few topics big enough to get parsed as we go, the rest of the
+    # parsing counts towards whatever phase we're read from.
+    with phase("topic_read"):
+        msg = next(messages, None)
+    if msg is None:
+        return
+    yield msg
+    yield from messages
+
+
 def open_main_page(md_root):
     outfile = open_outfile(md_root, Path("index.html"), "w+")
     return outfile
@@ -110,3 +205,163 @@ def open_topic_messages_page(md_root, sanitized_stream_name, sanitized_topic_nam
     directory = md_root / Path("stream/" + sanitized_stream_name + "/topic")
     outfile = open_outfile(directory, Path(sanitized_topic_name + ".html"), "w+")
     return outfile
+
+
+class OutputSink:
+    """
+    A tar or zip file that the website gets written into, one file at a
+    time (see `SinkPath`).  Subclasses provide
+
+        add(name, data): puts `data` (bytes) into the archive as `name`
+        finish(): writes out whatever's left and moves the archive into place
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name("." + self.path.name + ".tmp")
+        self.mtime = int(time.time())
+        self.names = []
+        self._names = set()
+
+    def open(self, name, mode):
+        return SinkOutfile(self, name, mode)
+
+    def write(self, name, data):
+        if name in self._names:
+            # Neither format can take a file back once it's in there.
+            raise Exception(f"{name} was written into {self.path} twice")
+        self._names.add(name)
+        self.names.append(name)
+        self.add(name, data)
+
+    def exists(self, name):
+        return name in self._names
+
+    def close(self):
+        self.finish()
+        fsync_path(self.tmp_path)
+        os.replace(self.tmp_path, self.path)
+        print(f"wrote {len(self.names)} files to {self.path}")
+
+
+class TarSink(OutputSink):
+    def __init__(self, path):
+        super().__init__(path)
+        # "w|" is tarfile's streaming mode: it never seeks back.
+        compression = "gz" if self.path.name.endswith((".tar.gz", ".tgz")) else ""
+        self.file = self.tmp_path.open("wb")
+        self.tar = tarfile.open(mode="w|" + compression, fileobj=self.file)
+
+    def add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def finish(self):
+        self.tar.close()
+        self.file.close()
+
+
+class ZipSink(OutputSink):
+    def __init__(self, path):
+        super().__init__(path)
+        self.zip = zipfile.ZipFile(self.tmp_path, "w", zipfile.ZIP_DEFLATED)
+        self.date_time = time.localtime(self.mtime)[:6]
+
+    def add(self, name, data):
+        info = zipfile.ZipInfo(name, date_time=self.date_time)
+        info.external_attr = 0o644 << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self.zip.writestr(info, data)
+
+    def finish(self):
+        self.zip.close()
+
+
+class SinkOutfile:
+    """
+    What `open_outfile` gives you for a file in an `OutputSink`: we
+    keep the file in memory until you close it.
+    """
+
+    def __init__(self, sink, name, mode):
+        self.sink = sink
+        self.name = name
+        self.binary = "b" in mode
+        self._file = io.BytesIO() if self.binary else io.StringIO()
+        self.size = None
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._file.closed:
+            return
+        data = self._file.getvalue()
+        if not self.binary:
+            data = data.encode("utf-8")
+        self._file.close()
+        self.size = len(data)
+        self.sink.write(self.name, data)
+
+
+class SinkPath:
+    """
+    A path within md_root, for an md_root from `open_sink`.  It supports
+    just what the build uses of Path; `exists` is only true for files
+    we've written into the sink.
+    """
+
+    def __init__(self, sink, key):
+        self.sink = sink
+        self.key = key
+
+    def __str__(self):
+        return f"{self.sink.path}:{self.key}"
+
+    def __truediv__(self, other):
+        key = posixpath.normpath(posixpath.join(self.key, Path(other).as_posix()))
+        # (like Path, md_root / "." is md_root)
+        return SinkPath(self.sink, "" if key == "." else key)
+
+    @property
+    def name(self):
+        return posixpath.basename(self.key)
+
+    @property
+    def parent(self):
+        return SinkPath(self.sink, posixpath.dirname(self.key))
+
+    def with_name(self, name):
+        return self.parent / name
+
+    def as_posix(self):
+        return self.key
+
+    def exists(self):
+        return self.sink.exists(self.key)
+
+    def open_outfile(self, filename, mode):
+        return self.sink.open((self / filename).key, mode)
+
+
+def open_sink(path):
+    """
+    Returns an md_root that writes into the tar or zip file `path`
+    (by its extension); call `md_root.sink.close()` when you're done.
+    """
+    if Path(path).suffix == ".zip":
+        sink = ZipSink(path)
+    elif Path(path).name.endswith((".tar", ".tar.gz", ".tgz")):
+        sink = TarSink(path)
+    else:
+        exit_immediately(f"{path} should end with .tar, .tar.gz, .tgz or .zip")
+    return SinkPath(sink, "")
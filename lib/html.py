@@ -13,7 +13,7 @@ add helpers/converters as necessary.)
 
 import html
 
-from .date_helper import format_date1
+from .date_helper import format_date1, format_month
 
 from .url import (
     sanitize_stream,
@@ -130,6 +130,8 @@ def stream_list_page_html(streams):
     content_html = f"""\
 <hr>
 
+<p><a href="recent.html">Recently active topics</a></p>
+
 <h2>Streams:</h2>
 
 {stream_list_html(streams)}
@@ -137,6 +139,42 @@ def stream_list_page_html(streams):
     return content_html
 
 
+def recent_topics_page_html(recent):
+    content_html = f"""\
+<hr>
+
+<h2>Recently active topics:</h2>
+
+{recent_topics_html(recent)}
+"""
+    return content_html
+
+
+def recent_topics_html(recent):
+    """
+    produce a list like this, newest first:
+
+    * stream_name > topic name (n messages, latest: <date>)
+    * stream_name > topic name (n messages, latest: <date>)
+
+    `recent` is a list of (stream_name, stream_id, topic_name, message_data).
+    """
+
+    def item_html(stream_name, stream_id, topic_name, message_data):
+        sanitized_stream_name = sanitize_stream(stream_name, stream_id)
+        stream_url = f"stream/{sanitized_stream_name}/index.html"
+        topic_url = f"stream/{sanitized_stream_name}/topic/{sanitize(topic_name)}.html"
+        stream_link = (
+            f'<a href="{html.escape(stream_url)}">{html.escape(stream_name)}</a>'
+        )
+        topic_link = f'<a href="{html.escape(topic_url)}">{html.escape(topic_name)}</a>'
+        topic_info = topic_info_string(message_data)
+        return f"<li> {stream_link} &gt; {topic_link} ({html.escape(topic_info)}) </li>"
+
+    the_list_html = "\n".join(item_html(*item) for item in recent)
+    return "<ul>\n" + the_list_html + "\n</ul>"
+
+
 def stream_list_html(streams):
     """
     produce a list like this:
@@ -150,8 +188,7 @@ def stream_list_html(streams):
         stream_id = stream_data["id"]
         sanitized_name = sanitize_stream(stream_name, stream_id)
         url = f"stream/{sanitized_name}/index.html"
-        stream_topic_data = stream_data["topic_data"]
-        num_topics = num_topics_string(stream_topic_data)
+        num_topics = num_topics_string(stream_data["num_topics"])
         return f'<li> <a href="{html.escape(url)}">{html.escape(stream_name)}</a> ({html.escape(str(num_topics))}) </li>'
 
     the_list = "\n\n".join(
@@ -161,6 +198,55 @@ def stream_list_html(streams):
     return "<ul>\n" + the_list + "\n</ul>"
 
 
+def month_list_page_html(months):
+    """
+    The main page for an archive built with --by-month (see
+    lib/partitions.py), listing the months, newest first:
+
+    * November 2019 (3 streams, 120 messages)
+
+    `months` maps months (like "2019/11") to their summaries.
+    """
+
+    def item_html(month, summary):
+        streams = summary["streams"]
+        num_messages = sum(stream["size"] for stream in streams.values())
+        stream_plural = "" if len(streams) == 1 else "s"
+        message_plural = "" if num_messages == 1 else "s"
+        info = f"{len(streams)} stream{stream_plural}, {num_messages} message{message_plural}"
+        link_html = f'<a href="{html.escape(month)}/index.html">{html.escape(format_month(month))}</a>'
+        return f"<li> {link_html} ({html.escape(info)}) </li>"
+
+    the_list_html = "\n".join(
+        item_html(month, months[month]) for month in sorted(months, reverse=True)
+    )
+    return f"""\
+<hr>
+
+<h2>Months:</h2>
+
+<ul>
+{the_list_html}
+</ul>
+"""
+
+
+def month_page_html(month, streams):
+    """
+    The main page of one month, which lists the streams with messages
+    that month.
+    """
+    return f"""\
+<hr>
+
+<h2>{html.escape(format_month(month))}</h2>
+
+<h3>Streams:</h3>
+
+{stream_list_html(streams)}
+"""
+
+
 def topic_list_page_html(stream_name, stream_url, topic_data):
     content = f"""\
 <h2> Stream: <a href="{html.escape(stream_url)}">{html.escape(stream_name)}</a></h2>
@@ -192,3 +278,58 @@ def topic_list_html(topic_data):
         for topic_name in sorted_topics(topic_data)
     )
     return "<ul>\n" + the_list_html + "\n</ul>"
+
+
+def message_redirect_page_html(shard_size, shard_dir):
+    """
+    The message.html page, which looks up a message id (from a Zulip
+    link in the fragment, or ?id=) in the message id index (see
+    lib/message_index.py), and sends you to its topic page.
+    """
+    return f"""\
+<p id="status">Looking for the message...</p>
+<script>
+(function () {{
+    var status = document.getElementById("status");
+    var text = new URLSearchParams(window.location.search).get("id") ||
+        decodeURIComponent(window.location.hash);
+    var match = /near\\/(\\d+)/.exec(text) || /^#?(\\d+)$/.exec(text);
+    if (!match) {{
+        status.textContent = "Add a Zulip message link (or id) after the # in the URL.";
+        return;
+    }}
+    var id = Number(match[1]);
+    var shard = Math.floor(id / {shard_size});
+    function notFound() {{
+        status.textContent = "Message " + id + " is not in this archive.";
+    }}
+    fetch("{shard_dir}/" + shard + ".json").then(function (response) {{
+        if (!response.ok) {{
+            return notFound();
+        }}
+        return response.json().then(function (index) {{
+            var ids = [];
+            var prev = shard * {shard_size};
+            for (var i = 0; i < index.ids.length; i++) {{
+                prev += index.ids[i];
+                ids.push(prev);
+            }}
+            var lo = 0, hi = ids.length - 1;
+            while (lo <= hi) {{
+                var mid = (lo + hi) >> 1;
+                if (ids[mid] === id) {{
+                    window.location.replace(index.pages[index.refs[mid]] + "#" + id);
+                    return;
+                }}
+                if (ids[mid] < id) {{
+                    lo = mid + 1;
+                }} else {{
+                    hi = mid - 1;
+                }}
+            }}
+            notFound();
+        }});
+    }}, notFound);
+}})();
+</script>
+"""
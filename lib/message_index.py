@@ -0,0 +1,131 @@
+"""
+Zulip links to a message (see `zulip_post_url`) only have the
+message id, which doesn't tell us which archive page the message is
+on.  So the build also writes a message id index, which the
+message.html page (see `message_redirect_page_html`) uses to send
+you to the right page:
+
+    <site>/message.html#narrow/stream/213222-general/topic/hello/near/179892604
+    <site>/message.html?id=179892604
+
+The index is sharded by message id, so that the page only has to
+fetch one small file: the shard for message id N is
+msgindex/<N // SHARD_SIZE>.json, and looks like this:
+
+    {
+        'pages': ['stream/213222-general/topic/hello.html', ...],
+        'ids': [sorted message ids, each as the difference from the
+                one before (the first one from N // SHARD_SIZE * SHARD_SIZE)],
+        'refs': [for each id, its page's index in 'pages']}
+
+The page binary searches the ids, and a missing shard just means
+the message isn't in the archive.
+
+While we build, we only keep two numbers per message in memory.
+
+A pipelined build (see lib/pipeline.py) only adds the topics that
+got new messages, so it merges them into the shards that are already
+there (see `add_existing`).
+"""
+
+import json
+import os
+from array import array
+from pathlib import Path
+
+from .common import open_outfile
+
+# Zulip message ids are shared by every stream in the organization
+# (including private ones), so the archive has a lot fewer messages
+# than this in each shard.
+SHARD_SIZE = 1 << 14
+
+SHARD_DIR = "msgindex"
+
+
+class MessageIndex:
+    def __init__(self):
+        self.pages = []
+        # page -> its number in self.pages
+        self.page_numbers = {}
+        # shard number -> (array of ids, array of page numbers)
+        self.shards = {}
+
+    def page_number(self, page):
+        if page not in self.page_numbers:
+            self.page_numbers[page] = len(self.pages)
+            self.pages.append(page)
+        return self.page_numbers[page]
+
+    def add_topic(self, page, message_ids):
+        page_num = self.page_number(page)
+        for msg_id in message_ids:
+            shard = msg_id // SHARD_SIZE
+            if shard not in self.shards:
+                self.shards[shard] = (array("q"), array("i"))
+            ids, refs = self.shards[shard]
+            ids.append(msg_id)
+            refs.append(page_num)
+
+    def shard_json(self, shard):
+        ids, refs = self.shards[shard]
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        shard_pages = {}
+        deltas = []
+        shard_refs = []
+        prev_id = shard * SHARD_SIZE
+        for i in order:
+            page_num = refs[i]
+            if page_num not in shard_pages:
+                shard_pages[page_num] = len(shard_pages)
+            deltas.append(ids[i] - prev_id)
+            shard_refs.append(shard_pages[page_num])
+            prev_id = ids[i]
+        return dict(
+            pages=[self.pages[page_num] for page_num in shard_pages],
+            ids=deltas,
+            refs=shard_refs,
+        )
+
+    def add_existing(self, md_root):
+        """
+        Adds the messages we don't have from md_root's copies of the
+        shards we have messages for.
+        """
+        shard_dir = md_root / Path(SHARD_DIR)
+        for shard, (ids, refs) in self.shards.items():
+            path = shard_dir / f"{shard}.json"
+            if not path.exists():
+                continue
+            with open(path, encoding="utf-8") as f:
+                js = json.load(f)
+            have = set(ids)
+            msg_id = shard * SHARD_SIZE
+            for delta, ref in zip(js["ids"], js["refs"]):
+                msg_id += delta
+                if msg_id not in have:
+                    ids.append(msg_id)
+                    refs.append(self.page_number(js["pages"][ref]))
+
+    def write(self, md_root, complete=True):
+        """
+        Writes the shards we have; unless `complete` is False (we only
+        have some of them), we also delete the ones we don't have.
+        """
+        shard_dir = md_root / Path(SHARD_DIR)
+        filenames = set()
+        for shard in sorted(self.shards):
+            filename = f"{shard}.json"
+            filenames.add(filename)
+            out = open_outfile(shard_dir, filename, "w")
+            json.dump(self.shard_json(shard), out, separators=(",", ":"))
+            out.close()
+
+        if not complete:
+            return
+
+        # Messages can get deleted (or moved out of the archived
+        # streams), which can leave a shard from an older build behind.
+        for filename in os.listdir(shard_dir) if shard_dir.exists() else []:
+            if filename.endswith(".json") and filename not in filenames:
+                os.remove(shard_dir / filename)
@@ -0,0 +1,245 @@
+"""
+Counters describing an archive run, for monitoring.
+
+When archive.py is run with `--metrics FILE`, we write these out
+at the end of the run, either in the Prometheus textfile format
+(if FILE ends with .prom, e.g. for node_exporter's textfile
+collector) or as JSON (anything else).
+
+The counters are:
+
+    messages_fetched:   messages we got back from the Zulip API
+    api_requests:       requests we made to the Zulip API
+    api_retries:        requests we repeated after hitting a rate limit
+    api_sleep_seconds:  time we spent waiting out rate limits
+    topics_rewritten:   topic JSON files we wrote
+    pages_rendered:     HTML pages we wrote
+    bytes_written:      total size of the JSON and HTML files we wrote
+
+We also record how long each stream took, separately for
+fetching it (-t/-i) and for building its pages (-b).
+
+With --orgs, each organization also gets its own copy of the
+counters (under "org_counters" in the JSON), and its streams are
+marked with its name.  In the Prometheus file, the organization is
+an `org` label, so there is one series per organization and you sum
+over them for the total.  The builds run in their own processes,
+whose counters we `merge`; the fetches run in threads of this one,
+each inside an `org_scope`.
+
+Counting is cheap, so we always count; only the file sizes
+(which cost a stat per file) are skipped unless metrics are
+enabled.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+_enabled = False
+
+_counters = dict(
+    messages_fetched=0,
+    api_requests=0,
+    api_retries=0,
+    api_sleep_seconds=0.0,
+    topics_rewritten=0,
+    pages_rendered=0,
+    bytes_written=0,
+)
+
+# org name -> counter name -> value, with --orgs
+_org_counters = {}
+
+# (phase, org name or None, stream name) -> seconds
+_stream_durations = {}
+
+_run_start = time.time()
+
+# (for --pipeline's render threads, and --orgs's fetch threads)
+_lock = threading.Lock()
+
+# (the organization whose fetch this thread is running, if any)
+_local = threading.local()
+
+
+def enable():
+    global _enabled, _run_start
+    _enabled = True
+    _run_start = time.time()
+
+
+def is_enabled():
+    return _enabled
+
+
+@contextmanager
+def org_scope(org_name):
+    """
+    Counts what this thread does, until the block ends, for
+    `org_name` as well as in the totals.
+    """
+    _local.org_name = org_name
+    try:
+        yield
+    finally:
+        _local.org_name = None
+
+
+def _org_name():
+    return getattr(_local, "org_name", None)
+
+
+def _add(name, amount, org_name):
+    _counters[name] += amount
+    if org_name is not None:
+        org_counters = _org_counters.setdefault(org_name, {})
+        org_counters[name] = org_counters.get(name, 0) + amount
+
+
+def _add_duration(phase, stream_name, seconds, org_name):
+    key = (phase, org_name, stream_name)
+    _stream_durations[key] = _stream_durations.get(key, 0.0) + seconds
+
+
+def incr(name, amount=1):
+    org_name = _org_name()
+    with _lock:
+        _add(name, amount, org_name)
+
+
+def record_file(outfile):
+    """
+    Call this after closing a file we wrote, to count its bytes.
+    """
+    if _enabled:
+        # (files from `open_outfile` know their size, since they may
+        # have been moved by the time we get here)
+        size = getattr(outfile, "size", None)
+        if size is None:
+            size = os.path.getsize(outfile.name)
+        incr("bytes_written", size)
+
+
+def record_stream_duration(phase, stream_name, seconds):
+    org_name = _org_name()
+    with _lock:
+        _add_duration(phase, stream_name, seconds, org_name)
+
+
+def snapshot():
+    """
+    What a worker process (see lib/orgs.py) sends back to the parent,
+    which `merge`s it.
+    """
+    with _lock:
+        return dict(counters=dict(_counters), stream_durations=dict(_stream_durations))
+
+
+def merge(js, org_name):
+    with _lock:
+        for name, amount in js["counters"].items():
+            _add(name, amount, org_name)
+        for (phase, _, stream_name), seconds in js["stream_durations"].items():
+            _add_duration(phase, stream_name, seconds, org_name)
+
+
+def metrics_json(modes):
+    end_time = time.time()
+    return dict(
+        modes=modes,
+        start_time=_run_start,
+        end_time=end_time,
+        duration_seconds=end_time - _run_start,
+        counters=dict(_counters),
+        org_counters={
+            org_name: dict(org_counters)
+            for org_name, org_counters in _org_counters.items()
+        },
+        stream_durations=[
+            (
+                dict(phase=phase, stream=stream_name, seconds=seconds)
+                if org_name is None
+                else dict(
+                    phase=phase, org=org_name, stream=stream_name, seconds=seconds
+                )
+            )
+            for (phase, org_name, stream_name), seconds in _stream_durations.items()
+        ],
+    )
+
+
+def _label_value(s):
+    return s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(js):
+    prefix = "zulip_archive_"
+    lines = []
+
+    def add(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {prefix}{name} {help_text}")
+        lines.append(f"# TYPE {prefix}{name} {metric_type}")
+        for labels, value in samples:
+            label_str = ",".join(
+                f'{k}="{_label_value(str(v))}"' for k, v in labels.items()
+            )
+            if label_str:
+                label_str = "{" + label_str + "}"
+            lines.append(f"{prefix}{name}{label_str} {value}")
+
+    modes = ",".join(js["modes"])
+    org_counters = sorted(js.get("org_counters", {}).items())
+
+    for name, value in js["counters"].items():
+        if org_counters:
+            samples = [
+                (dict(modes=modes, org=org_name), counters.get(name, 0))
+                for org_name, counters in org_counters
+            ]
+        else:
+            samples = [(dict(modes=modes), value)]
+        add(name, "gauge", f"{name.replace('_', ' ')} in the last run", samples)
+
+    add(
+        "run_duration_seconds",
+        "gauge",
+        "wall time of the last run",
+        [(dict(modes=modes), js["duration_seconds"])],
+    )
+    add(
+        "last_run_timestamp_seconds",
+        "gauge",
+        "when the last run finished",
+        [(dict(modes=modes), js["end_time"])],
+    )
+    add(
+        "stream_duration_seconds",
+        "gauge",
+        "time spent on each stream in the last run",
+        [
+            ({k: v for k, v in d.items() if k != "seconds"}, d["seconds"])
+            for d in js["stream_durations"]
+        ],
+    )
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path, modes):
+    js = metrics_json(modes)
+    path = Path(path)
+    if path.suffix == ".prom":
+        text = prometheus_text(js)
+    else:
+        text = json.dumps(js, indent=4, sort_keys=True)
+
+    # Monitoring may read the file at any moment, so we never
+    # let it see a half-written file.
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,276 @@
+"""
+This module copies a JSON cache (see lib/files.py) to a new
+directory, rewriting every file in another format or compression
+(see lib/cache_format.py), and then checks the copy against the
+original.
+
+You don't have to migrate a cache to change its format (we can read
+any format, and files get rewritten as they get updated), but this
+converts a big archive in one go, without touching the live cache:
+
+    CACHE_FORMAT=msgpack python3 archive.py --migrate-cache ../zulip_json_new
+
+Once it says the copy checks out, you can swap the directories.
+
+We work one topic at a time, in a pool of processes, so memory use
+depends on the size of the biggest topic, not the whole archive.
+
+To check the copy, we summarize each topic (see `topic_summary`) as
+we convert it, and then again when we read it back from the new
+cache, and compare both against the stream index.
+
+The --views and --mirror-uploads state files (views.json,
+uploads.json and uploads.log) get copied over as they are.
+"""
+
+import hashlib
+import json
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .cache_format import dump_file, iter_file, load_file
+from .common import durability_barrier, exit_immediately, open_outfile
+from .files import read_zulip_stream_info, read_zulip_topic_data
+from .populate import dump_stream_index
+from .snapshot import open_snapshot
+from .uploads import JOURNAL_FILE as UPLOADS_JOURNAL_FILE
+from .uploads import STATE_FILE as UPLOADS_STATE_FILE
+from .url import sanitize, sanitize_stream
+from .views import STATE_FILE as VIEWS_STATE_FILE
+
+# Each task converts this many topics, and then syncs them (see
+# `durability_barrier`).
+TOPICS_PER_TASK = 500
+
+# The json_root for each worker process (see `init_worker`).
+_json_root = None
+
+
+def init_worker(json_directory, snapshot_path):
+    # A snapshot has an open zip file, which we can't send to
+    # other processes, so each one opens its own.
+    global _json_root
+    if snapshot_path is None:
+        _json_root = Path(json_directory)
+    else:
+        _json_root = open_snapshot(snapshot_path, json_directory)
+
+
+def worker_args(json_root):
+    if hasattr(json_root, "snapshot"):
+        return (json_root.path, json_root.snapshot.path)
+    return (json_root, None)
+
+
+def topic_path(stream_name, stream_id, topic_name):
+    return Path(sanitize_stream(stream_name, stream_id)) / (
+        sanitize(topic_name) + ".json"
+    )
+
+
+def topic_tasks(json_root, stream_info):
+    """
+    Returns the topics in the index (as paths relative to
+    json_root), in chunks of TOPICS_PER_TASK.
+    """
+    paths = [
+        topic_path(stream_name, stream_data["id"], topic_name)
+        for stream_name, stream_data in stream_info["streams"].items()
+        for topic_name in read_zulip_topic_data(json_root, stream_name, stream_data)
+    ]
+    return [
+        paths[i : i + TOPICS_PER_TASK] for i in range(0, len(paths), TOPICS_PER_TASK)
+    ]
+
+
+def topic_summary(messages):
+    """
+    Summarizes an iterable of messages, in a way that doesn't depend
+    on the format they were stored in.
+    """
+    count = 0
+    latest_date = None
+    latest_id = None
+    ids_hash = hashlib.sha256()
+    messages_hash = hashlib.sha256()
+    for msg in messages:
+        count += 1
+        latest_date = msg["timestamp"]
+        latest_id = msg["id"]
+        ids_hash.update(b"%d," % msg["id"])
+        messages_hash.update(
+            json.dumps(msg, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        )
+        messages_hash.update(b"\n")
+    return dict(
+        size=count,
+        latest_date=latest_date,
+        latest_id=latest_id,
+        ids=ids_hash.hexdigest(),
+        checksum=messages_hash.hexdigest(),
+    )
+
+
+def read_problem(e):
+    if isinstance(e, FileNotFoundError):
+        return "missing"
+    return f"unreadable ({e})"
+
+
+def convert_topics(paths, dst_root, cache_format, cache_compression):
+    """
+    Returns the `topic_summary` of each topic we converted, and for
+    the ones we couldn't read, why not (see `read_problem`).
+    """
+    summaries = {}
+    for path in paths:
+        try:
+            messages = load_file(_json_root / path)
+        except Exception as e:
+            summaries[path] = read_problem(e)
+            continue
+        summaries[path] = topic_summary(messages)
+        out = open_outfile(dst_root / path.parent, path.name, "wb")
+        dump_file(messages, out, cache_format, cache_compression)
+        out.close()
+    durability_barrier()
+    return summaries
+
+
+def summarize_topics(paths):
+    summaries = {}
+    for path in paths:
+        try:
+            summaries[path] = topic_summary(iter_file(_json_root / path))
+        except Exception as e:
+            summaries[path] = read_problem(e)
+    return summaries
+
+
+def summarize_cache(json_root, stream_info, jobs):
+    """
+    Returns a dict mapping each topic in the index (as a path
+    relative to json_root) to its `topic_summary`, or why we couldn't
+    read it (see `read_problem`).  This reads every topic, `jobs`
+    processes at a time.
+    """
+    summaries = {}
+    tasks = topic_tasks(json_root, stream_info)
+    with ProcessPoolExecutor(
+        jobs, initializer=init_worker, initargs=worker_args(json_root)
+    ) as pool:
+        for result in pool.map(summarize_topics, tasks):
+            summaries.update(result)
+    return summaries
+
+
+def index_summaries(json_root, stream_info):
+    """
+    Returns what the stream index says about each topic (as a path
+    relative to json_root): its size and latest date.
+    """
+    summaries = {}
+    for stream_name, stream_data in stream_info["streams"].items():
+        topic_data = read_zulip_topic_data(json_root, stream_name, stream_data)
+        for topic_name, topic in topic_data.items():
+            path = topic_path(stream_name, stream_data["id"], topic_name)
+            summaries[path] = topic
+    return summaries
+
+
+def migrate_cache(json_root, dst_root, cache_format, cache_compression, jobs):
+    dst_root = Path(dst_root)
+    if dst_root.exists() and any(dst_root.iterdir()):
+        exit_immediately(f"{dst_root} needs to be empty (or not exist yet)")
+
+    stream_info = read_zulip_stream_info(json_root)
+    tasks = topic_tasks(json_root, stream_info)
+    print(f"converting {sum(len(t) for t in tasks)} topics into {dst_root}")
+
+    src_summaries = {}
+    with ProcessPoolExecutor(
+        jobs, initializer=init_worker, initargs=worker_args(json_root)
+    ) as pool:
+        results = pool.map(
+            convert_topics,
+            tasks,
+            [dst_root] * len(tasks),
+            [cache_format] * len(tasks),
+            [cache_compression] * len(tasks),
+        )
+        for result in results:
+            src_summaries.update(result)
+            print(f"converted {len(src_summaries)} topics")
+
+    copy_state_files(json_root, dst_root)
+
+    # The index is small, so we just load it all, and let
+    # dump_stream_index write it (and its shards) out again.
+    for stream_name, stream_data in stream_info["streams"].items():
+        stream_data["topic_data"] = read_zulip_topic_data(
+            json_root, stream_name, stream_data
+        )
+        del stream_data["num_topics"]
+    dump_stream_index(dst_root, stream_info, cache_format, cache_compression)
+
+    print("verifying...")
+    errors, warnings = verify_migration(json_root, dst_root, src_summaries, jobs)
+    for warning in warnings:
+        print("warning:", warning)
+    for error in errors:
+        print(error)
+    if errors:
+        exit_immediately(f"{len(errors)} problems with the copy in {dst_root}")
+    print(f"{dst_root} checks out")
+
+
+def copy_state_files(json_root, dst_root):
+    for name in [UPLOADS_STATE_FILE, UPLOADS_JOURNAL_FILE, VIEWS_STATE_FILE]:
+        src = json_root / name
+        if not src.exists():
+            continue
+        out = open_outfile(dst_root, name, "wb")
+        with src.open("rb") as f:
+            shutil.copyfileobj(f, out)
+        out.close()
+    durability_barrier()
+
+
+def verify_migration(json_root, dst_root, src_summaries, jobs):
+    """
+    Returns a list of the ways the copy in dst_root differs from
+    json_root, and a list of the ways the original cache disagrees
+    with its own stream index.
+    """
+    src_info = read_zulip_stream_info(json_root)
+    dst_info = read_zulip_stream_info(dst_root)
+    errors = []
+    warnings = []
+
+    for stream_name, stream_data in src_info["streams"].items():
+        # Older caches have the topic data inline.
+        entry = {k: v for k, v in stream_data.items() if k != "topic_data"}
+        if dst_info["streams"].get(stream_name) != entry:
+            errors.append(f"stream_index.json: {stream_name} doesn't match")
+    if len(dst_info["streams"]) != len(src_info["streams"]):
+        errors.append("stream_index.json: the streams don't match")
+
+    expected = index_summaries(json_root, src_info)
+    if index_summaries(dst_root, dst_info) != expected:
+        errors.append("stream_index: the topic data doesn't match")
+
+    dst_summaries = summarize_cache(dst_root, dst_info, jobs)
+    for path, topic in expected.items():
+        src = src_summaries.get(path, "missing")
+        dst = dst_summaries.get(path, "missing")
+        if isinstance(src, str):
+            errors.append(f"{path}: {src} in {json_root}")
+        elif isinstance(dst, str):
+            errors.append(f"{path}: {dst} in {dst_root}")
+        elif dst != src:
+            errors.append(f"{path}: the messages don't match")
+        elif (src["size"], src["latest_date"]) != (topic["size"], topic["latest_date"]):
+            # Not the migration's fault, but worth knowing.
+            warnings.append(f"{path}: doesn't match the stream index")
+    return errors, warnings
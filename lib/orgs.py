@@ -0,0 +1,353 @@
+"""
+If you archive several Zulip organizations, you can do them all in
+one run, instead of one `archive.py` per organization:
+
+    python3 archive.py -i -b --orgs orgs.yaml
+
+where orgs.yaml lists them:
+
+    orgs:
+      - name: lean
+        settings: lean/settings.py      # like default_settings.py
+        zuliprc: lean/zuliprc
+        requests_per_second: 2          # optional
+      - name: rust
+        settings: rust/settings.py
+        zuliprc: rust/zuliprc
+
+(paths are relative to orgs.yaml).  Every organization has its own
+settings, so its own streams (see `stream_validator`; a settings file
+copied from default_settings.py reads the streams.yaml next to it),
+JSON directory and html directory; no two can share a directory.
+
+The fetches (-t/-i) run in a pool of --jobs threads (default: one
+per organization), since they spend their time waiting on the Zulip
+API.  Each organization's fetch goes through its own `RateLimiter`,
+if it has a requests_per_second, on top of backing off when Zulip
+tells us to (see `safe_request`).  As soon as an organization's fetch
+is done, its build (-b, plus the sitemap) goes to a pool of
+processes (one per CPU, at most), since building is CPU bound; so
+one organization gets built while the others are still fetching.
+
+If one organization's fetch or build fails, we say so and carry on
+with the others; archive.py exits with an error at the end.
+"""
+
+import configparser
+import importlib.util
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+
+from .cache_format import check_compression, check_format
+from .common import exit_immediately, remove_temp_files, stream_validator
+from .populate import populate_all, populate_incremental
+from .views import Views
+from .website import build_website
+from . import metrics, timing
+
+
+class RateLimiter:
+    """
+    Lets through at most `rate` requests per second, evenly spaced,
+    from however many threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+            metrics.incr("api_sleep_seconds", delay)
+
+
+class RateLimitedClient:
+    """
+    A zulip.Client whose requests wait for `limiter` first.
+    """
+
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+
+    def __getattr__(self, attr):
+        method = getattr(self.client, attr)
+
+        def call(*args, **kwargs):
+            self.limiter.wait()
+            return method(*args, **kwargs)
+
+        return call
+
+
+def zulip_client(zuliprc):
+    # We only import zulip here, since building the website
+    # doesn't need a client (or even a zuliprc).
+    import zulip
+
+    return zulip.Client(config_file=zuliprc)
+
+
+def load_settings(name, path):
+    spec = importlib.util.spec_from_file_location(f"settings_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # A settings file copied from default_settings.py reads streams.yaml
+    # when it's first asked for its streams; every organization gets
+    # the one next to its own settings file, rather than whatever is in
+    # the current directory.
+    if hasattr(module, "streams_yaml"):
+        module.streams_yaml = str(Path(path).parent / module.streams_yaml)
+    return module
+
+
+class Org:
+    """
+    One organization: `settings` is its settings module, and
+    `get_client` makes a Zulip client for it.
+    """
+
+    def __init__(self, name, settings, zuliprc=None, rate=None, get_client=None):
+        self.name = name
+        self.settings = settings
+        self.zuliprc = zuliprc
+        self.limiter = RateLimiter(rate) if rate else None
+        if get_client is None and zuliprc is not None:
+            get_client = partial(zulip_client, zuliprc)
+        self.get_client = get_client
+
+    def client(self):
+        if self.get_client is None:
+            exit_immediately(f"{self.name} needs a zuliprc to fetch from Zulip.")
+        client = self.get_client()
+        if self.limiter is not None:
+            client = RateLimitedClient(client, self.limiter)
+        return client
+
+    def zulip_url(self):
+        zulip_url = getattr(self.settings, "zulip_url", None)
+        if zulip_url:
+            return zulip_url
+        if self.zuliprc is None or not os.path.exists(self.zuliprc):
+            exit_immediately(
+                f"{self.name} needs zulip_url in its settings, or a zuliprc."
+            )
+        config = configparser.RawConfigParser()
+        config.read(self.zuliprc)
+        return config.get("api", "site")
+
+    def cache_settings(self):
+        # Older settings.py files don't have these.
+        cache_format = getattr(self.settings, "cache_format", "json")
+        cache_compression = getattr(self.settings, "cache_compression", None)
+        check_format(cache_format)
+        check_compression(cache_compression)
+        return cache_format, cache_compression
+
+
+def read_orgs(path):
+    import yaml
+
+    path = Path(path)
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    if not config or not config.get("orgs"):
+        exit_immediately(f"{path} doesn't list any orgs.")
+
+    orgs = []
+    for entry in config["orgs"]:
+        if "name" not in entry or "settings" not in entry:
+            exit_immediately(f"Every org in {path} needs a name and settings.")
+        name = str(entry["name"])
+        if name in (org.name for org in orgs):
+            exit_immediately(f"{path} lists {name} twice.")
+        settings = load_settings(name, path.parent / entry["settings"])
+        zuliprc = entry.get("zuliprc")
+        if zuliprc is not None:
+            zuliprc = str(path.parent / zuliprc)
+        orgs.append(Org(name, settings, zuliprc, entry.get("requests_per_second")))
+    return orgs
+
+
+def check_orgs(orgs, fetch, build):
+    for what in ["json_directory", "html_directory"] if build else ["json_directory"]:
+        seen = {}
+        for org in orgs:
+            directory = getattr(org.settings, what)
+            if not directory.is_dir():
+                exit_immediately(
+                    f"{org.name}'s {what} {directory} needs to be a directory:\n\nmkdir {directory.as_posix()}"
+                )
+            directory = directory.resolve()
+            if directory in seen:
+                exit_immediately(
+                    f"{seen[directory]} and {org.name} have the same {what}."
+                )
+            seen[directory] = org.name
+    if fetch:
+        for org in orgs:
+            stream_validator(org.settings)
+            org.cache_settings()
+
+
+def fetch_org(org, mode):
+    settings = org.settings
+    cache_format, cache_compression = org.cache_settings()
+    populate = populate_all if mode == "t" else populate_incremental
+    remove_temp_files(settings.json_directory)
+    # (the other orgs are fetching in other threads at the same time)
+    with metrics.org_scope(org.name):
+        populate(
+            org.client(),
+            settings.json_directory,
+            stream_validator(settings),
+            cache_format,
+            cache_compression,
+        )
+
+
+def build_args(org, repo_root, views, sitemap, metrics_enabled, timing_enabled):
+    settings = org.settings
+    return (
+        settings.json_directory,
+        settings.html_directory,
+        settings.site_url,
+        settings.html_root,
+        settings.title,
+        org.zulip_url(),
+        settings.zulip_icon_url,
+        repo_root,
+        settings.page_head_html,
+        settings.page_footer_html,
+        views,
+        sitemap,
+        metrics_enabled,
+        timing_enabled,
+    )
+
+
+def build_org(
+    json_root,
+    md_root,
+    site_url,
+    html_root,
+    title,
+    zulip_url,
+    zulip_icon_url,
+    repo_root,
+    page_head_html,
+    page_footer_html,
+    views,
+    sitemap,
+    metrics_enabled,
+    timing_enabled,
+):
+    """
+    Builds one organization's website, in a worker process; returns
+    the worker's metrics and timings, which the parent merges.
+    """
+    if metrics_enabled:
+        metrics.enable()
+    if timing_enabled:
+        timing.enable()
+    remove_temp_files(md_root)
+    build_website(
+        json_root,
+        md_root,
+        site_url,
+        html_root,
+        title,
+        zulip_url,
+        zulip_icon_url,
+        repo_root,
+        page_head_html,
+        page_footer_html,
+        None,
+        Views(json_root) if views else None,
+    )
+    if sitemap:
+        from .sitemap import build_sitemap
+
+        build_sitemap(site_url, md_root.as_posix(), md_root.as_posix())
+    return dict(
+        metrics=metrics.snapshot(),
+        phases=timing.summary()["phases"] if timing_enabled else {},
+    )
+
+
+def archive_orgs(
+    orgs,
+    mode,
+    build,
+    repo_root,
+    views=False,
+    sitemap=True,
+    threads=None,
+    processes=None,
+):
+    """
+    `mode` is "t", "i" or None (to not fetch), like archive.py's flags.
+    Returns the names of the organizations that failed.
+    """
+    check_orgs(orgs, mode is not None, build)
+    failed = []
+
+    def submit_build(org):
+        args = build_args(
+            org, repo_root, views, sitemap, metrics.is_enabled(), timing.is_enabled()
+        )
+        return build_pool.submit(build_org, *args)
+
+    def report(org, what, e):
+        print(f"{org.name}: {what} failed: {e!r}")
+        failed.append(org.name)
+
+    # Forking a process with threads running can deadlock it.
+    mp_context = multiprocessing.get_context("spawn")
+    processes = processes or min(len(orgs), os.cpu_count() or 1)
+    with ThreadPoolExecutor(threads or len(orgs)) as fetch_pool, ProcessPoolExecutor(
+        processes, mp_context=mp_context
+    ) as build_pool:
+        fetches = {}
+        if mode is not None:
+            fetches = {fetch_pool.submit(fetch_org, org, mode): org for org in orgs}
+        builds = {}
+        if build and mode is None:
+            builds = {submit_build(org): org for org in orgs}
+
+        for future in as_completed(fetches):
+            org = fetches[future]
+            # (exit_immediately's SystemExit too, so that one org can't
+            # stop the others)
+            try:
+                future.result()
+            except (Exception, SystemExit) as e:
+                report(org, "fetch", e)
+                continue
+            print(f"{org.name}: fetched")
+            if build:
+                builds[submit_build(org)] = org
+
+        for future in as_completed(builds):
+            org = builds[future]
+            try:
+                js = future.result()
+            except (Exception, SystemExit) as e:
+                report(org, "build", e)
+                continue
+            print(f"{org.name}: built")
+            metrics.merge(js["metrics"], org.name)
+            timing.merge(js["phases"])
+
+    return failed
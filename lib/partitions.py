@@ -0,0 +1,307 @@
+"""
+A big archive can outgrow what a host like GitHub Pages allows, and
+every build rewrites every page.  With --by-month:
+
+    python3 archive.py -b --by-month
+
+we split the website up by month instead.  Each month is its own
+little archive, with a page for each stream (listing that month's
+topics) and a page for each topic (with that month's messages):
+
+    <md_root>
+        index.html              (lists the months)
+        months.json
+        2019
+            11
+                index.html      (lists the streams)
+                frozen.json
+                stream
+                    213222-general
+                        index.html
+                        topic
+                            hello.html
+
+Once a month is over (as of the last fetch), we build it one more
+time and then freeze it: we write frozen.json into it, and never
+touch it again.  So a build only reads the topics that got messages
+since the last frozen month, and only writes the months after it,
+and you can publish the frozen months separately (say, each year in
+its own repository).  months.json says up to which month things are
+frozen.
+
+To rebuild the frozen months (say, after you add a stream with a
+long history to streams.yaml), delete months.json.
+
+Messages go on the page for the month they were sent in.  (If a
+message is older than the one before it, which can happen with
+imported messages, it goes in the same month as the one before it,
+so that we can write each topic's pages in one pass.)
+"""
+
+import itertools
+import json
+import time
+import urllib.parse
+from pathlib import Path
+from shutil import copytree
+
+from .cache_format import load_file
+from .common import copy_outfile, durability_barrier, open_outfile
+from .files import (
+    iter_zulip_messages_for_topic,
+    read_zulip_stream_info,
+    read_zulip_topic_data,
+)
+from .html import last_updated_footer_html, month_list_page_html, month_page_html
+from .url import archive_uploads_url, sanitize, sanitize_stream
+from .website import write_css, write_stream_topics, write_topic_messages
+from . import metrics
+from .timing import phase
+
+STATE_FILE = "months.json"
+FROZEN_FILE = "frozen.json"
+
+
+def month_of(ts):
+    """
+    The month (like "2019/11") of a timestamp, which is also the
+    month's directory.
+    """
+    return time.strftime("%Y/%m", time.gmtime(ts))
+
+
+def month_html_root(site_url, html_root, month):
+    """
+    The html_root for the pages of `month`, like
+    http://127.0.0.1:4000/archive/2020/01.
+
+    This is a full URL, which the functions in lib/url.py use as it
+    is.  A relative one would go wrong: with the GitHub action's
+    site_url (https://user.github.io/repo, no trailing slash) and
+    html_root "", urljoin turns "2020/01" into
+    https://user.github.io/2020/01.
+    """
+    return f"{urllib.parse.urljoin(site_url, html_root)}/{month}"
+
+
+def month_before(month):
+    year, month = map(int, month.split("/"))
+    if month == 1:
+        return f"{year - 1}/12"
+    return f"{year}/{month - 1:02}"
+
+
+def read_state(md_root):
+    path = md_root / STATE_FILE
+    if not path.exists():
+        # Nothing is frozen ("" is before every month).
+        return dict(frozen_through="")
+    return load_file(path)
+
+
+def months_of_messages(messages, frozen_through):
+    """
+    Yields (month, message) for the messages after the month
+    `frozen_through`.
+    """
+    month = ""
+    for msg in messages:
+        month = max(month, month_of(msg["timestamp"]))
+        if month > frozen_through:
+            yield month, msg
+
+
+def counted(month_messages, topic_info):
+    for _, msg in month_messages:
+        topic_info["size"] += 1
+        topic_info["latest_date"] = msg["timestamp"]
+        yield msg
+
+
+def build_partitioned_website(
+    json_root,
+    md_root,
+    site_url,
+    html_root,
+    title,
+    zulip_url,
+    zulip_icon_url,
+    repo_root,
+    page_head_html,
+    page_footer_html,
+    uploads=None,
+):
+    stream_info = read_zulip_stream_info(json_root)
+    streams = stream_info["streams"]
+    date_footer_html = last_updated_footer_html(stream_info)
+
+    frozen_through = read_state(md_root)["frozen_through"]
+    print(f"frozen through: {frozen_through or 'nothing yet'}")
+
+    # month -> stream name -> topic name -> dict(size, latest_date)
+    months = {}
+
+    def write_topic(stream_name, stream_id, topic_name):
+        sanitized_stream_name = sanitize_stream(stream_name, stream_id)
+        messages = iter_zulip_messages_for_topic(
+            json_root, sanitized_stream_name, sanitize(topic_name)
+        )
+        for month, month_messages in itertools.groupby(
+            months_of_messages(messages, frozen_through),
+            key=lambda item: item[0],
+        ):
+            topic_info = dict(size=0, latest_date=0)
+            write_topic_messages(
+                json_root,
+                md_root / month,
+                site_url,
+                month_html_root(site_url, html_root, month),
+                title,
+                zulip_url,
+                zulip_icon_url,
+                stream_name,
+                dict(id=stream_id),
+                topic_name,
+                date_footer_html,
+                page_head_html,
+                page_footer_html,
+                uploads,
+                counted(month_messages, topic_info),
+                archive_uploads_url(site_url, html_root),
+            )
+            months.setdefault(month, {}).setdefault(stream_name, {})[
+                topic_name
+            ] = topic_info
+
+    # The topics that linked to uploads we were still downloading (see
+    # lib/uploads.py), to write again once we have them.
+    redo_topics = []
+
+    for stream_name, stream_data in streams.items():
+        print("building: ", stream_name)
+        start = time.perf_counter()
+        topic_data = read_zulip_topic_data(json_root, stream_name, stream_data)
+        with phase("page_render"):
+            for topic_name, topic in topic_data.items():
+                if month_of(topic["latest_date"]) <= frozen_through:
+                    continue
+                write_topic(stream_name, stream_data["id"], topic_name)
+                if uploads is not None and uploads.missed():
+                    redo_topics.append((stream_name, stream_data["id"], topic_name))
+        metrics.record_stream_duration(
+            "build", stream_name, time.perf_counter() - start
+        )
+
+    if uploads is not None:
+        with phase("uploads"):
+            uploads.finish()
+        with phase("page_render"):
+            for stream_name, stream_id, topic_name in redo_topics:
+                write_topic(stream_name, stream_id, topic_name)
+
+    summaries = {}
+    with phase("page_render"):
+        for month, month_streams in months.items():
+            summaries[month] = write_month(
+                md_root,
+                month,
+                site_url,
+                html_root,
+                title,
+                streams,
+                month_streams,
+                date_footer_html,
+                page_head_html,
+                page_footer_html,
+            )
+
+    # Freeze the months that are over.  The pages have to be on disk
+    # before the markers that say they're done.
+    durability_barrier()
+    new_frozen_through = max(
+        frozen_through, month_before(month_of(stream_info["time"]))
+    )
+    for month, summary in summaries.items():
+        if month <= new_frozen_through:
+            out = open_outfile(md_root / month, FROZEN_FILE, "w")
+            json.dump(summary, out, indent=2, sort_keys=True)
+            out.close()
+    durability_barrier()
+    out = open_outfile(md_root, STATE_FILE, "w")
+    json.dump(dict(frozen_through=new_frozen_through), out)
+    out.close()
+
+    # The main page lists all the months, frozen or not.
+    for marker in md_root.glob(f"*/*/{FROZEN_FILE}"):
+        month = marker.parent.relative_to(md_root).as_posix()
+        if month not in summaries:
+            summaries[month] = load_file(marker)
+    with phase("page_render"):
+        outfile = open_outfile(md_root, Path("index.html"), "w+")
+        outfile.write(page_head_html)
+        outfile.write(month_list_page_html(summaries))
+        outfile.write(date_footer_html)
+        outfile.write(page_footer_html)
+        outfile.close()
+        metrics.incr("pages_rendered")
+        metrics.record_file(outfile)
+
+    with phase("asset_copy"):
+        write_css(md_root)
+        copytree(
+            str(Path(repo_root) / "assets"),
+            str(Path(md_root) / "assets"),
+            copy_function=copy_outfile,
+            dirs_exist_ok=True,
+        )
+        copy_outfile(Path(repo_root) / ".nojekyll", Path(md_root) / ".nojekyll")
+
+    durability_barrier()
+
+
+def write_month(
+    md_root,
+    month,
+    site_url,
+    html_root,
+    title,
+    streams,
+    month_streams,
+    date_footer_html,
+    page_head_html,
+    page_footer_html,
+):
+    """
+    Writes the stream pages and the main page for one month, and
+    returns its summary (for frozen.json and the main page).
+    """
+    month_root = md_root / month
+    summary_streams = {}
+    for stream_name, topic_data in month_streams.items():
+        stream_id = streams[stream_name]["id"]
+        write_stream_topics(
+            month_root,
+            site_url,
+            month_html_root(site_url, html_root, month),
+            title,
+            stream_name,
+            dict(id=stream_id, topic_data=topic_data),
+            date_footer_html,
+            page_head_html,
+            page_footer_html,
+        )
+        summary_streams[stream_name] = dict(
+            id=stream_id,
+            num_topics=len(topic_data),
+            size=sum(topic["size"] for topic in topic_data.values()),
+        )
+
+    outfile = open_outfile(month_root, Path("index.html"), "w+")
+    outfile.write(page_head_html)
+    outfile.write(month_page_html(month, summary_streams))
+    outfile.write(date_footer_html)
+    outfile.write(page_footer_html)
+    outfile.close()
+    metrics.incr("pages_rendered")
+    metrics.record_file(outfile)
+    return dict(streams=summary_streams)
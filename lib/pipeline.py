@@ -0,0 +1,162 @@
+"""
+Normally `archive.py -i -b` fetches everything, and only then starts
+building.  With
+
+    python3 archive.py -i -b --pipeline
+
+the build starts while we're still fetching: every topic that
+`populate_incremental` writes goes over a queue to render threads,
+which write its page from the messages we already have in memory,
+while the main thread waits on the Zulip API for the next stream.
+Once every stream is fetched, `PipelinedBuild.finish` builds the rest
+(the main page, the stream pages, the feeds, recent.html, the message
+id index, and the views), and archive.py the sitemap, as usual.
+
+Topics without new messages keep their pages from the last build,
+so this needs a website that was built with -b before.  (Their
+"Last updated" footers stay as they were, and the pages we render
+here say when the fetch started.)
+
+Rendering mostly holds the GIL, so more render threads than
+RENDER_THREADS don't buy much; the point is to render while the
+fetch is waiting on the network.  The queue holds at most QUEUE_SIZE
+topics, so a fetch that's faster than the rendering waits for it,
+rather than holding everything in memory.
+"""
+
+import queue
+import threading
+import time
+
+from .html import last_updated_footer_html
+from .populate import slim_message
+from .timing import phase
+from .url import sanitize, sanitize_stream
+from .website import build_website, write_topic_messages
+
+RENDER_THREADS = 2
+
+QUEUE_SIZE = 1000
+
+
+class PipelinedBuild:
+    """
+    Takes the arguments `build_website` does; `threads` is how many
+    render threads to run.  Pass `topic_updated` to
+    `populate_incremental` as its `on_topic`, and call `finish` once
+    it's done.
+    """
+
+    def __init__(
+        self,
+        json_root,
+        md_root,
+        site_url,
+        html_root,
+        title,
+        zulip_url,
+        zulip_icon_url,
+        repo_root,
+        page_head_html,
+        page_footer_html,
+        views=None,
+        threads=None,
+    ):
+        self.json_root = json_root
+        self.md_root = md_root
+        self.site_url = site_url
+        self.html_root = html_root
+        self.title = title
+        self.zulip_url = zulip_url
+        self.zulip_icon_url = zulip_icon_url
+        self.repo_root = repo_root
+        self.page_head_html = page_head_html
+        self.page_footer_html = page_footer_html
+        self.views = views
+        self.views_lock = threading.Lock()
+        self.date_footer_html = last_updated_footer_html(dict(time=time.time()))
+
+        # page -> message ids, for the message id index
+        self.rendered = {}
+        self.error = None
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.threads = [
+            threading.Thread(target=self.render_topics, daemon=True)
+            for _ in range(threads or RENDER_THREADS)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def topic_updated(self, stream, topic_name, messages):
+        if self.error is not None:
+            raise self.error
+        messages = [slim_message(msg) for msg in messages]
+        self.queue.put((stream["name"], stream["stream_id"], topic_name, messages))
+
+    def render_topics(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # Just drain the queue; `finish` will raise the error.
+                continue
+            try:
+                with phase("page_render"):
+                    self.render_topic(*item)
+            except Exception as e:
+                self.error = e
+
+    def render_topic(self, stream_name, stream_id, topic_name, messages):
+        if self.views is not None:
+            # Views aren't thread safe, so we count the messages here
+            # instead of while we write the page.
+            with self.views_lock:
+                messages = list(
+                    self.views.feed(stream_name, stream_id, topic_name, messages)
+                )
+        message_ids = write_topic_messages(
+            self.json_root,
+            self.md_root,
+            self.site_url,
+            self.html_root,
+            self.title,
+            self.zulip_url,
+            self.zulip_icon_url,
+            stream_name,
+            dict(id=stream_id),
+            topic_name,
+            self.date_footer_html,
+            self.page_head_html,
+            self.page_footer_html,
+            None,
+            messages,
+        )
+        sanitized_stream_name = sanitize_stream(stream_name, stream_id)
+        page = f"stream/{sanitized_stream_name}/topic/{sanitize(topic_name)}.html"
+        self.rendered[page] = message_ids
+
+    def finish(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+        print(f"rendered {len(self.rendered)} topics while fetching")
+        build_website(
+            self.json_root,
+            self.md_root,
+            self.site_url,
+            self.html_root,
+            self.title,
+            self.zulip_url,
+            self.zulip_icon_url,
+            self.repo_root,
+            self.page_head_html,
+            self.page_footer_html,
+            None,
+            self.views,
+            self.rendered,
+        )
@@ -25,13 +25,25 @@ About the data:
             stream_name: {
                 'id': stream_id,
                 'latest_id': id of latest post in stream,
-                'topic_data': {
-                    topic_name: {
-                        topic_size: num posts in topic,
-                        latest_date: time of latest post }}}}}
+                'num_topics': number of topics in stream }}}
 
     stream_index.json is created in the top level of the JSON directory.
 
+    Next to it, the stream_index directory has a json file for each
+    stream, with info about each topic in the stream:
+
+    {
+        'name': stream_name,
+        'id': stream_id,
+        'topic_data': {
+            topic_name: {
+                topic_size: num posts in topic,
+                latest_date: time of latest post }}}
+
+    While we work on the index in memory, a stream's entry holds its
+    `topic_data` too, if we have loaded (or changed) it; when we dump
+    the index, we rewrite the files for exactly those streams.
+
     This directory also contains a subdirectory for each archived stream.
 
     In each stream subdirectory, there is a json file for each topic in that stream.
@@ -40,22 +52,29 @@ About the data:
     as desribed at https://zulip.com/api/get-messages
 """
 
-import json
 import time
 from datetime import datetime
 from pathlib import Path
+from .cache_format import dump_file, load_file
 from .common import (
+    durability_barrier,
     exit_immediately,
     open_outfile,
 )
+from . import metrics
+from .files import (
+    read_zulip_topic_data,
+    stream_index_shard_path,
+)
+from .timing import phase
 from .url import (
     sanitize_stream,
     sanitize,
 )
 
 
-def dump_json(js, outfile):
-    json.dump(js, outfile, ensure_ascii=False, sort_keys=True, indent=4)
+def dump_json(js, outfile, cache_format, cache_compression):
+    dump_file(js, outfile, cache_format, cache_compression)
 
 
 # Takes a list of messages. Returns a dict mapping topic names to lists of messages in that topic.
@@ -76,23 +95,30 @@ def request_all(client, request, anchor=0):
     request["anchor"] = anchor
     request["num_before"] = 0
     request["num_after"] = 1000
-    response = safe_request(client.get_messages, request)
-    msgs = response["messages"]
-    while not response["found_newest"]:
-        request["anchor"] = response["messages"][-1]["id"] + 1
+    with phase("stream_fetch"):
         response = safe_request(client.get_messages, request)
-        msgs = msgs + response["messages"]
+        msgs = response["messages"]
+        while not response["found_newest"]:
+            request["anchor"] = response["messages"][-1]["id"] + 1
+            response = safe_request(client.get_messages, request)
+            msgs = msgs + response["messages"]
+    metrics.incr("messages_fetched", len(msgs))
     return msgs
 
 
 # runs client.cmd(args). If the response is a rate limit error, waits
 # the requested time and then retries the request.
 def safe_request(cmd, *args, **kwargs):
+    metrics.incr("api_requests")
     rsp = cmd(*args, **kwargs)
     while rsp["result"] == "error":
         if "retry-after" in rsp:
             print("timeout hit: {}".format(rsp["retry-after"]))
-            time.sleep(float(rsp["retry-after"]) + 1)
+            sleep_seconds = float(rsp["retry-after"]) + 1
+            time.sleep(sleep_seconds)
+            metrics.incr("api_retries")
+            metrics.incr("api_sleep_seconds", sleep_seconds)
+            metrics.incr("api_requests")
             rsp = cmd(*args, **kwargs)
         else:
             exit_immediately(rsp["msg"])
@@ -102,12 +128,13 @@ def safe_request(cmd, *args, **kwargs):
 def get_streams(client):
     # Fetch metadata on all streams the current user has access to.
     # We will filter these for processing via is_valid_stream_name.
-    response = safe_request(
-        client.get_streams,
-        include_public=True,
-        include_subscribed=True,
-        include_web_public=True,
-    )
+    with phase("stream_fetch"):
+        response = safe_request(
+            client.get_streams,
+            include_public=True,
+            include_subscribed=True,
+            include_web_public=True,
+        )
     return response["streams"]
 
 
@@ -116,6 +143,8 @@ def populate_all(
     client,
     json_root,
     is_valid_stream_name,
+    cache_format="json",
+    cache_compression=None,
 ):
     all_streams = get_streams(client)
     streams = [s for s in all_streams if is_valid_stream_name(s)]
@@ -127,8 +156,10 @@ def populate_all(
         stream_id = s["stream_id"]
 
         print(stream_name)
+        start = time.perf_counter()
 
-        topics = safe_request(client.get_stream_topics, stream_id)["topics"]
+        with phase("stream_fetch"):
+            topics = safe_request(client.get_stream_topics, stream_id)["topics"]
 
         latest_id = 0  # till we know better
 
@@ -156,7 +187,9 @@ def populate_all(
 
             latest_id = max(latest_id, last_message["id"])
 
-            dump_topic_messages(json_root, s, topic_name, messages)
+            dump_topic_messages(
+                json_root, s, topic_name, messages, cache_format, cache_compression
+            )
 
         stream_data = dict(
             id=stream_id,
@@ -165,17 +198,26 @@ def populate_all(
         )
 
         streams_data[stream_name] = stream_data
+        metrics.record_stream_duration(
+            "fetch", stream_name, time.perf_counter() - start
+        )
 
     js = dict(streams=streams_data, time=time.time())
-    dump_stream_index(json_root, js)
+    dump_stream_index(json_root, js, cache_format, cache_compression)
 
 
 # Retrieves only new messages from Zulip, based on timestamps from the last update.
 # Raises an exception if there is no index at json_root/stream_index.json
+#
+# If you pass `on_topic`, we call it with (stream, topic name, messages)
+# for every topic we write (see lib/pipeline.py).
 def populate_incremental(
     client,
     json_root,
     is_valid_stream_name,
+    cache_format="json",
+    cache_compression=None,
+    on_topic=None,
 ):
     streams = get_streams(client)
     stream_index = json_root / Path("stream_index.json")
@@ -195,12 +237,12 @@ def populate_incremental(
         )
         exit_immediately(error_msg)
 
-    f = stream_index.open("r", encoding="utf-8")
-    js = json.load(f)
-    f.close()
+    with phase("index_load"):
+        js = load_file(stream_index)
 
     for s in (s for s in streams if is_valid_stream_name(s)):
         print(s["name"])
+        start = time.perf_counter()
         if s["name"] not in js["streams"]:
             js["streams"][s["name"]] = {
                 "id": s["stream_id"],
@@ -218,6 +260,11 @@ def populate_incremental(
         if len(new_msgs) > 0:
             js["streams"][s["name"]]["latest_id"] = new_msgs[-1]["id"]
         nm = separate_results(new_msgs)
+        stream_data = js["streams"][s["name"]]
+        if nm and "topic_data" not in stream_data:
+            stream_data["topic_data"] = read_zulip_topic_data(
+                json_root, s["name"], stream_data
+            )
         for topic_name in nm:
             p = (
                 json_root
@@ -226,32 +273,81 @@ def populate_incremental(
             )
             topic_exists = p.exists()
             old = []
-            if topic_exists:
-                f = p.open("r", encoding="utf-8")
-                old = json.load(f)
-                f.close()
             m = nm[topic_name]
+            if topic_exists:
+                with phase("topic_read"):
+                    old = load_file(p)
+                # If we crashed after moving topic files into place,
+                # but before updating stream_index.json, we get some
+                # messages again; don't store them twice.
+                old = [msg for msg in old if msg["id"] < m[0]["id"]]
             new_topic_data = {
                 "size": len(m) + len(old),
                 "latest_date": m[-1]["timestamp"],
             }
-            js["streams"][s["name"]]["topic_data"][topic_name] = new_topic_data
-            dump_topic_messages(json_root, s, topic_name, old + m)
+            stream_data["topic_data"][topic_name] = new_topic_data
+            dump_topic_messages(
+                json_root, s, topic_name, old + m, cache_format, cache_compression
+            )
+            if on_topic is not None:
+                on_topic(s, topic_name, old + m)
+        metrics.record_stream_duration("fetch", s["name"], time.perf_counter() - start)
 
     js["time"] = time.time()
-    dump_stream_index(json_root, js)
+    dump_stream_index(json_root, js, cache_format, cache_compression)
 
 
-def dump_stream_index(json_root, js):
+def dump_stream_index(json_root, js, cache_format="json", cache_compression=None):
     if not ("streams" in js and "time" in js):
         raise Exception("programming error")
 
-    out = open_outfile(json_root, Path("stream_index.json"), "w")
-    dump_json(js, out)
+    manifest_streams = {}
+
+    with phase("index_dump"):
+        for stream_name, stream_data in js["streams"].items():
+            entry = {k: v for k, v in stream_data.items() if k != "topic_data"}
+            if "topic_data" in stream_data:
+                entry["num_topics"] = len(stream_data["topic_data"])
+                dump_stream_topic_data(
+                    json_root, stream_name, stream_data, cache_format, cache_compression
+                )
+            manifest_streams[stream_name] = entry
+
+        # The topic files (and shards) have to be in place before the
+        # index that points at them.
+        durability_barrier()
+
+        manifest = dict(streams=manifest_streams, time=js["time"])
+        out = open_outfile(json_root, Path("stream_index.json"), "wb")
+        dump_json(manifest, out, cache_format, cache_compression)
+        out.close()
+        metrics.record_file(out)
+        durability_barrier()
+
+
+def dump_stream_topic_data(
+    json_root, stream_name, stream_data, cache_format, cache_compression
+):
+    shard = dict(
+        name=stream_name,
+        id=stream_data["id"],
+        topic_data=stream_data["topic_data"],
+    )
+    shard_path = stream_index_shard_path(json_root, stream_name, stream_data["id"])
+    out = open_outfile(shard_path.parent, shard_path.name, "wb")
+    dump_json(shard, out, cache_format, cache_compression)
     out.close()
+    metrics.record_file(out)
 
 
-def dump_topic_messages(json_root, stream_data, topic_name, message_data):
+def dump_topic_messages(
+    json_root,
+    stream_data,
+    topic_name,
+    message_data,
+    cache_format="json",
+    cache_compression=None,
+):
     stream_name = stream_data["name"]
     stream_id = stream_data["stream_id"]
     sanitized_stream_name = sanitize_stream(stream_name, stream_id)
@@ -260,10 +356,13 @@ def dump_topic_messages(json_root, stream_data, topic_name, message_data):
     sanitized_topic_name = sanitize(topic_name)
     topic_fn = sanitized_topic_name + ".json"
 
-    out = open_outfile(stream_dir, topic_fn, "w")
-    msgs = [slim_message(m) for m in message_data]
-    dump_json(msgs, out)
-    out.close()
+    with phase("topic_write"):
+        out = open_outfile(stream_dir, topic_fn, "wb")
+        msgs = [slim_message(m) for m in message_data]
+        dump_json(msgs, out, cache_format, cache_compression)
+        out.close()
+    metrics.incr("topics_rewritten")
+    metrics.record_file(out)
 
 
 def slim_message(msg):
@@ -271,6 +370,7 @@ def slim_message(msg):
         "content",
         "id",
         "sender_full_name",
+        "sender_id",
         "timestamp",
     ]
     return {k: v for k, v in msg.items() if k in fields}
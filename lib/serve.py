@@ -0,0 +1,394 @@
+"""
+Instead of building every page up front, you can serve the archive
+straight from the JSON cache:
+
+    python3 archive.py --serve 4000
+
+and the pages get rendered (with the same code as `archive.py -b`)
+when somebody asks for them, at the same URLs as the built website:
+
+    http://127.0.0.1:4000/<html_root>/index.html
+    http://127.0.0.1:4000/<html_root>/stream/213222-general/index.html
+    http://127.0.0.1:4000/<html_root>/stream/213222-general/topic/hello.html
+
+(The site_url in settings.py should point at the server, since the
+topic pages link to it.)
+
+We keep the pages we rendered in an LRU cache of up to
+MAX_CACHE_BYTES.  Each page is cached along with what it was built
+from: the index's time for the main page, the stream's latest_id
+and number of topics for a stream page, and the topic's size and
+latest_date for a topic page.  So when `archive.py -i` updates the
+cache (we notice when stream_index.json changes), only the pages
+with something new get rendered again.  (A cached topic page keeps
+its "Last updated" footer from when we rendered it.)
+
+See benchmarks/loadtest.py for measuring how many requests per
+second this can handle.
+"""
+
+import http.server
+import io
+import mimetypes
+import os
+import threading
+import urllib.parse
+from collections import OrderedDict
+from pathlib import Path
+
+from .files import (
+    iter_zulip_messages_for_topic,
+    read_zulip_stream_info,
+    read_zulip_topic_data,
+)
+from .html import (
+    last_updated_footer_html,
+    stream_list_page_html,
+    topic_list_page_html,
+)
+from .url import archive_stream_url, sanitize, sanitize_stream
+from .website import write_topic_page
+
+MAX_CACHE_BYTES = 256 << 20
+
+# Only this machine, unless you ask for more with --host.
+DEFAULT_HOST = "127.0.0.1"
+
+
+class PageCache:
+    """
+    An LRU cache of rendered pages, by URL path, that holds up to
+    `max_bytes` of them.  A page only counts as cached if it was
+    rendered from the same `version` we ask for.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.pages = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, version):
+        with self.lock:
+            entry = self.pages.get(path)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.pages.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path, version, body):
+        with self.lock:
+            old = self.pages.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(body) > self.max_bytes:
+                return
+            self.pages[path] = (version, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.pages.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class ArchiveIndex:
+    """
+    stream_index.json, which we read again whenever it changes, and
+    the topic data of the streams we've needed so far.  (Request
+    threads read all of it under `lock`, since `refresh` can replace
+    it at any time.)
+    """
+
+    def __init__(self, json_root):
+        self.json_root = json_root
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.refresh()
+
+    def index_mtime(self):
+        try:
+            return os.stat(os.fspath(self.json_root / "stream_index.json")).st_mtime_ns
+        except FileNotFoundError:
+            # only in a snapshot, which doesn't change under us
+            return None
+
+    def refresh(self):
+        mtime = self.index_mtime()
+        with self.lock:
+            if self.mtime == mtime and self.mtime is not None:
+                return
+            self.stream_info = read_zulip_stream_info(self.json_root)
+            self.date_footer_html = last_updated_footer_html(self.stream_info)
+            self.stream_names = {
+                sanitize_stream(stream_name, stream_data["id"]): stream_name
+                for stream_name, stream_data in self.stream_info["streams"].items()
+            }
+            # stream name -> (topic data, sanitized topic name -> topic name)
+            self.topics = {}
+            self.mtime = mtime
+
+    def main(self):
+        """
+        Returns the stream info and the "Last updated" footer.
+        """
+        with self.lock:
+            return self.stream_info, self.date_footer_html
+
+    def stream(self, sanitized_stream_name):
+        with self.lock:
+            stream_name = self.stream_names.get(sanitized_stream_name)
+            if stream_name is None:
+                return None, None
+            return stream_name, self.stream_info["streams"][stream_name]
+
+    def topic_data(self, stream_name, stream_data):
+        """
+        `stream_data` is what `stream` returned, in case the index
+        changed since.
+        """
+        with self.lock:
+            if stream_name not in self.topics:
+                topic_data = read_zulip_topic_data(
+                    self.json_root, stream_name, stream_data
+                )
+                topic_names = {sanitize(name): name for name in topic_data}
+                self.topics[stream_name] = (topic_data, topic_names)
+            return self.topics[stream_name]
+
+
+class ArchiveServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        json_root,
+        site_url,
+        html_root,
+        title,
+        zulip_url,
+        zulip_icon_url,
+        repo_root,
+        page_head_html,
+        page_footer_html,
+        max_cache_bytes=MAX_CACHE_BYTES,
+    ):
+        super().__init__(address, ArchiveRequestHandler)
+        self.index = ArchiveIndex(json_root)
+        self.cache = PageCache(max_cache_bytes)
+        self.json_root = json_root
+        self.site_url = site_url
+        self.html_root = html_root
+        self.title = title
+        self.zulip_url = zulip_url
+        self.zulip_icon_url = zulip_icon_url
+        self.repo_root = Path(repo_root)
+        self.page_head_html = page_head_html
+        self.page_footer_html = page_footer_html
+
+    def main_page(self):
+        stream_info, date_footer_html = self.index.main()
+        version = stream_info["time"]
+
+        def render():
+            return (
+                self.page_head_html
+                + stream_list_page_html(stream_info["streams"])
+                + date_footer_html
+                + self.page_footer_html
+            )
+
+        return version, render
+
+    def stream_page(self, sanitized_stream_name):
+        index = self.index
+        stream_name, stream_data = index.stream(sanitized_stream_name)
+        if stream_name is None:
+            return None, None
+        version = (stream_data["latest_id"], stream_data["num_topics"])
+
+        def render():
+            topic_data, _ = index.topic_data(stream_name, stream_data)
+            _, date_footer_html = index.main()
+            stream_url = archive_stream_url(
+                self.site_url, self.html_root, sanitized_stream_name
+            )
+            return (
+                self.page_head_html
+                + topic_list_page_html(stream_name, stream_url, topic_data)
+                + date_footer_html
+                + self.page_footer_html
+            )
+
+        return version, render
+
+    def topic_page(self, sanitized_stream_name, sanitized_topic_name):
+        index = self.index
+        stream_name, stream_data = index.stream(sanitized_stream_name)
+        if stream_name is None:
+            return None, None
+        topic_data, topic_names = index.topic_data(stream_name, stream_data)
+        topic_name = topic_names.get(sanitized_topic_name)
+        if topic_name is None:
+            return None, None
+        topic = topic_data[topic_name]
+        version = (topic["size"], topic["latest_date"])
+
+        def render():
+            _, date_footer_html = index.main()
+            out = io.StringIO()
+            write_topic_page(
+                out,
+                self.site_url,
+                self.html_root,
+                self.title,
+                self.zulip_url,
+                self.zulip_icon_url,
+                stream_name,
+                stream_data["id"],
+                topic_name,
+                iter_zulip_messages_for_topic(
+                    self.json_root, sanitized_stream_name, sanitized_topic_name
+                ),
+                date_footer_html,
+                self.page_footer_html,
+            )
+            return out.getvalue()
+
+        return version, render
+
+    def page(self, path):
+        """
+        Returns (version, render function) for the page at `path`
+        (relative to html_root), or (None, None) if there's no such
+        page.
+        """
+        parts = path.split("/")
+        if path == "index.html":
+            return self.main_page()
+        if len(parts) == 3 and parts[0] == "stream" and parts[2] == "index.html":
+            return self.stream_page(parts[1])
+        if (
+            len(parts) == 4
+            and parts[0] == "stream"
+            and parts[2] == "topic"
+            and parts[3].endswith(".html")
+        ):
+            return self.topic_page(parts[1], parts[3][: -len(".html")])
+        return None, None
+
+    def static_file(self, path):
+        """
+        style.css and assets/, from the repo (like `build_website`
+        copies them).
+        """
+        if path == "style.css" or (
+            path.startswith("assets/") and ".." not in path.split("/")
+        ):
+            file_path = self.repo_root / path
+            if file_path.is_file():
+                return file_path
+        return None
+
+
+class ArchiveRequestHandler(http.server.BaseHTTPRequestHandler):
+    # keep-alive, so that clients don't pay for a connection per page
+    protocol_version = "HTTP/1.1"
+    # (otherwise the body waits ~40ms behind the headers for an ACK)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        path = urllib.parse.urlsplit(self.path).path.lstrip("/")
+        prefix = server.html_root.strip("/")
+        if prefix:
+            if path == prefix:
+                path = ""
+            elif path.startswith(prefix + "/"):
+                path = path[len(prefix) + 1 :]
+            elif path != "style.css":
+                # (the topic pages link to <site_url>/style.css)
+                self.send_error(404)
+                return
+
+        if path == "" or path.endswith("/"):
+            # (so that "stream/x/" and "stream/x/index.html" share a cache entry)
+            path += "index.html"
+
+        file_path = server.static_file(path)
+        if file_path is not None:
+            content_type = mimetypes.guess_type(file_path.name)[0]
+            self.respond(
+                file_path.read_bytes(), content_type or "application/octet-stream"
+            )
+            return
+
+        server.index.refresh()
+        version, render = server.page(path)
+        if render is None:
+            self.send_error(404)
+            return
+        body = server.cache.get(path, version)
+        cache_status = "hit"
+        if body is None:
+            cache_status = "miss"
+            body = render().encode("utf-8")
+            server.cache.put(path, version, body)
+        self.respond(body, "text/html; charset=utf-8", cache_status)
+
+    def respond(self, body, content_type, cache_status=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if cache_status is not None:
+            self.send_header("X-Cache", cache_status)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(
+    port,
+    json_root,
+    site_url,
+    html_root,
+    title,
+    zulip_url,
+    zulip_icon_url,
+    repo_root,
+    page_head_html,
+    page_footer_html,
+    host=DEFAULT_HOST,
+    max_cache_bytes=MAX_CACHE_BYTES,
+):
+    """
+    Serves the archive on `host`:`port` until you hit ^C; the other
+    arguments are the ones `ArchiveServer` takes.
+    """
+    server = ArchiveServer(
+        (host, port),
+        json_root,
+        site_url,
+        html_root,
+        title,
+        zulip_url,
+        zulip_icon_url,
+        repo_root,
+        page_head_html,
+        page_footer_html,
+        max_cache_bytes,
+    )
+    print(f"serving the archive at http://{host}:{port}/{html_root.strip('/')}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        cache = server.cache
+        print(f"page cache: {cache.hits} hits, {cache.misses} misses")
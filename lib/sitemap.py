@@ -1,8 +1,13 @@
+import os
+import tempfile
 from glob import iglob
+from pathlib import Path
 from typing import Iterator
 
 from xml_sitemap_writer import XMLSitemap
 
+from .common import copy_outfile
+
 
 def build_sitemap(base_url: str, archive_dir_path: str, sitemap_write_dir_path: str):
     def iterate_html_files() -> Iterator[str]:
@@ -14,3 +19,17 @@ def build_sitemap(base_url: str, archive_dir_path: str, sitemap_write_dir_path:
 
     with XMLSitemap(sitemap_write_dir_path, base_url) as sitemap:
         sitemap.add_urls(iterate_html_files())
+
+
+def build_sink_sitemap(base_url: str, md_root):
+    """
+    Like build_sitemap, for an md_root in an output sink (see
+    lib/files.py).  XMLSitemap only writes to a directory, so we let it
+    write to a temporary one and copy the (few) sitemap files over.
+    """
+    html_files = (name for name in md_root.sink.names if name.endswith(".html"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with XMLSitemap(tmp_dir, base_url) as sitemap:
+            sitemap.add_urls(html_files)
+        for filename in sorted(os.listdir(tmp_dir)):
+            copy_outfile(Path(tmp_dir) / filename, md_root / filename)
@@ -0,0 +1,148 @@
+"""
+A snapshot is the whole JSON cache (see lib/files.py) packed into a
+single zip file.  Moving one big file around (in a CI cache, say) is
+a lot faster than moving hundreds of thousands of small ones.
+
+You don't have to unpack a snapshot to use it.  `open_snapshot` gives
+you a json_root that reads files from the snapshot, unless they
+exist in a real directory next to it, and writes to that directory:
+
+    json_root = open_snapshot(snapshot_path, json_directory)
+    populate_incremental(client, json_root, ...)  # writes what changed
+    pack_snapshot(json_root, snapshot_path)       # folds it back in
+
+so an incremental update only touches the files that got new
+messages.  zip files have an index at the end, so we can read any
+file in the snapshot without reading the ones before it.
+
+Cache files that are already compressed (see lib/cache_format.py)
+get stored as is; the rest get deflated.
+"""
+
+import os
+import posixpath
+import zipfile
+from pathlib import Path
+
+from .cache_format import GZIP_MAGIC, ZSTD_MAGIC
+from .common import fsync_path, is_temp_file
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.zip = zipfile.ZipFile(self.path)
+        self.files = set()
+        self.dirs = set()
+        for name in self.zip.namelist():
+            self.files.add(name)
+            parent = posixpath.dirname(name)
+            while parent and parent not in self.dirs:
+                self.dirs.add(parent)
+                parent = posixpath.dirname(parent)
+
+
+class SnapshotPath(os.PathLike):
+    """
+    A path within json_root, for a json_root from `open_snapshot`.
+    It supports just what our readers and writers use of Path.
+    """
+
+    def __init__(self, path, snapshot, key):
+        self.path = path
+        self.snapshot = snapshot
+        self.key = key
+
+    def __fspath__(self):
+        return os.fspath(self.path)
+
+    def __str__(self):
+        return str(self.path)
+
+    def __truediv__(self, other):
+        other = Path(other).as_posix()
+        key = posixpath.join(self.key, other) if self.key else other
+        return SnapshotPath(self.path / other, self.snapshot, key)
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def parent(self):
+        return SnapshotPath(
+            self.path.parent, self.snapshot, posixpath.dirname(self.key)
+        )
+
+    def with_name(self, name):
+        return self.parent / name
+
+    def exists(self):
+        return (
+            self.path.exists()
+            or self.key in self.snapshot.files
+            or self.key in self.snapshot.dirs
+        )
+
+    def open(self, mode="r", **kwargs):
+        if mode == "rb" and not self.path.exists() and self.key in self.snapshot.files:
+            return self.snapshot.zip.open(self.key)
+        return self.path.open(mode, **kwargs)
+
+
+def open_snapshot(snapshot_path, json_directory):
+    return SnapshotPath(Path(json_directory), Snapshot(snapshot_path), "")
+
+
+def cache_files(json_root):
+    """
+    Returns a dict mapping the name of every file in the cache (like
+    "213222general/47413hello.json") to where to read it from.
+    """
+    files = {}
+    if isinstance(json_root, SnapshotPath):
+        snapshot = json_root.snapshot
+        for name in snapshot.files:
+            files[name] = (snapshot.zip, name)
+        json_root = json_root.path
+
+    for dir_path, _, filenames in os.walk(json_root):
+        for filename in filenames:
+            if is_temp_file(filename):
+                # left over from a crash; see open_outfile
+                continue
+            path = Path(dir_path) / filename
+            files[path.relative_to(json_root).as_posix()] = (None, path)
+    return files
+
+
+def pack_snapshot(json_root, snapshot_path):
+    snapshot_path = Path(snapshot_path)
+    tmp_path = snapshot_path.with_name("." + snapshot_path.name + ".tmp")
+    files = cache_files(json_root)
+
+    with zipfile.ZipFile(tmp_path, "w") as zf:
+        # Sorted, so that a snapshot of the same cache is the same file.
+        for name in sorted(files):
+            source, path = files[name]
+            if source is None:
+                data = path.read_bytes()
+            else:
+                data = source.read(path)
+            if data.startswith(GZIP_MAGIC) or data.startswith(ZSTD_MAGIC):
+                compress_type = zipfile.ZIP_STORED
+            else:
+                compress_type = zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.external_attr = 0o644 << 16
+            zf.writestr(info, data, compress_type=compress_type)
+
+    fsync_path(tmp_path)
+    os.replace(tmp_path, snapshot_path)
+    print(f"packed {len(files)} files into {snapshot_path}")
+
+
+def restore_snapshot(snapshot_path, json_directory):
+    with zipfile.ZipFile(snapshot_path) as zf:
+        zf.extractall(json_directory)
+        print(f"restored {len(zf.namelist())} files into {json_directory}")
@@ -0,0 +1,122 @@
+"""
+Normally `archive.py -b` writes straight into the html directory, so
+while a long build runs, your site is a mix of old and new pages (and
+a build that dies halfway leaves it that way).  With --staging:
+
+    python3 archive.py -b --staging
+
+we build into a new directory instead, and then swap it in at the
+end, all at once.  The html directory becomes a symlink to the
+current build, next to the builds themselves:
+
+    <html_directory> -> <html_directory>.builds/20240101-120000
+    <html_directory>.builds
+        20231231-120000      (the previous build)
+        20240101-120000
+
+The new build starts out as a copy of the current one made of hard
+links, which is fast and takes no extra space; since we always
+replace files rather than write into them (see `open_outfile`), the
+pages we rebuild never touch the live ones.
+
+The swap itself is a rename of a symlink, which is atomic.  (The
+first time, your html directory is a real directory, and we have to
+move it into <html_directory>.builds before we can put the symlink
+in its place.)
+
+We keep the previous build around, for anybody who is in the middle
+of loading a page from it, and delete anything older.
+"""
+
+import os
+import shutil
+import time
+from pathlib import Path
+
+from .common import durability_barrier, fsync_dir
+
+STAGING_SUFFIX = ".staging"
+
+
+def builds_dir(md_root):
+    return md_root.with_name(md_root.name + ".builds")
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # say, a file system without hard links
+        shutil.copy2(src, dst)
+
+
+def start_staging(md_root):
+    """
+    Returns a new build directory, which starts out with (hard links
+    to) everything in md_root.
+    """
+    builds = builds_dir(Path(os.path.abspath(md_root)))
+    builds.mkdir(exist_ok=True)
+
+    for path in builds.iterdir():
+        if path.name.endswith(STAGING_SUFFIX):
+            print(f"removing {path}, from a build that didn't finish")
+            shutil.rmtree(path)
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    name = stamp
+    suffix = 1
+    while (builds / name).exists():
+        # two builds in the same second
+        suffix += 1
+        name = f"{stamp}-{suffix}"
+    staging = builds / (name + STAGING_SUFFIX)
+    print(f"building into {staging}")
+    if md_root.exists():
+        shutil.copytree(md_root, staging, symlinks=True, copy_function=link_or_copy)
+    else:
+        staging.mkdir()
+    return staging
+
+
+def unlink_sitemaps(staging):
+    # The sitemap library writes into existing files, which in a
+    # staging directory are hard links to the live ones.
+    for path in staging.glob("sitemap*.xml*"):
+        path.unlink()
+
+
+def finish_staging(md_root, staging):
+    """
+    Makes the build in `staging` the live one, and cleans up older
+    builds.
+    """
+    durability_barrier()
+
+    md_root = Path(os.path.abspath(md_root))
+    builds = staging.parent
+    build = staging.with_name(staging.name[: -len(STAGING_SUFFIX)])
+    os.rename(staging, build)
+
+    # We keep the build that is live right now.
+    keep = {build.name}
+    if md_root.is_symlink():
+        keep.add(Path(os.readlink(md_root)).name)
+    elif md_root.exists():
+        previous = builds / (build.name + ".old")
+        os.rename(md_root, previous)
+        keep.add(previous.name)
+    # (the renames have to be on disk before the link to them is)
+    fsync_dir(builds)
+
+    tmp_link = md_root.with_name("." + md_root.name + ".tmp")
+    if tmp_link.is_symlink():
+        tmp_link.unlink()
+    os.symlink(os.path.relpath(build, md_root.parent), tmp_link)
+    os.replace(tmp_link, md_root)
+    fsync_dir(md_root.parent)
+    print(f"{md_root} now points to {build}")
+
+    for path in builds.iterdir():
+        if path.name not in keep:
+            shutil.rmtree(path)
@@ -0,0 +1,216 @@
+"""
+Optional per-phase timing and profiling, for figuring out why
+a run was slow.
+
+The rest of the code marks out its phases like this:
+
+    with phase("topic_write"):
+        ...
+
+When timing is off (the default) `phase` does nothing.  When
+archive.py is run with `--timings` or `--profile`, we record wall
+time, CPU time and peak memory for every phase, and with `--profile`
+we also collect a separate cProfile for each phase.
+
+Phases can nest (for example, reading a topic's JSON happens while
+we render its page).  Time is charged to the innermost phase only,
+so the numbers for all phases add up to the time spent in phases.
+
+Each thread has its own phases (with --pipeline, pages get rendered
+in other threads while the main thread fetches), and CPU time is the
+thread's own, so with threads the phases can add up to more wall
+time than the run took.  We only profile the main thread.  With
+--orgs the builds run in other processes, which time their own phases
+and send them back to be added to ours (they don't profile).
+
+The phases we use are:
+
+    stream_fetch:  talking to the Zulip API
+    topic_read:    reading topic JSON files
+    topic_write:   writing topic JSON files
+    index_load:    reading stream_index.json
+    index_dump:    writing stream_index.json
+    page_render:   building HTML pages
+    asset_copy:    copying CSS and other static assets
+    uploads:       downloading uploads (--mirror-uploads)
+    sitemap:       building the sitemap
+"""
+
+import cProfile
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+_enabled = False
+_profile_dir = None
+_run_start = None
+
+# phase name -> accumulated stats (see _new_stats)
+_stats = {}
+
+# phase name -> cProfile.Profile, when profiling
+_profilers = {}
+
+# Each thread's `stack` has an entry [name, wall_start, cpu_start] for
+# each of its active phases.
+_local = threading.local()
+
+_lock = threading.Lock()
+
+
+def enable(profile_dir=None):
+    global _enabled, _profile_dir, _run_start
+    _enabled = True
+    _profile_dir = profile_dir
+    _run_start = (time.perf_counter(), time.process_time())
+
+
+def is_enabled():
+    return _enabled
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def _new_stats():
+    return dict(calls=0, wall_seconds=0.0, cpu_seconds=0.0, peak_rss_mb=0.0)
+
+
+def _in_main_thread():
+    return threading.current_thread() is threading.main_thread()
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _pause(entry, wall, cpu):
+    name, wall_start, cpu_start = entry
+    with _lock:
+        stats = _stats.setdefault(name, _new_stats())
+        stats["wall_seconds"] += wall - wall_start
+        stats["cpu_seconds"] += cpu - cpu_start
+    if name in _profilers and _in_main_thread():
+        _profilers[name].disable()
+
+
+def _resume(entry, wall, cpu):
+    entry[1] = wall
+    entry[2] = cpu
+    if entry[0] in _profilers and _in_main_thread():
+        _profilers[entry[0]].enable()
+
+
+@contextmanager
+def phase(name):
+    if not _enabled:
+        yield
+        return
+
+    stack = _stack()
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    if stack:
+        _pause(stack[-1], wall, cpu)
+
+    if _profile_dir is not None and name not in _profilers and _in_main_thread():
+        _profilers[name] = cProfile.Profile()
+
+    entry = [name, wall, cpu]
+    stack.append(entry)
+    _resume(entry, wall, cpu)
+    try:
+        yield
+    finally:
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        stack.pop()
+        _pause(entry, wall, cpu)
+
+        with _lock:
+            stats = _stats[name]
+            stats["calls"] += 1
+            # The high-water mark only ever goes up, so this tells us
+            # which phase pushed the process to its peak.
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], peak_rss_mb())
+
+        if stack:
+            _resume(stack[-1], wall, cpu)
+
+
+def merge(phases):
+    """
+    Adds the phases from another process's `summary` (see lib/orgs.py)
+    to ours.
+    """
+    with _lock:
+        for name, other in phases.items():
+            stats = _stats.setdefault(name, _new_stats())
+            for key in ["calls", "wall_seconds", "cpu_seconds"]:
+                stats[key] += other[key]
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], other["peak_rss_mb"])
+
+
+def summary():
+    wall_start, cpu_start = _run_start
+    return dict(
+        total=dict(
+            wall_seconds=time.perf_counter() - wall_start,
+            cpu_seconds=time.process_time() - cpu_start,
+            peak_rss_mb=peak_rss_mb(),
+        ),
+        phases=_stats,
+    )
+
+
+def print_summary(js):
+    print("\nTimings:\n")
+    print(
+        f"    {'phase':<14} {'calls':>8} {'wall (s)':>10} {'cpu (s)':>10} {'peak RSS (MB)':>14}"
+    )
+    for name, stats in sorted(
+        js["phases"].items(), key=lambda item: item[1]["wall_seconds"], reverse=True
+    ):
+        print(
+            f"    {name:<14} {stats['calls']:>8} {stats['wall_seconds']:>10.2f} "
+            f"{stats['cpu_seconds']:>10.2f} {stats['peak_rss_mb']:>14.1f}"
+        )
+    total = js["total"]
+    print(
+        f"    {'total':<14} {'':>8} {total['wall_seconds']:>10.2f} "
+        f"{total['cpu_seconds']:>10.2f} {total['peak_rss_mb']:>14.1f}"
+    )
+
+
+def finish(timings_file=None):
+    """
+    Called at the end of the run: prints the summary, and writes it
+    (and the per-phase profiles, if any) to disk.
+    """
+    if not _enabled:
+        return
+
+    js = summary()
+    print_summary(js)
+
+    if _profile_dir is not None:
+        profile_dir = Path(_profile_dir)
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        for name, profiler in _profilers.items():
+            profiler.dump_stats(str(profile_dir / (name + ".prof")))
+        print(f"\nWrote per-phase profiles to {profile_dir}/<phase>.prof")
+
+    if timings_file is not None:
+        with Path(timings_file).open("w", encoding="utf-8") as f:
+            json.dump(js, f, indent=4, sort_keys=True)
@@ -0,0 +1,300 @@
+"""
+Messages link to uploaded files and image previews on the Zulip
+server (like /user_uploads/2/ab/cat.png, or /thumbnail?url=...),
+which the topic pages resolve through their <base href>.  That makes
+the pages slow to load, and the images break for visitors who
+aren't logged in to Zulip.  With --mirror-uploads:
+
+    python3 archive.py -b --mirror-uploads
+
+we download everything the messages link to on the Zulip server
+into the website, and point the links at our copies instead.
+
+Downloads are named by the sha256 of their contents, so the same
+file uploaded twice (or linked as both the upload and its preview)
+is only stored once:
+
+    <md_root>
+        uploads
+            3f
+                3f9a...e1.png
+
+We remember what we downloaded in uploads.json in the JSON
+directory, mapping each link to the file we stored, so the next run
+only downloads links it hasn't seen.  Until the build is over, each
+finished download also gets a line in uploads.log, so a run that
+gets interrupted picks up where it left off.  Links that fail get
+retried on the next few runs, and keep pointing at Zulip meanwhile.
+
+We find the links as the build reads the messages (see
+`UploadMirror`), and download them in a pool of threads, since they
+mostly wait on the network, while the build goes on.  The few pages
+that link to something new get written again once it's downloaded.
+"""
+
+import base64
+import hashlib
+import html
+import json
+import mimetypes
+import posixpath
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from .cache_format import load_file
+from .common import durability_barrier, fsync_dir, fsync_path, open_outfile
+
+# href/src attributes with a path on the Zulip server that serves
+# uploads or image previews.
+UPLOAD_RE = re.compile(
+    r'\b(href|src)="(/(?:user_uploads/|thumbnail\?|external_content/)[^"]*)"'
+)
+
+UPLOADS_DIR = "uploads"
+STATE_FILE = "uploads.json"
+JOURNAL_FILE = "uploads.log"
+
+DEFAULT_THREADS = 8
+TIMEOUT = 60
+MAX_ATTEMPTS = 3
+
+# How much of a download we hold in memory at a time.
+CHUNK_SIZE = 1 << 16
+
+EXT_RE = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+
+def find_uploads(content):
+    """
+    Returns the (HTML-escaped) upload paths that message `content`
+    links to.
+    """
+    return [m.group(2) for m in UPLOAD_RE.finditer(content)]
+
+
+def rewrite_uploads(content, uploads, uploads_url):
+    """
+    Points the links in message `content` that we have in `uploads`
+    (upload path -> stored name) at our copies under `uploads_url`.
+    """
+
+    def replace(m):
+        stored = uploads.get(m.group(2))
+        if stored is None:
+            return m.group(0)
+        return f'{m.group(1)}="{uploads_url}/{stored}"'
+
+    return UPLOAD_RE.sub(replace, content)
+
+
+def read_state(json_root):
+    path = json_root / STATE_FILE
+    if path.exists():
+        state = load_file(path)
+    else:
+        state = dict(files={}, failed={})
+
+    # What an interrupted run downloaded after it last saved the
+    # state.  (The last line may be cut off, if it crashed while
+    # writing it.)
+    journal_path = os.fspath(json_root / JOURNAL_FILE)
+    if os.path.exists(journal_path):
+        with open(journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                state["files"][entry["path"]] = entry["name"]
+                state["failed"].pop(entry["path"], None)
+    return state
+
+
+def write_state(json_root, state):
+    # The state must never refer to a file that isn't on disk yet.
+    durability_barrier()
+    out = open_outfile(json_root, STATE_FILE, "w")
+    json.dump(state, out, indent=2, sort_keys=True)
+    out.close()
+    durability_barrier()
+    # Everything in the journal is in the state now.
+    journal_path = os.fspath(json_root / JOURNAL_FILE)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+
+
+def stored_name(digest, upload_path, content_type):
+    ext = posixpath.splitext(urllib.parse.urlparse(upload_path).path)[1].lower()
+    if not EXT_RE.match(ext):
+        ext = mimetypes.guess_extension(content_type or "") or ""
+    return f"{digest[:2]}/{digest}{ext}"
+
+
+def download(zulip_url, upload_path, auth, out):
+    """
+    Writes the upload at `upload_path` to the file `out`, a chunk at
+    a time, and returns (sha256 hex digest, content type).  This runs
+    in the thread pool.
+    """
+    # We import this here, since every build uses `rewrite_uploads`
+    # but only --mirror-uploads downloads anything.
+    import urllib.request
+
+    url = urllib.parse.urljoin(zulip_url, html.unescape(upload_path))
+    request = urllib.request.Request(url)
+    if auth is not None:
+        # Zulip accepts the API key for uploads, like for the API.
+        request.add_unredirected_header("Authorization", auth)
+    digest = hashlib.sha256()
+    with urllib.request.urlopen(request, timeout=TIMEOUT) as rsp:
+        while True:
+            chunk = rsp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+        return digest.hexdigest(), rsp.headers.get_content_type()
+
+
+def basic_auth(email, api_key):
+    token = base64.b64encode(f"{email}:{api_key}".encode()).decode()
+    return f"Basic {token}"
+
+
+class UploadMirror:
+    """
+    Mirrors uploads while the build reads the messages: pass it to
+    the build as its `uploads`.  `rewrite_uploads` looks each link up
+    with `get`, which returns our copy, or starts downloading the link
+    in the thread pool (and returns None, so the link keeps pointing at
+    Zulip for now).  After each page, the build asks `missed` whether
+    the page linked to anything we were still downloading, and writes
+    those pages again after `finish` has waited for the downloads.
+    `auth` is an Authorization header value (see `basic_auth`), if
+    the uploads need one.
+    """
+
+    def __init__(self, json_root, md_root, zulip_url, auth=None, threads=None):
+        self.json_root = json_root
+        self.uploads_root = Path(md_root) / UPLOADS_DIR
+        self.zulip_url = zulip_url
+        self.auth = auth
+        self.state = read_state(json_root)
+        self.files = self.state["files"]
+        self.failed = self.state["failed"]
+
+        # Every link we've looked up, and the ones being downloaded.
+        self.seen = set()
+        self.downloading = {}
+        self.missed_any = False
+
+        # (stored names written this run, and the journal; see `fetch`)
+        self.written = set()
+        self.written_lock = threading.Lock()
+        self.journal = None
+        self.num_bytes = 0
+        self.start = time.perf_counter()
+        self.pool = ThreadPoolExecutor(max_workers=threads or DEFAULT_THREADS)
+
+    def get(self, path):
+        if path not in self.seen:
+            self.seen.add(path)
+            name = self.files.get(path)
+            if name is not None and not (self.uploads_root / name).exists():
+                del self.files[path]
+            if path not in self.files and self.failed.get(path, 0) < MAX_ATTEMPTS:
+                future = self.pool.submit(self.fetch, path)
+                self.downloading[path] = future
+        if path in self.downloading:
+            self.missed_any = True
+        return self.files.get(path)
+
+    def missed(self):
+        """
+        Whether we were still downloading anything that got looked up
+        since the last call.
+        """
+        missed, self.missed_any = self.missed_any, False
+        return missed
+
+    def fetch(self, path):
+        """
+        Downloads `path` and stores it; returns the stored name.  This
+        runs in the thread pool.
+
+        We don't know the name until we have the whole file, so we
+        download into a temp file (named like `open_outfile`'s, so
+        that a crash doesn't leave it behind for good), and move it
+        into place ourselves.
+        """
+        self.uploads_root.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.uploads_root, prefix=".download-", suffix=".tmp", delete=False
+        ) as out:
+            try:
+                digest, content_type = download(self.zulip_url, path, self.auth, out)
+            except BaseException:
+                out.close()
+                os.remove(out.name)
+                raise
+            num_bytes = out.tell()
+        name = stored_name(digest, path, content_type)
+        stored_path = self.uploads_root / name
+        with self.written_lock:
+            is_new = name not in self.written
+            self.written.add(name)
+        if is_new and not stored_path.exists():
+            fsync_path(out.name)
+            stored_path.parent.mkdir(exist_ok=True)
+            os.replace(out.name, stored_path)
+            fsync_dir(stored_path.parent)
+            with self.written_lock:
+                self.num_bytes += num_bytes
+        else:
+            os.remove(out.name)
+        self.record(path, name)
+        return name
+
+    def record(self, path, name):
+        """
+        Adds a finished download to the journal (see `read_state`).
+        """
+        line = json.dumps(dict(path=path, name=name)) + "\n"
+        with self.written_lock:
+            if self.journal is None:
+                journal_path = os.fspath(self.json_root / JOURNAL_FILE)
+                self.journal = open(journal_path, "a", encoding="utf-8")
+            self.journal.write(line)
+            self.journal.flush()
+
+    def finish(self):
+        """
+        Waits for the downloads, and saves what we have in uploads.json
+        (which replaces the journal).
+        """
+        print(f"uploads: {len(self.seen)} linked, {len(self.downloading)} to download")
+        futures = {future: path for path, future in self.downloading.items()}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                self.files[path] = future.result()
+                self.failed.pop(path, None)
+            # (urllib's URLError is an OSError)
+            except (OSError, ValueError) as e:
+                self.failed[path] = self.failed.get(path, 0) + 1
+                print(f"could not download {path}: {e}")
+        self.pool.shutdown()
+        self.downloading = {}
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        write_state(self.json_root, self.state)
+        seconds = time.perf_counter() - self.start
+        print(f"uploads: downloaded {self.num_bytes} bytes in {seconds:.1f}s")
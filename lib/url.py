@@ -64,6 +64,14 @@ def archive_message_url(
     return f"{topic_url}#{msg_id}"
 
 
+def archive_uploads_url(site_url, html_root):
+    """
+    http://127.0.0.1:4000/archive/uploads
+    """
+    base_url = urllib.parse.urljoin(site_url, html_root)
+    return f"{base_url}/uploads"
+
+
 ## String cleaning functions
 
 
@@ -0,0 +1,271 @@
+"""
+This module checks that the JSON cache and the website agree with
+each other, which is mostly useful after a run got interrupted:
+
+    python3 archive.py --verify
+
+For every topic in the stream index, we check that its JSON file
+exists and has the number of messages and latest date the index
+says, and that none of its messages are newer than the stream's
+`latest_id`.  Then we check that the topic has a page that is newer
+than its JSON file, with one anchor per message, and that the links
+in it to other archive pages go somewhere.  We also look for files
+that nothing in the index refers to.
+
+The topics get checked in a pool of processes, since this reads the
+whole cache and the whole website.
+
+What we print is a repair plan: the topics to fetch again, the
+pages to rebuild, and the files to delete.
+"""
+
+import html
+import json
+import re
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .cache_format import iter_file
+from .common import exit_immediately, is_temp_file
+from .feeds import FEED_FILE
+from .files import read_zulip_stream_info, read_zulip_topic_data
+from .migrate import TOPICS_PER_TASK, topic_summary, worker_args
+from .snapshot import open_snapshot
+from .uploads import JOURNAL_FILE as UPLOADS_JOURNAL_FILE
+from .uploads import STATE_FILE as UPLOADS_STATE_FILE
+from .views import STATE_FILE as VIEWS_STATE_FILE
+from .url import sanitize, sanitize_stream
+
+HREF_RE = re.compile(r'href="([^"]*)"')
+
+# What each worker process checks against (see `init_worker`).
+_json_root = None
+_md_root = None
+_base_url = None
+
+
+def init_worker(json_directory, snapshot_path, md_root, base_url):
+    global _json_root, _md_root, _base_url
+    if snapshot_path is None:
+        _json_root = Path(json_directory)
+    else:
+        _json_root = open_snapshot(snapshot_path, json_directory)
+    _md_root = md_root
+    _base_url = base_url
+
+
+def broken_links(page_path, md_root, base_url):
+    """
+    Returns the links in the page at `page_path` that should go to
+    another archive page, but don't.  Links elsewhere are not our
+    problem.
+    """
+    text = page_path.read_text(encoding="utf-8")
+    # Topic pages set <base> to the Zulip server, so that relative
+    # links in messages work.
+    has_base = "<base " in text
+    broken = []
+    for href in HREF_RE.findall(text):
+        url = html.unescape(href).split("#")[0]
+        if url.startswith(base_url + "/"):
+            target = md_root / url[len(base_url) + 1 :]
+        elif has_base or not url or url.startswith("/") or ":" in url:
+            continue
+        else:
+            target = page_path.parent / url
+        if not target.exists():
+            broken.append(href)
+    return broken
+
+
+def check_topic(stream_name, stream_data, topic_name, topic):
+    """
+    Returns a list of (action, reason) for one topic, where action is
+    "refetch" or "rebuild".
+    """
+    sanitized_stream_name = sanitize_stream(stream_name, stream_data["id"])
+    sanitized_topic_name = sanitize(topic_name)
+    json_path = _json_root / sanitized_stream_name / (sanitized_topic_name + ".json")
+    problems = []
+
+    try:
+        summary = topic_summary(iter_file(json_path))
+    except FileNotFoundError:
+        return [("refetch", "no JSON file")]
+    except Exception as e:
+        return [("refetch", f"can't read the JSON file ({e})")]
+
+    if summary["size"] != topic["size"]:
+        problems.append(
+            ("refetch", f"{summary['size']} messages, the index says {topic['size']}")
+        )
+    if summary["latest_date"] != topic["latest_date"]:
+        problems.append(("refetch", "the latest date doesn't match the index"))
+    if summary["latest_id"] is not None and (
+        summary["latest_id"] > stream_data["latest_id"]
+    ):
+        problems.append(("refetch", "has messages newer than the stream's latest_id"))
+
+    if _md_root is None:
+        return problems
+
+    page_path = (
+        _md_root
+        / "stream"
+        / sanitized_stream_name
+        / "topic"
+        / (sanitized_topic_name + ".html")
+    )
+    if not page_path.exists():
+        problems.append(("rebuild", "no page"))
+        return problems
+
+    if (
+        isinstance(json_path, Path)
+        and page_path.stat().st_mtime < json_path.stat().st_mtime
+    ):
+        problems.append(("rebuild", "the page is older than the JSON"))
+    num_anchors = page_path.read_text(encoding="utf-8").count('<a name="')
+    if num_anchors != summary["size"]:
+        problems.append(
+            ("rebuild", f"the page has {num_anchors} of {summary['size']} messages")
+        )
+    for href in broken_links(page_path, _md_root, _base_url):
+        problems.append(("rebuild", f"broken link to {href}"))
+    return problems
+
+
+def check_topics(tasks):
+    results = []
+    for stream_name, stream_data, topic_name, topic in tasks:
+        for action, reason in check_topic(stream_name, stream_data, topic_name, topic):
+            results.append((action, stream_name, topic_name, reason))
+    return results
+
+
+def orphans(directory, expected):
+    """
+    Returns the files (and directories) in `directory` that aren't in
+    `expected` (a set of names).  We leave out temp files left over
+    from a crash, since the next run deletes them anyway (see
+    `remove_temp_files`).
+    """
+    if not directory.is_dir():
+        return []
+    return sorted(
+        str(path)
+        for path in directory.iterdir()
+        if path.name not in expected and not is_temp_file(path.name)
+    )
+
+
+def verify(json_root, md_root, site_url, html_root, jobs=None, plan_file=None):
+    """
+    Checks the cache in `json_root` (and the website in `md_root`,
+    unless it's None) and prints a repair plan.  Exits with an error
+    if anything needs repairing.
+    """
+    base_url = urllib.parse.urljoin(site_url, html_root)
+    stream_info = read_zulip_stream_info(json_root)
+    streams = stream_info["streams"]
+
+    tasks = []
+    stream_dirs = {}
+    for stream_name, stream_data in streams.items():
+        sanitized_stream_name = sanitize_stream(stream_name, stream_data["id"])
+        topic_data = read_zulip_topic_data(json_root, stream_name, stream_data)
+        stream_dirs[sanitized_stream_name] = {sanitize(t) for t in topic_data}
+        entry = {k: v for k, v in stream_data.items() if k != "topic_data"}
+        for topic_name, topic in topic_data.items():
+            tasks.append((stream_name, entry, topic_name, topic))
+    print(f"checking {len(tasks)} topics")
+
+    chunks = [
+        tasks[i : i + TOPICS_PER_TASK] for i in range(0, len(tasks), TOPICS_PER_TASK)
+    ]
+    plan = dict(refetch=[], rebuild=[], delete=[])
+    with ProcessPoolExecutor(
+        jobs,
+        initializer=init_worker,
+        initargs=worker_args(json_root) + (md_root, base_url),
+    ) as pool:
+        for results in pool.map(check_topics, chunks):
+            for action, stream_name, topic_name, reason in results:
+                plan[action].append(
+                    dict(stream=stream_name, topic=topic_name, reason=reason)
+                )
+
+    # The files that nothing in the index refers to.  (For a
+    # snapshot, we only look at the directory next to it.)
+    json_dir = Path(json_root)
+    plan["delete"] += orphans(
+        json_dir,
+        set(stream_dirs)
+        | {
+            "stream_index",
+            "stream_index.json",
+            UPLOADS_STATE_FILE,
+            UPLOADS_JOURNAL_FILE,
+            VIEWS_STATE_FILE,
+        },
+    )
+    plan["delete"] += orphans(
+        json_dir / "stream_index", {s + ".json" for s in stream_dirs}
+    )
+    for sanitized_stream_name, topics in stream_dirs.items():
+        plan["delete"] += orphans(
+            json_dir / sanitized_stream_name, {t + ".json" for t in topics}
+        )
+
+    if md_root is not None:
+        plan["delete"] += orphans(md_root / "stream", set(stream_dirs))
+        for sanitized_stream_name, topics in stream_dirs.items():
+            stream_dir = md_root / "stream" / sanitized_stream_name
+            plan["delete"] += orphans(stream_dir, {"index.html", "topic", FEED_FILE})
+            plan["delete"] += orphans(
+                stream_dir / "topic", {t + ".html" for t in topics}
+            )
+
+        pages = [md_root / "index.html"] + [
+            md_root / "stream" / s / "index.html" for s in stream_dirs
+        ]
+        for page in pages:
+            if not page.exists():
+                plan["rebuild"].append(dict(page=str(page), reason="no page"))
+                continue
+            for href in broken_links(page, md_root, base_url):
+                plan["rebuild"].append(
+                    dict(page=str(page), reason=f"broken link to {href}")
+                )
+
+    print_plan(plan)
+    if plan_file is not None:
+        with open(plan_file, "w", encoding="utf-8") as f:
+            json.dump(plan, f, ensure_ascii=False, indent=4)
+
+    num_problems = sum(len(items) for items in plan.values())
+    if num_problems:
+        exit_immediately(f"{num_problems} problems found; see the repair plan above")
+    print("everything checks out")
+
+
+def print_plan(plan):
+    def label(item):
+        if "page" in item:
+            return item["page"]
+        return f"{item['stream']} > {item['topic']}"
+
+    print("\nRepair plan:")
+    for action, what in [
+        ("refetch", "topics to fetch again"),
+        ("rebuild", "pages to rebuild (archive.py -b)"),
+    ]:
+        items = plan[action]
+        print(f"\n  {what}: {len(items)}")
+        for item in items:
+            print(f"    {label(item)}: {item['reason']}")
+    print(f"\n  files to delete: {len(plan['delete'])}")
+    for path in plan["delete"]:
+        print(f"    {path}")
+    print()
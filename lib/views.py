@@ -0,0 +1,308 @@
+"""
+Views of the archive that aren't about one stream or topic, like a
+page per author, or how many messages there were each day.  With
+--views:
+
+    python3 archive.py -b --views
+
+the build also writes:
+
+    <md_root>
+        authors
+            index.html      (everybody, busiest first)
+            <id>.html       (one author's messages per stream and month)
+        daily.html          (messages per day)
+        daily.json
+        topics.html         (the topics with the most people in them)
+
+Every view is an "aggregator": it keeps some totals, which it updates
+one message at a time, and writes its pages from them.  The messages
+come from the build itself, as it reads each topic to write its page
+(see `Views.feed`), so adding a view doesn't add another pass over
+the JSON.
+
+The totals are saved in views.json in the JSON directory, along with
+the id of the last message we counted in each topic, so each build
+only counts the messages that are new.  (If you refetch everything
+with -t, messages can disappear; delete views.json to count from
+scratch.)
+
+To add a view, subclass Aggregator and add it to AGGREGATORS.
+"""
+
+import heapq
+import html
+import json
+from pathlib import Path
+
+from .cache_format import load_file
+from .common import open_outfile
+from .date_helper import format_date1, format_day
+from .url import sanitize, sanitize_stream
+from . import metrics
+
+STATE_FILE = "views.json"
+
+
+def sender_key(msg):
+    # Names can change, ids don't (but caches from before we kept
+    # sender_id don't have them).
+    return str(msg.get("sender_id", msg["sender_full_name"]))
+
+
+def write_page(md_root, path, content_html, page_head_html, page_footer_html):
+    path = Path(path)
+    outfile = open_outfile(md_root / path.parent, path.name, "w+")
+    outfile.write(page_head_html)
+    outfile.write(content_html)
+    outfile.write(page_footer_html)
+    outfile.close()
+    metrics.incr("pages_rendered")
+    metrics.record_file(outfile)
+
+
+class Aggregator:
+    """
+    `name` is where we keep the totals in views.json, and `state`
+    is the totals themselves (as loaded from views.json; `to_json`
+    gives them back).
+
+    Subclasses count each new message in `add(stream_name, stream_id,
+    topic_name, msg)`, and write their pages in `write(md_root,
+    page_head_html, page_footer_html)`.
+    """
+
+    name = None
+
+    def __init__(self, state=None):
+        self.state = self.empty() if state is None else state
+
+    def empty(self):
+        return {}
+
+    def to_json(self):
+        return self.state
+
+
+class AuthorIndex(Aggregator):
+    """
+    authors/index.html, and a page per author with their messages per
+    stream and per month.
+    """
+
+    name = "authors"
+
+    def add(self, stream_name, stream_id, topic_name, msg):
+        key = sender_key(msg)
+        if key not in self.state:
+            self.state[key] = dict(
+                count=0, first=msg["timestamp"], last=0, streams={}, months={}
+            )
+        author = self.state[key]
+        author["name"] = msg["sender_full_name"]
+        author["count"] += 1
+        author["first"] = min(author["first"], msg["timestamp"])
+        author["last"] = max(author["last"], msg["timestamp"])
+        streams = author["streams"]
+        streams[stream_name] = streams.get(stream_name, 0) + 1
+        month = format_day(msg["timestamp"])[:7]
+        author["months"][month] = author["months"].get(month, 0) + 1
+
+    def write(self, md_root, page_head_html, page_footer_html):
+        keys = sorted(self.state, key=lambda key: -self.state[key]["count"])
+        items = []
+        for key in keys:
+            author = self.state[key]
+            url = f"{sanitize(key)}.html"
+            items.append(
+                f'<li> <a href="{html.escape(url)}">{html.escape(author["name"])}</a> ({author["count"]} messages) </li>'
+            )
+            write_page(
+                md_root,
+                f"authors/{sanitize(key)}.html",
+                author_page_html(author),
+                page_head_html,
+                page_footer_html,
+            )
+        content_html = "<h2>Authors:</h2>\n<ul>\n" + "\n".join(items) + "\n</ul>\n"
+        write_page(
+            md_root,
+            "authors/index.html",
+            content_html,
+            page_head_html,
+            page_footer_html,
+        )
+
+
+def author_page_html(author):
+    streams_html = "\n".join(
+        f"<li> {html.escape(stream_name)} ({count} messages) </li>"
+        for stream_name, count in sorted(
+            author["streams"].items(), key=lambda item: -item[1]
+        )
+    )
+    months_html = "\n".join(
+        f"<tr><td>{html.escape(month)}</td><td>{count}</td></tr>"
+        for month, count in sorted(author["months"].items())
+    )
+    return f"""\
+<h2>{html.escape(author["name"])}</h2>
+<p>{author["count"]} messages, from {html.escape(format_date1(author["first"]))} to {html.escape(format_date1(author["last"]))}</p>
+
+<h3>Streams:</h3>
+<ul>
+{streams_html}
+</ul>
+
+<h3>Messages per month:</h3>
+<table>
+{months_html}
+</table>
+"""
+
+
+class DailyCounts(Aggregator):
+    """
+    daily.html and daily.json, with the number of messages per day
+    (UTC), overall and per stream.
+    """
+
+    name = "daily"
+
+    def empty(self):
+        return dict(all={}, streams={})
+
+    def add(self, stream_name, stream_id, topic_name, msg):
+        day = format_day(msg["timestamp"])
+        counts = self.state["all"]
+        counts[day] = counts.get(day, 0) + 1
+        counts = self.state["streams"].setdefault(stream_name, {})
+        counts[day] = counts.get(day, 0) + 1
+
+    def write(self, md_root, page_head_html, page_footer_html):
+        out = open_outfile(md_root, "daily.json", "w")
+        json.dump(self.state, out, sort_keys=True, separators=(",", ":"))
+        out.close()
+        metrics.record_file(out)
+
+        rows_html = "\n".join(
+            f"<tr><td>{day}</td><td>{count}</td></tr>"
+            for day, count in sorted(self.state["all"].items(), reverse=True)
+        )
+        content_html = f"""\
+<h2>Messages per day:</h2>
+<p>(Per stream, see <a href="daily.json">daily.json</a>.)</p>
+<table>
+{rows_html}
+</table>
+"""
+        write_page(
+            md_root, "daily.html", content_html, page_head_html, page_footer_html
+        )
+
+
+class TopicStats(Aggregator):
+    """
+    topics.html, with the topics that the most people took part in.
+    """
+
+    name = "topics"
+
+    # How many topics topics.html lists.
+    TOP_TOPICS = 100
+
+    def __init__(self, state=None):
+        super().__init__(state)
+        # (sets while we count, lists in views.json)
+        for stream_topics in self.state.values():
+            for topic in stream_topics.values():
+                topic["senders"] = set(topic["senders"])
+
+    def to_json(self):
+        return {
+            stream_name: {
+                topic_name: dict(topic, senders=sorted(topic["senders"]))
+                for topic_name, topic in stream_topics.items()
+            }
+            for stream_name, stream_topics in self.state.items()
+        }
+
+    def add(self, stream_name, stream_id, topic_name, msg):
+        topics = self.state.setdefault(stream_name, {})
+        if topic_name not in topics:
+            topics[topic_name] = dict(id=stream_id, messages=0, senders=set())
+        topic = topics[topic_name]
+        topic["messages"] += 1
+        topic["senders"].add(sender_key(msg))
+
+    def write(self, md_root, page_head_html, page_footer_html):
+        topics = (
+            (len(topic["senders"]), topic["messages"], stream_name, topic_name)
+            for stream_name, stream_topics in self.state.items()
+            for topic_name, topic in stream_topics.items()
+        )
+        items = []
+        for num_senders, num_messages, stream_name, topic_name in heapq.nlargest(
+            self.TOP_TOPICS, topics
+        ):
+            stream_id = self.state[stream_name][topic_name]["id"]
+            url = f"stream/{sanitize_stream(stream_name, stream_id)}/topic/{sanitize(topic_name)}.html"
+            items.append(
+                f'<li> {html.escape(stream_name)} &gt; <a href="{html.escape(url)}">{html.escape(topic_name)}</a> ({num_senders} people, {num_messages} messages) </li>'
+            )
+        content_html = (
+            "<h2>Topics with the most people:</h2>\n<ul>\n"
+            + "\n".join(items)
+            + "\n</ul>\n"
+        )
+        write_page(
+            md_root, "topics.html", content_html, page_head_html, page_footer_html
+        )
+
+
+AGGREGATORS = [AuthorIndex, DailyCounts, TopicStats]
+
+
+class Views:
+    """
+    Feeds the messages the build reads through every aggregator, and
+    keeps track of which ones have been counted.
+    """
+
+    def __init__(self, json_root, aggregators=AGGREGATORS):
+        path = json_root / STATE_FILE
+        state = load_file(path) if path.exists() else dict(topics={}, views={})
+        # stream name -> topic name -> id of the last message counted
+        self.topics = state["topics"]
+        self.aggregators = [
+            aggregator(state["views"].get(aggregator.name))
+            for aggregator in aggregators
+        ]
+
+    def feed(self, stream_name, stream_id, topic_name, messages):
+        """
+        Passes along `messages` (the messages of a topic, as the build
+        reads them), counting the ones we haven't counted before.
+        """
+        seen = self.topics.setdefault(stream_name, {})
+        last_id = seen.get(topic_name, 0)
+        for msg in messages:
+            if msg["id"] > last_id:
+                for aggregator in self.aggregators:
+                    aggregator.add(stream_name, stream_id, topic_name, msg)
+                seen[topic_name] = max(seen.get(topic_name, 0), msg["id"])
+            yield msg
+
+    def finish(self, json_root, md_root, page_head_html, page_footer_html):
+        for aggregator in self.aggregators:
+            aggregator.write(md_root, page_head_html, page_footer_html)
+
+        state = dict(
+            topics=self.topics,
+            views={
+                aggregator.name: aggregator.to_json() for aggregator in self.aggregators
+            },
+        )
+        out = open_outfile(json_root, STATE_FILE, "w")
+        json.dump(state, out, sort_keys=True, separators=(",", ":"))
+        out.close()
@@ -15,8 +15,10 @@ language of choice, this is probably the best place to start.
 """
 
 from pathlib import Path
+import hashlib
 import html
-from shutil import copyfile, copytree
+import json
+import time
 
 from .url import (
     sanitize_stream,
@@ -27,13 +29,16 @@ from .files import (
     open_main_page,
     open_stream_topics_page,
     open_topic_messages_page,
-    read_zulip_messages_for_topic,
+    iter_zulip_messages_for_topic,
     read_zulip_stream_info,
+    read_zulip_topic_data,
 )
 
 from .html import (
     format_message_html,
+    message_redirect_page_html,
     last_updated_footer_html,
+    recent_topics_page_html,
     topic_page_links_html,
     stream_list_page_html,
     topic_list_page_html,
@@ -41,8 +46,32 @@ from .html import (
 
 from .url import (
     archive_stream_url,
+    archive_uploads_url,
 )
 
+from .cache_format import load_file
+from .common import copy_outfile, copy_outfiles, durability_barrier, open_outfile
+from .feeds import (
+    FEED_FILE,
+    FEED_SIZE,
+    read_feed_state,
+    write_feed_state,
+    write_site_feed,
+    write_stream_feed,
+)
+from .message_index import SHARD_DIR, SHARD_SIZE, MessageIndex
+from .uploads import rewrite_uploads
+from .zulip_data import merge_recent_topics, recent_topics
+from . import metrics
+from .timing import phase
+
+# How many topics recent.html lists.
+RECENT_TOPICS = 100
+
+# recent.json remembers which topics recent.html lists (see
+# `write_recent_page`).
+RECENT_STATE_FILE = "recent.json"
+
 
 def to_topic_page_head_html(title):
     return f'<html>\n<head><meta charset="utf-8"><title>{title}</title></head>\n'
@@ -59,65 +88,213 @@ def build_website(
     repo_root,
     page_head_html,
     page_footer_html,
+    uploads=None,
+    views=None,
+    rendered=None,
 ):
+    """
+    `uploads` is an `UploadMirror` (see lib/uploads.py), if we mirror
+    the uploads the messages link to, and `views` is a `Views` (see
+    lib/views.py), if we're writing those.
+
+    For a pipelined build (see lib/pipeline.py), `rendered` maps the
+    topic pages that have already been written to their message ids;
+    we leave the other topic pages as they are.
+    """
     stream_info = read_zulip_stream_info(json_root)
 
     streams = stream_info["streams"]
     date_footer_html = last_updated_footer_html(stream_info)
-    write_main_page(
-        md_root,
-        site_url,
-        html_root,
-        title,
-        streams,
-        date_footer_html,
-        page_head_html,
-        page_footer_html,
-    )
-    write_css(md_root)
-
-    for stream_name in streams:
-        print("building: ", stream_name)
-        stream_data = streams[stream_name]
-        topic_data = stream_data["topic_data"]
-
-        write_stream_topics(
+    message_index = MessageIndex()
+    old_feed_state = read_feed_state(md_root)
+    feed_state = {}
+    # For the feeds and recent.html, we keep each stream's most
+    # recently updated topics (see `recent_topics`).
+    recent_by_stream = {}
+    recent_topic_data = {}
+    # The topics and stream feeds that linked to uploads we were still
+    # downloading, to write again once we have them.
+    redo_topics = []
+    redo_feeds = []
+    with phase("page_render"):
+        write_main_page(
             md_root,
             site_url,
             html_root,
             title,
-            stream_name,
-            stream_data,
+            streams,
             date_footer_html,
             page_head_html,
             page_footer_html,
         )
 
-        for topic_name in topic_data:
-            write_topic_messages(
-                json_root,
+    for stream_name in streams:
+        print("building: ", stream_name)
+        start = time.perf_counter()
+        # We load one stream's topic info at a time, and let go of
+        # it when we move on to the next stream.
+        topic_data = read_zulip_topic_data(json_root, stream_name, streams[stream_name])
+        stream_data = dict(streams[stream_name], topic_data=topic_data)
+
+        with phase("page_render"):
+            write_stream_topics(
                 md_root,
                 site_url,
                 html_root,
                 title,
-                zulip_url,
-                zulip_icon_url,
                 stream_name,
-                streams[stream_name],
-                topic_name,
+                stream_data,
                 date_footer_html,
                 page_head_html,
                 page_footer_html,
             )
 
-    copytree(
-        str(Path(repo_root) / "assets"),
-        str(Path(md_root) / "assets"),
-        dirs_exist_ok=True,
-    )
+            sanitized_stream_name = sanitize_stream(stream_name, stream_data["id"])
+            for topic_name in topic_data if rendered is None else []:
+                messages = None
+                if views is not None:
+                    messages = views.feed(
+                        stream_name,
+                        stream_data["id"],
+                        topic_name,
+                        iter_zulip_messages_for_topic(
+                            json_root, sanitized_stream_name, sanitize(topic_name)
+                        ),
+                    )
+                message_ids = write_topic_messages(
+                    json_root,
+                    md_root,
+                    site_url,
+                    html_root,
+                    title,
+                    zulip_url,
+                    zulip_icon_url,
+                    stream_name,
+                    stream_data,
+                    topic_name,
+                    date_footer_html,
+                    page_head_html,
+                    page_footer_html,
+                    uploads,
+                    messages,
+                )
+                page = (
+                    f"stream/{sanitized_stream_name}/topic/{sanitize(topic_name)}.html"
+                )
+                message_index.add_topic(page, message_ids)
+                if uploads is not None and uploads.missed():
+                    redo_topics.append((stream_name, stream_data["id"], topic_name))
+
+            recent = recent_topics(topic_data, max(FEED_SIZE, RECENT_TOPICS))
+            recent_by_stream[stream_name] = recent
+            recent_topic_data[stream_name] = {
+                topic_name: topic_data[topic_name] for _, topic_name in recent
+            }
+
+            # The feed only changes when the stream gets new messages.
+            feed_state[stream_name] = stream_data["latest_id"]
+            feed_path = md_root / "stream" / sanitized_stream_name / FEED_FILE
+            if (
+                old_feed_state.get(stream_name) != feed_state[stream_name]
+                or not feed_path.exists()
+            ):
+                write_stream_feed(
+                    json_root,
+                    md_root,
+                    site_url,
+                    html_root,
+                    title,
+                    zulip_url,
+                    stream_name,
+                    stream_data["id"],
+                    recent[:FEED_SIZE],
+                    uploads,
+                )
+                if uploads is not None and uploads.missed():
+                    redo_feeds.append((stream_name, stream_data["id"], recent))
+
+        metrics.record_stream_duration(
+            "build", stream_name, time.perf_counter() - start
+        )
 
-    # Copy .nojekyll into md_root as well.
-    copyfile(str(Path(repo_root) / ".nojekyll"), str(Path(md_root) / ".nojekyll"))
+    if uploads is not None:
+        with phase("uploads"):
+            uploads.finish()
+        with phase("page_render"):
+            for stream_name, stream_id, topic_name in redo_topics:
+                write_topic_messages(
+                    json_root,
+                    md_root,
+                    site_url,
+                    html_root,
+                    title,
+                    zulip_url,
+                    zulip_icon_url,
+                    stream_name,
+                    dict(id=stream_id),
+                    topic_name,
+                    date_footer_html,
+                    page_head_html,
+                    page_footer_html,
+                    uploads,
+                )
+            for stream_name, stream_id, recent in redo_feeds:
+                write_stream_feed(
+                    json_root,
+                    md_root,
+                    site_url,
+                    html_root,
+                    title,
+                    zulip_url,
+                    stream_name,
+                    stream_id,
+                    recent[:FEED_SIZE],
+                    uploads,
+                )
+
+    with phase("page_render"):
+        if rendered is None:
+            message_index.write(md_root)
+        else:
+            for page, message_ids in rendered.items():
+                message_index.add_topic(page, message_ids)
+            message_index.add_existing(md_root)
+            message_index.write(md_root, complete=False)
+        if feed_state != old_feed_state or not (md_root / FEED_FILE).exists():
+            write_site_feed(
+                json_root,
+                md_root,
+                site_url,
+                html_root,
+                title,
+                zulip_url,
+                streams,
+                recent_by_stream,
+                uploads,
+            )
+            write_feed_state(md_root, feed_state)
+        write_recent_page(
+            md_root,
+            stream_info,
+            recent_by_stream,
+            recent_topic_data,
+            date_footer_html,
+            page_head_html,
+            page_footer_html,
+        )
+        write_message_redirect_page(md_root, page_head_html, page_footer_html)
+        if views is not None:
+            views.finish(json_root, md_root, page_head_html, page_footer_html)
+
+    with phase("asset_copy"):
+        write_css(md_root)
+
+        copy_outfiles(Path(repo_root) / "assets", md_root / "assets")
+
+        # Copy .nojekyll into md_root as well.
+        copy_outfile(Path(repo_root) / ".nojekyll", md_root / ".nojekyll")
+
+    durability_barrier()
 
 
 # writes the index page listing all streams.
@@ -149,6 +326,65 @@ def write_main_page(
     outfile.write(date_footer_html)
     outfile.write(page_footer_html)
     outfile.close()
+    metrics.incr("pages_rendered")
+    metrics.record_file(outfile)
+
+
+def write_recent_page(
+    md_root,
+    stream_info,
+    recent_by_stream,
+    recent_topic_data,
+    date_footer_html,
+    page_head_html,
+    page_footer_html,
+):
+    """
+    recent.html lists the most recently updated topics in all streams:
+
+        Recently active topics:
+
+        general > lunch (4 messages, latest: <date>)
+        social > happy hour (1 message, latest: <date>)
+
+    We only write it when the list of topics (or their sizes and
+    dates) has changed since the last time; recent.json remembers a
+    hash of the list.  (An -i run that finds no new messages still
+    updates stream_index.json, so its time doesn't tell us anything.)
+    """
+    streams = stream_info["streams"]
+    recent = [
+        (
+            stream_name,
+            streams[stream_name]["id"],
+            topic_name,
+            recent_topic_data[stream_name][topic_name],
+        )
+        for _, stream_name, topic_name in merge_recent_topics(
+            recent_by_stream, RECENT_TOPICS
+        )
+    ]
+    recent_hash = hashlib.sha256(
+        json.dumps(recent, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    state_path = md_root / RECENT_STATE_FILE
+    if state_path.exists() and (md_root / "recent.html").exists():
+        if load_file(state_path).get("hash") == recent_hash:
+            return
+
+    outfile = open_outfile(md_root, Path("recent.html"), "w+")
+    outfile.write(page_head_html)
+    outfile.write(recent_topics_page_html(recent))
+    outfile.write(date_footer_html)
+    outfile.write(page_footer_html)
+    outfile.close()
+    metrics.incr("pages_rendered")
+    metrics.record_file(outfile)
+
+    out = open_outfile(md_root, RECENT_STATE_FILE, "w")
+    json.dump(dict(hash=recent_hash), out)
+    out.close()
 
 
 def write_stream_topics(
@@ -186,6 +422,8 @@ def write_stream_topics(
     outfile.write(date_footer_html)
     outfile.write(page_footer_html)
     outfile.close()
+    metrics.incr("pages_rendered")
+    metrics.record_file(outfile)
 
 
 def write_topic_messages(
@@ -202,6 +440,9 @@ def write_topic_messages(
     date_footer_html,
     page_head_html,
     page_footer_html,
+    uploads=None,
+    messages=None,
+    uploads_url=None,
 ):
     """
     Writes the topics page, which lists all messages
@@ -215,21 +456,75 @@ def write_topic_messages(
 
     Bob:
         No, let's get tacos!
+
+    Returns the ids of the messages, for the message id index.
+
+    We read the messages from the topic's JSON, unless you pass them
+    in `messages`.  See `write_topic_page` for `uploads_url`.
     """
     stream_id = stream["id"]
 
     sanitized_stream_name = sanitize_stream(stream_name, stream_id)
     sanitized_topic_name = sanitize(topic_name)
 
-    messages = read_zulip_messages_for_topic(
-        json_root, sanitized_stream_name, sanitized_topic_name
-    )
+    if messages is None:
+        messages = iter_zulip_messages_for_topic(
+            json_root, sanitized_stream_name, sanitized_topic_name
+        )
 
     outfile = open_topic_messages_page(
         md_root,
         sanitized_stream_name,
         sanitized_topic_name,
     )
+    message_ids = write_topic_page(
+        outfile,
+        site_url,
+        html_root,
+        title,
+        zulip_url,
+        zulip_icon_url,
+        stream_name,
+        stream_id,
+        topic_name,
+        messages,
+        date_footer_html,
+        page_footer_html,
+        uploads,
+        uploads_url,
+    )
+    outfile.close()
+    metrics.incr("pages_rendered")
+    metrics.record_file(outfile)
+    return message_ids
+
+
+def write_topic_page(
+    outfile,
+    site_url,
+    html_root,
+    title,
+    zulip_url,
+    zulip_icon_url,
+    stream_name,
+    stream_id,
+    topic_name,
+    messages,
+    date_footer_html,
+    page_footer_html,
+    uploads=None,
+    uploads_url=None,
+):
+    """
+    Writes a topic page to `outfile` (anything with a `write`), and
+    returns the ids of the messages.
+
+    The mirrored uploads are under `html_root`, unless you say
+    otherwise with `uploads_url` (lib/partitions.py's months have
+    their own html_root, but share the site's uploads).
+    """
+    sanitized_stream_name = sanitize_stream(stream_name, stream_id)
+    sanitized_topic_name = sanitize(topic_name)
 
     topic_links = topic_page_links_html(
         site_url,
@@ -253,7 +548,18 @@ def write_topic_messages(
         f'\n<head><link href="{html.escape(site_url)}/style.css" rel="stylesheet"></head>\n'
     )
 
+    if uploads_url is None:
+        uploads_url = archive_uploads_url(site_url, html_root)
+
+    message_ids = []
     for msg in messages:
+        message_ids.append(msg["id"])
+        if uploads:
+            # The page's <base href> is the Zulip server, so these
+            # have to be full URLs.
+            msg = dict(
+                msg, content=rewrite_uploads(msg["content"], uploads, uploads_url)
+            )
         msg_html = format_message_html(
             site_url,
             html_root,
@@ -269,8 +575,17 @@ def write_topic_messages(
 
     outfile.write(date_footer_html)
     outfile.write(page_footer_html)
+    return message_ids
+
+
+def write_message_redirect_page(md_root, page_head_html, page_footer_html):
+    outfile = open_outfile(md_root, Path("message.html"), "w+")
+    outfile.write(page_head_html)
+    outfile.write(message_redirect_page_html(SHARD_SIZE, SHARD_DIR))
+    outfile.write(page_footer_html)
     outfile.close()
+    metrics.record_file(outfile)
 
 
 def write_css(md_root):
-    copyfile("style.css", md_root / "style.css")
+    copy_outfile("style.css", md_root / "style.css")
@@ -8,6 +8,9 @@ for folks who may want to emit differently structured
 HTML or markdown.
 """
 
+import heapq
+import itertools
+
 from .date_helper import format_date1
 
 
@@ -16,7 +19,7 @@ def sorted_streams(streams):
     Streams are sorted so that streams with the most topics
     go to the top.
     """
-    return sorted(streams, key=lambda s: len(streams[s]["topic_data"]), reverse=True)
+    return sorted(streams, key=lambda s: streams[s]["num_topics"], reverse=True)
 
 
 def sorted_topics(topic_data):
@@ -29,11 +32,41 @@ def sorted_topics(topic_data):
     )
 
 
-def num_topics_string(stream_topic_data):
+def recent_topics(topic_data, k):
+    """
+    The k most recently updated topics, newest first, as
+    (latest_date, topic_name) pairs.  This keeps a heap of k topics
+    rather than sorting all of them, since streams can have tens of
+    thousands of topics and we usually want a few dozen.
+    """
+    return heapq.nlargest(
+        k, ((topic["latest_date"], name) for name, topic in topic_data.items())
+    )
+
+
+def merge_recent_topics(recent_by_stream, k):
+    """
+    Merges the `recent_topics` lists for several streams (a dict
+    mapping stream names to them) into the k most recently updated
+    topics overall, as (latest_date, stream_name, topic_name).
+    """
+    merged = heapq.merge(
+        *(
+            [
+                (latest_date, stream_name, topic_name)
+                for latest_date, topic_name in recent
+            ]
+            for stream_name, recent in recent_by_stream.items()
+        ),
+        reverse=True,
+    )
+    return list(itertools.islice(merged, k))
+
+
+def num_topics_string(num_topics):
     """
     example: "5 topics"
     """
-    num_topics = len(stream_topic_data)
     plural = "" if num_topics == 1 else "s"
     return f"{num_topics} topic{plural}"
 
@@ -0,0 +1,155 @@
+# What the tests share.  Run the tests in the repo root directory,
+# e.g. `pytest tests/*.py` or `python tests/testViews.py`.
+import os
+import sys
+
+sys.path.append(".")
+
+from lib.populate import dump_stream_index, dump_topic_messages
+from lib.website import build_website
+
+
+def assert_equal(v1, v2):
+    if v1 != v2:
+        print("mismatch")
+        print(v1)
+        print(v2)
+        raise AssertionError
+
+
+class FakeClient:
+    """
+    Just enough of zulip.Client for populate_all and
+    populate_incremental.
+    """
+
+    def __init__(self, streams=("general", "python")):
+        self.streams = [
+            dict(name=name, stream_id=i + 1, invite_only=False, is_web_public=True)
+            for i, name in enumerate(streams)
+        ]
+        self.messages = []
+        self.requests = 0
+
+    def add(self, stream_name, topic_name, msg_id):
+        self.messages.append(
+            dict(
+                id=msg_id,
+                stream=stream_name,
+                subject=topic_name,
+                content=f"<p>message {msg_id}</p>",
+                sender_full_name="Alice",
+                timestamp=1600000000 + msg_id,
+            )
+        )
+
+    def get_streams(self, **kwargs):
+        self.requests += 1
+        return dict(result="success", streams=self.streams)
+
+    def get_stream_topics(self, stream_id):
+        self.requests += 1
+        stream_name = [s["name"] for s in self.streams if s["stream_id"] == stream_id][
+            0
+        ]
+        topics = {m["subject"] for m in self.messages if m["stream"] == stream_name}
+        return dict(result="success", topics=[dict(name=t) for t in sorted(topics)])
+
+    def get_messages(self, request):
+        self.requests += 1
+        narrow = {n["operator"]: n["operand"] for n in request["narrow"]}
+        msgs = [
+            m
+            for m in self.messages
+            if m["stream"] == narrow["stream"]
+            and narrow.get("topic", m["subject"]) == m["subject"]
+            and m["id"] >= request["anchor"]
+        ]
+        return dict(result="success", messages=msgs, found_newest=True)
+
+
+def message(msg_id, timestamp=None, **fields):
+    """
+    A message for `make_cache`; unless you say otherwise, it was sent
+    at second `msg_id`.
+    """
+    return dict(
+        dict(
+            id=msg_id,
+            content=f"<p>{msg_id}</p>",
+            sender_full_name="A",
+            timestamp=msg_id if timestamp is None else timestamp,
+        ),
+        **fields,
+    )
+
+
+def make_cache(json_root, streams, index_time=1600000000, cache_compression=None):
+    """
+    Writes a JSON cache.  `streams` maps stream names to (stream id,
+    {topic name: messages}), where a message is a dict (see `message`)
+    or just an id.
+    """
+    stream_info = {}
+    for stream_name, (stream_id, topics) in streams.items():
+        stream = dict(name=stream_name, stream_id=stream_id)
+        topic_data = {}
+        latest_id = 0
+        for topic_name, messages in topics.items():
+            messages = [m if isinstance(m, dict) else message(m) for m in messages]
+            dump_topic_messages(
+                json_root,
+                stream,
+                topic_name,
+                messages,
+                cache_compression=cache_compression,
+            )
+            topic_data[topic_name] = dict(
+                size=len(messages), latest_date=messages[-1]["timestamp"]
+            )
+            latest_id = max([latest_id] + [m["id"] for m in messages])
+        stream_info[stream_name] = dict(
+            id=stream_id, latest_id=latest_id, topic_data=topic_data
+        )
+    dump_stream_index(
+        json_root,
+        dict(streams=stream_info, time=index_time),
+        cache_compression=cache_compression,
+    )
+
+
+SITE_URL = "http://127.0.0.1:4000"
+ZULIP_URL = "https://example.zulipchat.com/"
+
+
+def build(
+    json_root,
+    md_root,
+    uploads=None,
+    views=None,
+    site_url=SITE_URL,
+    zulip_url=ZULIP_URL,
+    builder=build_website,
+    html_root="archive",
+):
+    """
+    Builds the website the way the tests like it; `builder` can be
+    `build_partitioned_website` instead.
+    """
+    args = [
+        json_root,
+        md_root,
+        site_url,
+        html_root,
+        "Test",
+        zulip_url,
+        None,
+        os.getcwd(),
+        "<html>",
+        "</html>",
+    ]
+    if views is not None:
+        args += [uploads, views]
+    elif uploads is not None:
+        args.append(uploads)
+    builder(*args)
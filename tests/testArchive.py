@@ -0,0 +1,72 @@
+# For convenience, just run the tests in the repo root directory.
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import ZULIP_URL, assert_equal, make_cache
+
+# Runs archive.py with zulip made unimportable, and prints the lib
+# modules it loaded.
+RUN_ARCHIVE = """
+import json, runpy, sys
+sys.modules["zulip"] = None
+sys.argv = ["archive.py"] + sys.argv[1:]
+runpy.run_path(sys.argv.pop(1), run_name="__main__")
+print(json.dumps(sorted(m for m in sys.modules if m.startswith("lib."))))
+"""
+
+
+def test_build_without_zulip():
+    repo_root = Path.cwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        (tmp_dir / "settings.py").write_text(
+            (repo_root / "default_settings.py").read_text()
+        )
+        # (the build copies style.css from the current directory)
+        (tmp_dir / "style.css").write_text((repo_root / "style.css").read_text())
+        make_cache(tmp_dir / "json", dict(general=(1, dict(lunch=[1, 2]))))
+        (tmp_dir / "archive").mkdir()
+        env = dict(
+            os.environ,
+            JSON_DIRECTORY=str(tmp_dir / "json"),
+            ZULIP_URL=ZULIP_URL,
+            PYTHONPATH=os.pathsep.join([str(tmp_dir), str(repo_root)]),
+        )
+        # (no zuliprc in tmp_dir, and no streams.yaml)
+        output = subprocess.run(
+            [sys.executable, "-c", RUN_ARCHIVE, str(repo_root / "archive.py"), "-b"],
+            cwd=tmp_dir,
+            env=env,
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        ).stdout
+        topic_page = (
+            tmp_dir / "archive" / "stream" / "1-general" / "topic" / "lunch.html"
+        )
+        assert_equal(topic_page.exists(), True)
+
+    modules = json.loads(output.splitlines()[-1])
+    for module in [
+        "lib.populate",
+        "lib.snapshot",
+        "lib.migrate",
+        "lib.verify",
+        "lib.staging",
+        "lib.partitions",
+        "lib.pipeline",
+        "lib.views",
+        "lib.export",
+    ]:
+        assert_equal(module in modules, False)
+    assert_equal("lib.website" in modules, True)
+
+
+if __name__ == "__main__":
+    test_build_without_zulip()
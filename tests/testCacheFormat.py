@@ -0,0 +1,104 @@
+# For convenience, just run the tests in the repo root directory.
+import io
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal
+from lib import cache_format
+
+SAMPLE = dict(
+    streams={
+        "general 🐢": dict(
+            id=7,
+            latest_id=1234,
+            topic_data={"lunch": dict(size=3, latest_date=1600000000)},
+        )
+    },
+    time=1600000123.5,
+)
+
+
+def test_round_trip():
+    for fmt in cache_format.FORMATS:
+        if fmt == "orjson" and cache_format.orjson is None:
+            continue
+        if fmt == "msgpack" and cache_format.msgpack is None:
+            continue
+        data = cache_format.dumps(SAMPLE, fmt)
+        assert_equal(cache_format.loads(data), SAMPLE)
+
+
+def test_compression():
+    compressions = [None, "gzip"]
+    if cache_format.zstandard is not None:
+        compressions.append("zstd")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for compression in compressions:
+            out = io.BytesIO()
+            cache_format.dump_file(SAMPLE, out, "json", compression)
+            assert_equal(cache_format.loads(out.getvalue()), SAMPLE)
+
+            path = Path(tmp_dir) / "stream_index.json"
+            path.write_bytes(out.getvalue())
+            assert_equal(cache_format.load_file(path), SAMPLE)
+
+
+def test_json_is_unchanged():
+    # The default format must stay byte-for-byte what we have
+    # always written, so that existing caches don't churn.
+    data = cache_format.dumps([dict(id=1, content="<p>hi 🐢</p>")], "json")
+    assert_equal(
+        data.decode("utf-8"),
+        '[\n    {\n        "content": "<p>hi 🐢</p>",\n        "id": 1\n    }\n]',
+    )
+
+
+def test_detection():
+    assert_equal(cache_format.is_json(b'{"a": 1}'), True)
+    assert_equal(cache_format.is_json(b"\n  [1]"), True)
+    if cache_format.msgpack is not None:
+        assert_equal(cache_format.is_json(cache_format.dumps(SAMPLE, "msgpack")), False)
+        assert_equal(cache_format.is_json(cache_format.dumps([1, 2], "msgpack")), False)
+
+
+def test_iter_file():
+    messages = [
+        dict(id=i, content="<p>" + "🐢" * (i % 50) + "</p>", timestamp=i * 0.5)
+        for i in range(300)
+    ]
+    # Use tiny chunks, so that messages (and turtles) get split
+    # across chunks.
+    old_sizes = cache_format.STREAM_THRESHOLD, cache_format.CHUNK_SIZE
+    try:
+        for threshold, chunk_size in [(1024 * 1024, 64 * 1024), (1, 7)]:
+            cache_format.STREAM_THRESHOLD = threshold
+            cache_format.CHUNK_SIZE = chunk_size
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = Path(tmp_dir) / "topic.json"
+                for fmt in ["json", "compact-json", "msgpack"]:
+                    if fmt == "msgpack" and cache_format.msgpack is None:
+                        continue
+                    for compression in [None, "gzip"]:
+                        with path.open("wb") as f:
+                            cache_format.dump_file(messages, f, fmt, compression)
+                        assert_equal(list(cache_format.iter_file(path)), messages)
+
+                for text in ["[]", " [ ] ", "[1, 22, 333]\n"]:
+                    path.write_text(text)
+                    assert_equal(
+                        list(cache_format.iter_file(path)),
+                        cache_format.load_file(path),
+                    )
+    finally:
+        cache_format.STREAM_THRESHOLD, cache_format.CHUNK_SIZE = old_sizes
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_compression()
+    test_json_is_unchanged()
+    test_detection()
+    test_iter_file()
@@ -1,11 +1,16 @@
 # For convenience, just run the tests in the repo root directory.
 import sys
+import tempfile
+from pathlib import Path
 
+sys.path.append(".")
 sys.path.append("lib")
 
 import common
 import url
 
+from lib.snapshot import SnapshotPath
+
 
 class Settings:
     def __init__(self, **kwargs):
@@ -91,6 +96,88 @@ def test_validator():
     assert_equal(validator(stream("bar", False, False)), False)
 
 
+def test_open_outfile():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "sub" / "hello.txt"
+        path.parent.mkdir()
+        path.write_text("old")
+
+        outfile = common.open_outfile(path.parent, "hello.txt", "w")
+        outfile.write("new")
+        outfile.close()
+
+        # Nothing changes until the barrier.
+        assert_equal(path.read_text(), "old")
+        common.durability_barrier()
+        assert_equal(path.read_text(), "new")
+        assert_equal(sorted(p.name for p in path.parent.iterdir()), ["hello.txt"])
+
+        # A file we never close (say, because we crashed) never
+        # replaces the old one.
+        outfile = common.open_outfile(path.parent, "hello.txt", "w")
+        outfile.write("partial")
+        common.durability_barrier()
+        assert_equal(path.read_text(), "new")
+        outfile.close()
+        common.durability_barrier()
+
+
+def test_outfile_size():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        max_pending = common.MAX_PENDING
+        # So that closing the file moves it into place right away.
+        common.MAX_PENDING = 1
+        try:
+            outfile = common.open_outfile(Path(tmp_dir), "hello.txt", "w")
+            outfile.write("h\u00e9llo")
+            outfile.close()
+        finally:
+            common.MAX_PENDING = max_pending
+        assert_equal((Path(tmp_dir) / "hello.txt").exists(), True)
+        assert_equal(outfile.size, 6)
+
+
+def test_barrier_directories():
+    synced = []
+    fsync_dir = common.fsync_dir
+    common.fsync_dir = synced.append
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # SnapshotPaths for the same directory aren't equal, but
+            # we still sync it once.
+            json_root = SnapshotPath(Path(tmp_dir), None, "")
+            for name in ["a.json", "b.json"]:
+                outfile = common.open_outfile(json_root / "general", name, "w")
+                outfile.write("[]")
+                outfile.close()
+            common.durability_barrier()
+            assert_equal(synced, [str(Path(tmp_dir) / "general")])
+            assert_equal(
+                sorted(p.name for p in (Path(tmp_dir) / "general").iterdir()),
+                ["a.json", "b.json"],
+            )
+    finally:
+        common.fsync_dir = fsync_dir
+
+
+def test_remove_temp_files():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        (root / "sub").mkdir()
+        (root / "sub" / "hello.txt").write_text("hello")
+        (root / "sub" / ".hello.txt.tmp").write_text("hel")
+        (root / ".index.html.tmp").write_text("")
+        common.remove_temp_files(root)
+        assert_equal(
+            sorted(p.relative_to(root).as_posix() for p in root.rglob("*")),
+            ["sub", "sub/hello.txt"],
+        )
+
+
 if __name__ == "__main__":
     test_sanitize()
     test_validator()
+    test_open_outfile()
+    test_outfile_size()
+    test_barrier_directories()
+    test_remove_temp_files()
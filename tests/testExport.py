@@ -0,0 +1,85 @@
+# For convenience, just run the tests in the repo root directory.
+import sys
+import tempfile
+from calendar import timegm
+from pathlib import Path
+
+import pytest
+
+sys.path.append(".")
+
+from helpers import assert_equal, make_cache, message
+from lib import export
+
+JAN = timegm((2020, 1, 5, 12, 0, 0))
+FEB = timegm((2020, 2, 5, 12, 0, 0))
+
+
+def msg(msg_id, timestamp):
+    return message(msg_id, timestamp, content="x" * msg_id)
+
+
+STREAMS = dict(
+    general=(1, dict(lunch=[msg(1, JAN), msg(2, JAN), msg(5, FEB)])),
+    python=(2, dict(hello=[msg(3, JAN)], bye=[msg(4, FEB)])),
+)
+
+
+def test_export():
+    # (--export's optional dependencies; CI installs them)
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("numpy")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir) / "json"
+        make_cache(json_root, STREAMS, FEB)
+
+        for filename in ["messages.parquet", "messages.arrow"]:
+            out_path = Path(tmp_dir) / filename
+            # Small chunks, so that we get several batches.
+            export.export_cache(json_root, out_path, chunk_rows=2)
+
+            rows = sorted(
+                row
+                for batch in export.iter_batches(
+                    out_path, ["id", "stream", "topic", "content_length"]
+                )
+                for row in zip(*(column.to_pylist() for column in batch.columns))
+            )
+            assert_equal(
+                rows,
+                [
+                    (1, "general", "lunch", 1),
+                    (2, "general", "lunch", 2),
+                    (3, "python", "hello", 3),
+                    (4, "python", "bye", 4),
+                    (5, "general", "lunch", 5),
+                ],
+            )
+
+            stats = export.cache_stats(out_path, "month")
+            assert_equal(
+                stats["streams"],
+                dict(
+                    general=dict(messages=3, content_length=8),
+                    python=dict(messages=2, content_length=7),
+                ),
+            )
+            assert_equal(
+                stats["periods"],
+                {
+                    "2020-01": dict(messages=3, content_length=6),
+                    "2020-02": dict(messages=2, content_length=9),
+                },
+            )
+            assert_equal(
+                stats["stream_periods"]["python"]["2020-02"],
+                dict(messages=1, content_length=4),
+            )
+            assert_equal(
+                list(export.cache_stats(out_path, "year")["periods"]), ["2020"]
+            )
+
+
+if __name__ == "__main__":
+    test_export()
@@ -0,0 +1,118 @@
+# For convenience, just run the tests in the repo root directory.
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal, build, make_cache
+from lib.feeds import newest_messages
+from lib.zulip_data import merge_recent_topics, recent_topics
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+
+def feed_ids(path):
+    feed = ET.parse(path).getroot()
+    return [
+        int(entry.find(ATOM + "id").text.split("#")[1])
+        for entry in feed.iter(ATOM + "entry")
+    ]
+
+
+def test_recent_topics():
+    topic_data = {
+        name: dict(latest_date=date) for name, date in zip("abcde", [3, 9, 1, 7, 5])
+    }
+    assert_equal(recent_topics(topic_data, 2), [(9, "b"), (7, "d")])
+    assert_equal(
+        merge_recent_topics(
+            dict(s1=recent_topics(topic_data, 3), s2=[(8, "x"), (2, "y")]), 3
+        ),
+        [(9, "s1", "b"), (8, "s2", "x"), (7, "s1", "d")],
+    )
+
+
+def test_feeds():
+    stream_topics = dict(
+        general=(1, dict(lunch=[1, 2, 7], dinner=[3, 4])),
+        python=(2, dict(hello=[5, 6])),
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir) / "json"
+        md_root = Path(tmp_dir) / "html"
+        make_cache(json_root, stream_topics)
+
+        topics = [("general", 1, "lunch"), ("general", 1, "dinner")]
+        assert_equal(
+            [msg["id"] for *_, msg in newest_messages(json_root, topics, 3)],
+            [7, 4, 3],
+        )
+
+        build(json_root, md_root)
+        general_feed = md_root / "stream" / "1-general" / "feed.xml"
+        python_feed = md_root / "stream" / "2-python" / "feed.xml"
+        site_feed = md_root / "feed.xml"
+        assert_equal(feed_ids(general_feed), [7, 4, 3, 2, 1])
+        assert_equal(feed_ids(python_feed), [6, 5])
+        assert_equal(feed_ids(site_feed), [7, 6, 5, 4, 3, 2, 1])
+
+        # Nothing new, so no feed gets written.
+        inodes = [p.stat().st_ino for p in (general_feed, python_feed, site_feed)]
+        build(json_root, md_root)
+        assert_equal(
+            [p.stat().st_ino for p in (general_feed, python_feed, site_feed)], inodes
+        )
+
+        # Only the stream with a new message gets a new feed.
+        stream_topics["python"][1]["hello"].append(8)
+        make_cache(json_root, stream_topics)
+        build(json_root, md_root)
+        assert_equal(general_feed.stat().st_ino, inodes[0])
+        assert_equal(feed_ids(python_feed), [8, 6, 5])
+        assert_equal(feed_ids(site_feed), [8, 7, 6, 5, 4, 3, 2, 1])
+
+
+def test_recent_page():
+    stream_topics = dict(
+        general=(1, dict(lunch=[1, 2, 7], dinner=[3, 4])),
+        python=(2, dict(hello=[5, 6])),
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir) / "json"
+        md_root = Path(tmp_dir) / "html"
+        make_cache(json_root, stream_topics)
+        build(json_root, md_root)
+
+        page = md_root / "recent.html"
+        text = page.read_text()
+        links = [
+            "stream/1-general/topic/lunch.html",
+            "stream/2-python/topic/hello.html",
+            "stream/1-general/topic/dinner.html",
+        ]
+        positions = [text.index(f'href="{link}"') for link in links]
+        assert_equal(positions, sorted(positions))
+        assert_equal('href="stream/2-python/index.html"' in text, True)
+        assert_equal("3 messages" in text, True)
+
+        # An update without new messages doesn't change the page.
+        inode = page.stat().st_ino
+        make_cache(json_root, stream_topics, index_time=1600000100)
+        build(json_root, md_root)
+        assert_equal(page.stat().st_ino, inode)
+
+        stream_topics["general"][1]["dinner"].append(8)
+        make_cache(json_root, stream_topics, index_time=1600000200)
+        build(json_root, md_root)
+        text = page.read_text()
+        assert_equal(
+            text.index("topic/dinner.html") < text.index("topic/lunch.html"), True
+        )
+
+
+if __name__ == "__main__":
+    test_recent_topics()
+    test_feeds()
+    test_recent_page()
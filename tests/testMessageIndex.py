@@ -0,0 +1,70 @@
+# For convenience, just run the tests in the repo root directory.
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal
+from lib.common import durability_barrier
+from lib.message_index import SHARD_DIR, SHARD_SIZE, MessageIndex
+
+
+def lookup(md_root, msg_id):
+    # What message.html does, in Python.
+    shard = msg_id // SHARD_SIZE
+    path = md_root / SHARD_DIR / f"{shard}.json"
+    if not path.exists():
+        return None
+    index = json.loads(path.read_text())
+    msg_ids = []
+    prev = shard * SHARD_SIZE
+    for delta in index["ids"]:
+        prev += delta
+        msg_ids.append(prev)
+    if msg_id not in msg_ids:
+        return None
+    return index["pages"][index["refs"][msg_ids.index(msg_id)]]
+
+
+def test_message_index():
+    lunch = [5, 9, SHARD_SIZE + 3]
+    dinner = [7, 8, 3 * SHARD_SIZE]
+
+    message_index = MessageIndex()
+    message_index.add_topic("stream/1-general/topic/lunch.html", lunch)
+    message_index.add_topic("stream/1-general/topic/dinner.html", dinner)
+
+    assert_equal(
+        message_index.shard_json(0),
+        dict(
+            pages=[
+                "stream/1-general/topic/lunch.html",
+                "stream/1-general/topic/dinner.html",
+            ],
+            ids=[5, 2, 1, 1],
+            refs=[0, 1, 1, 0],
+        ),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        md_root = Path(tmp_dir)
+        stale_shard = md_root / SHARD_DIR / "2.json"
+        stale_shard.parent.mkdir()
+        stale_shard.write_text("{}")
+
+        message_index.write(md_root)
+        durability_barrier()
+
+        for msg_id in lunch:
+            assert_equal(lookup(md_root, msg_id), "stream/1-general/topic/lunch.html")
+        for msg_id in dinner:
+            assert_equal(lookup(md_root, msg_id), "stream/1-general/topic/dinner.html")
+        assert_equal(lookup(md_root, 6), None)
+        assert_equal(lookup(md_root, 2 * SHARD_SIZE), None)
+        assert_equal(stale_shard.exists(), False)
+
+
+if __name__ == "__main__":
+    test_message_index()
@@ -0,0 +1,110 @@
+# For convenience, just run the tests in the repo root directory.
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import FakeClient, assert_equal, build
+from lib import metrics
+from lib.populate import populate_all
+
+
+def reset_metrics():
+    metrics._enabled = False
+    for name in metrics._counters:
+        metrics._counters[name] = 0
+    metrics._org_counters.clear()
+    metrics._stream_durations.clear()
+
+
+def test_metrics():
+    client = FakeClient()
+    client.add("general", "lunch", 1)
+    client.add("general", "lunch", 2)
+    client.add("general", "dinner", 3)
+    client.add("python", "typing", 4)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        json_root = tmp_dir / "json"
+        json_root.mkdir()
+        # (we always count, so other tests leave counts behind)
+        reset_metrics()
+        metrics.enable()
+        try:
+            populate_all(client, json_root, lambda stream: True)
+            build(json_root, tmp_dir / "html")
+            metrics.write_metrics(tmp_dir / "metrics.json", ["t", "b"])
+            metrics.write_metrics(tmp_dir / "metrics.prom", ["t", "b"])
+        finally:
+            reset_metrics()
+        js = json.loads((tmp_dir / "metrics.json").read_text())
+        prom = (tmp_dir / "metrics.prom").read_text().splitlines()
+
+    counters = js["counters"]
+    assert_equal(counters["messages_fetched"], 4)
+    # get_streams, get_stream_topics for each stream, get_messages for each topic
+    assert_equal(counters["api_requests"], 1 + 2 + 3)
+    assert_equal(counters["api_retries"], 0)
+    assert_equal(counters["topics_rewritten"], 3)
+    assert_equal(counters["pages_rendered"] > 0, True)
+    assert_equal(counters["bytes_written"] > 0, True)
+    assert_equal(
+        sorted((d["phase"], d["stream"]) for d in js["stream_durations"]),
+        [
+            ("build", "general"),
+            ("build", "python"),
+            ("fetch", "general"),
+            ("fetch", "python"),
+        ],
+    )
+
+    assert_equal('zulip_archive_messages_fetched{modes="t,b"} 4' in prom, True)
+    assert_equal("# TYPE zulip_archive_api_requests gauge" in prom, True)
+    stream_lines = [
+        line.split(" ")[0]
+        for line in prom
+        if line.startswith("zulip_archive_stream_duration_seconds{")
+    ]
+    assert_equal(
+        sorted(stream_lines),
+        [
+            'zulip_archive_stream_duration_seconds{phase="build",stream="general"}',
+            'zulip_archive_stream_duration_seconds{phase="build",stream="python"}',
+            'zulip_archive_stream_duration_seconds{phase="fetch",stream="general"}',
+            'zulip_archive_stream_duration_seconds{phase="fetch",stream="python"}',
+        ],
+    )
+
+
+def test_org_labels():
+    js = dict(
+        modes=["b"],
+        duration_seconds=2.0,
+        end_time=1600000000.0,
+        counters=dict(pages_rendered=5),
+        org_counters={"my-org": dict(pages_rendered=3), "lean": dict(pages_rendered=2)},
+        stream_durations=[
+            dict(phase="build", org="my-org", stream="general", seconds=1.5)
+        ],
+    )
+    prom = metrics.prometheus_text(js).splitlines()
+    # One metric, with a series per org.
+    assert_equal(
+        [line for line in prom if line.startswith("zulip_archive_pages_rendered")],
+        [
+            'zulip_archive_pages_rendered{modes="b",org="lean"} 2',
+            'zulip_archive_pages_rendered{modes="b",org="my-org"} 3',
+        ],
+    )
+    assert_equal(
+        'zulip_archive_stream_duration_seconds{phase="build",org="my-org",'
+        'stream="general"} 1.5' in prom,
+        True,
+    )
+
+
+if __name__ == "__main__":
+    test_metrics()
+    test_org_labels()
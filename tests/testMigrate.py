@@ -0,0 +1,92 @@
+# For convenience, just run the tests in the repo root directory.
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal, make_cache, message
+from lib import cache_format
+from lib.migrate import (
+    convert_topics,
+    init_worker,
+    migrate_cache,
+    topic_summary,
+    verify_migration,
+)
+
+
+def msg(msg_id):
+    return message(msg_id, content=f"<p>{msg_id} 🐢</p>")
+
+
+CACHE = dict(general=(1, {"lunch": [msg(1), msg(2), msg(3)], "dinner 🍕": [msg(4)]}))
+
+
+def test_topic_summary():
+    messages = [dict(id=1, timestamp=10, content="a"), dict(id=2, timestamp=20)]
+    summary = topic_summary(messages)
+    assert_equal((summary["size"], summary["latest_date"]), (2, 20))
+    assert_equal(topic_summary(iter(messages)), summary)
+    assert_equal(topic_summary(messages[:1]) == summary, False)
+
+
+def test_migrate_cache():
+    fmt = "msgpack" if cache_format.msgpack is not None else "compact-json"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src = Path(tmp_dir) / "src"
+        dst = Path(tmp_dir) / "dst"
+        make_cache(src, CACHE)
+        migrate_cache(src, dst, fmt, "gzip", 2)
+
+        topic_file = dst / "1-general" / "lunch.json"
+        assert_equal(topic_file.read_bytes()[:2], cache_format.GZIP_MAGIC)
+        messages = cache_format.load_file(topic_file)
+        assert_equal(messages, cache_format.load_file(src / "1-general/lunch.json"))
+
+        src_summaries = {
+            path.relative_to(src): topic_summary(cache_format.load_file(path))
+            for path in (src / "1-general").iterdir()
+        }
+        assert_equal(verify_migration(src, dst, src_summaries, 2), ([], []))
+
+        # Now break the copy.
+        messages[1]["content"] = "<p>oops</p>"
+        with topic_file.open("wb") as f:
+            cache_format.dump_file(messages, f, fmt)
+        errors, _ = verify_migration(src, dst, src_summaries, 2)
+        assert_equal(errors, ["1-general/lunch.json: the messages don't match"])
+
+
+def test_migrate_problems():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src = Path(tmp_dir) / "src"
+        dst = Path(tmp_dir) / "dst"
+        make_cache(src, CACHE)
+        (src / "views.json").write_text('{"authors": {}}')
+        (src / "1-general" / "lunch.json").unlink()
+
+        # The missing topic doesn't stop us from converting the rest,
+        # but the copy doesn't check out.
+        try:
+            migrate_cache(src, dst, "json", None, 2)
+            raise AssertionError("expected the migration to fail")
+        except SystemExit:
+            pass
+        assert_equal(
+            sorted(p.name for p in (dst / "1-general").iterdir()),
+            ["dinner.20.F0.9F.8D.95.json"],
+        )
+        assert_equal((dst / "views.json").read_text(), '{"authors": {}}')
+
+        (src / "1-general" / "lunch.json").write_text("[{")
+        init_worker(src, None)
+        path = Path("1-general/lunch.json")
+        summaries = convert_topics([path], dst, "json", None)
+        assert_equal(summaries[path].startswith("unreadable ("), True)
+
+
+if __name__ == "__main__":
+    test_topic_summary()
+    test_migrate_cache()
+    test_migrate_problems()
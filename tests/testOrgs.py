@@ -0,0 +1,231 @@
+# For convenience, just run the tests in the repo root directory.
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import FakeClient, assert_equal
+from lib.common import stream_validator
+from lib.files import read_zulip_stream_info
+from lib.orgs import RateLimitedClient, RateLimiter, archive_orgs, read_orgs
+from lib import metrics
+
+SETTINGS = """\
+from pathlib import Path
+
+zulip_url = "https://{name}.zulipchat.com/"
+site_url = "http://127.0.0.1:4000"
+html_root = "archive"
+title = "{name}"
+zulip_icon_url = None
+json_directory = Path({json_directory!r})
+html_directory = Path({html_directory!r})
+page_head_html = "<html>"
+page_footer_html = "</html>"
+included_streams = ["*"]
+excluded_streams = {excluded!r}
+"""
+
+
+def write_org(tmp_dir, name, excluded):
+    org_dir = tmp_dir / name
+    for directory in ["json", "html"]:
+        (org_dir / directory).mkdir(parents=True)
+    (org_dir / "settings.py").write_text(
+        SETTINGS.format(
+            name=name,
+            json_directory=str(org_dir / "json"),
+            html_directory=str(org_dir / "html"),
+            excluded=excluded,
+        )
+    )
+    return org_dir
+
+
+def test_rate_limiter():
+    client = RateLimitedClient(FakeClient(["general"]), RateLimiter(50))
+    start = time.monotonic()
+    for _ in range(6):
+        client.get_streams()
+    # The first request goes right away.
+    assert_equal(time.monotonic() - start >= 5 / 50, True)
+    assert_equal(client.client.requests, 6)
+
+
+def test_orgs():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        lean = write_org(tmp_dir, "lean", [])
+        rust = write_org(tmp_dir, "rust", ["python"])
+        (tmp_dir / "orgs.yaml").write_text("""\
+orgs:
+  - name: lean
+    settings: lean/settings.py
+  - name: rust
+    settings: rust/settings.py
+    requests_per_second: 100
+""")
+        orgs = read_orgs(tmp_dir / "orgs.yaml")
+        assert_equal([org.name for org in orgs], ["lean", "rust"])
+        assert_equal(orgs[1].limiter.interval, 1 / 100)
+
+        clients = dict(
+            lean=FakeClient(["general"]), rust=FakeClient(["general", "python"])
+        )
+        clients["lean"].add("general", "theorems", 1)
+        clients["rust"].add("general", "borrowing", 2)
+        clients["rust"].add("python", "snakes", 3)
+        for org in orgs:
+            org.get_client = lambda client=clients[org.name]: client
+
+        assert_equal(archive_orgs(orgs, "t", True, os.getcwd()), [])
+        # The builds' counters come back from their processes, per org.
+        assert_equal(metrics._org_counters["lean"]["pages_rendered"] > 0, True)
+        assert_equal(metrics._org_counters["rust"]["pages_rendered"] > 0, True)
+
+        assert_equal(
+            list(read_zulip_stream_info(lean / "json")["streams"]), ["general"]
+        )
+        # Each org has its own stream filter.
+        assert_equal(
+            list(read_zulip_stream_info(rust / "json")["streams"]), ["general"]
+        )
+        assert_equal(
+            (
+                lean / "html" / "stream" / "1-general" / "topic" / "theorems.html"
+            ).exists(),
+            True,
+        )
+        assert_equal(
+            (
+                rust / "html" / "stream" / "1-general" / "topic" / "borrowing.html"
+            ).exists(),
+            True,
+        )
+        assert_equal((rust / "html" / "sitemap.xml").exists(), True)
+        assert_equal("rust" in (rust / "html" / "index.html").read_text(), False)
+
+        # And then an incremental update, without building.
+        clients["lean"].add("general", "theorems", 4)
+        archive_orgs(orgs, "i", False, os.getcwd())
+        topic_data = read_zulip_stream_info(lean / "json")["streams"]["general"]
+        assert_equal(topic_data["latest_id"], 4)
+
+
+def test_org_failure():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        lean = write_org(tmp_dir, "lean", [])
+        write_org(tmp_dir, "rust", [])
+        (tmp_dir / "orgs.yaml").write_text("""\
+orgs:
+  - name: lean
+    settings: lean/settings.py
+  - name: rust
+    settings: rust/settings.py
+""")
+        orgs = read_orgs(tmp_dir / "orgs.yaml")
+        client = FakeClient(["general"])
+        client.add("general", "theorems", 1)
+        orgs[0].get_client = lambda: client
+        # rust has no zuliprc, so its fetch fails; lean carries on.
+        assert_equal(archive_orgs(orgs, "t", True, os.getcwd()), ["rust"])
+        assert_equal((lean / "html" / "index.html").exists(), True)
+
+
+def test_org_streams_yaml():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        org_dir = tmp_dir / "lean"
+        org_dir.mkdir()
+        # Settings copied from default_settings.py find the streams.yaml
+        # next to them, wherever we run from.
+        (org_dir / "settings.py").write_text(Path("default_settings.py").read_text())
+        (org_dir / "streams.yaml").write_text("""\
+included:
+  - "*"
+excluded:
+  - python
+""")
+        (tmp_dir / "orgs.yaml").write_text("""\
+orgs:
+  - name: lean
+    settings: lean/settings.py
+""")
+        [org] = read_orgs(tmp_dir / "orgs.yaml")
+        is_valid = stream_validator(org.settings)
+        stream = dict(is_web_public=True, invite_only=False)
+        assert_equal(is_valid(dict(stream, name="general")), True)
+        assert_equal(is_valid(dict(stream, name="python")), False)
+
+
+def test_org_fetch_metrics():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        write_org(tmp_dir, "lean", [])
+        write_org(tmp_dir, "rust", [])
+        (tmp_dir / "orgs.yaml").write_text("""\
+orgs:
+  - name: lean
+    settings: lean/settings.py
+  - name: rust
+    settings: rust/settings.py
+""")
+        orgs = read_orgs(tmp_dir / "orgs.yaml")
+        # Both orgs have a stream called general.
+        clients = dict(lean=FakeClient(["general"]), rust=FakeClient(["general"]))
+        clients["lean"].add("general", "theorems", 1)
+        clients["rust"].add("general", "borrowing", 2)
+        clients["rust"].add("general", "lifetimes", 3)
+        for org in orgs:
+            org.get_client = lambda client=clients[org.name]: client
+
+        # (we always count, so other tests leave counts behind)
+        metrics._counters = dict.fromkeys(metrics._counters, 0)
+        metrics._org_counters.clear()
+        metrics._stream_durations.clear()
+        assert_equal(archive_orgs(orgs, "t", False, os.getcwd()), [])
+
+    lean = metrics._org_counters["lean"]
+    rust = metrics._org_counters["rust"]
+    # get_streams, get_stream_topics, and get_messages for each topic
+    assert_equal(lean["api_requests"], 1 + 1 + 1)
+    assert_equal(rust["api_requests"], 1 + 1 + 2)
+    assert_equal(metrics._counters["api_requests"], 3 + 4)
+    assert_equal(lean["messages_fetched"], 1)
+    assert_equal(rust["messages_fetched"], 2)
+    assert_equal(
+        sorted(metrics._stream_durations),
+        [("fetch", "lean", "general"), ("fetch", "rust", "general")],
+    )
+
+
+def test_default_streams_yaml():
+    # Without --orgs, settings copied from default_settings.py read
+    # the streams.yaml in the current directory.
+    spec = importlib.util.spec_from_file_location(
+        "settings_default", "default_settings.py"
+    )
+    settings = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(settings)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        (Path(tmp_dir) / "streams.yaml").write_text("included:\n  - lunch\n")
+        os.chdir(tmp_dir)
+        try:
+            assert_equal(settings.included_streams, ["lunch"])
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    test_rate_limiter()
+    test_orgs()
+    test_org_failure()
+    test_org_fetch_metrics()
+    test_org_streams_yaml()
+    test_default_streams_yaml()
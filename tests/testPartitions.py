@@ -0,0 +1,129 @@
+# For convenience, just run the tests in the repo root directory.
+import json
+import sys
+import tempfile
+from calendar import timegm
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal, build, make_cache, message
+from lib.partitions import build_partitioned_website, month_before, months_of_messages
+
+
+def ts(year, month, day):
+    return timegm((year, month, day, 12, 0, 0))
+
+
+def test_months():
+    assert_equal(month_before("2020/01"), "2019/12")
+    assert_equal(month_before("2020/11"), "2020/10")
+    messages = [
+        dict(timestamp=ts(2020, 1, 5)),
+        dict(timestamp=ts(2020, 2, 5)),
+        dict(timestamp=ts(2020, 1, 31)),
+        dict(timestamp=ts(2020, 3, 1)),
+    ]
+    assert_equal(
+        [month for month, _ in months_of_messages(messages, "")],
+        ["2020/01", "2020/02", "2020/02", "2020/03"],
+    )
+    assert_equal(
+        [month for month, _ in months_of_messages(messages, "2020/01")],
+        ["2020/02", "2020/02", "2020/03"],
+    )
+
+
+def test_partitions():
+    topics = dict(
+        lunch=[
+            message(1, ts(2020, 1, 5)),
+            message(2, ts(2020, 2, 5)),
+            message(5, ts(2020, 3, 5)),
+        ],
+        dinner=[message(3, ts(2020, 1, 20))],
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir) / "json"
+        md_root = Path(tmp_dir) / "html"
+        make_cache(json_root, dict(general=(1, topics)), ts(2020, 3, 10))
+        build(json_root, md_root, builder=build_partitioned_website)
+
+        lunch = "stream/1-general/topic/lunch.html"
+        january_lunch = md_root / "2020/01" / lunch
+        assert_equal(
+            'name="1"' in january_lunch.read_text()
+            and 'name="2"' not in january_lunch.read_text(),
+            True,
+        )
+        assert_equal(
+            "http://127.0.0.1:4000/archive/2020/01/stream/1-general/index.html"
+            in january_lunch.read_text(),
+            True,
+        )
+        assert_equal(
+            (md_root / "2020/01/stream/1-general/topic/dinner.html").exists(), True
+        )
+        assert_equal(
+            (md_root / "2020/02/stream/1-general/topic/dinner.html").exists(), False
+        )
+        assert_equal(
+            json.loads((md_root / "2020/01/frozen.json").read_text()),
+            dict(streams=dict(general=dict(id=1, num_topics=2, size=2))),
+        )
+        assert_equal((md_root / "2020/02/frozen.json").exists(), True)
+        assert_equal((md_root / "2020/03/frozen.json").exists(), False)
+
+        # The frozen months are left alone (we don't even read dinner).
+        inode = january_lunch.stat().st_ino
+        topics["lunch"].append(message(6, ts(2020, 4, 2)))
+        make_cache(json_root, dict(general=(1, topics)), ts(2020, 4, 3))
+        (json_root / "1-general" / "dinner.json").unlink()
+        build(json_root, md_root, builder=build_partitioned_website)
+        assert_equal(january_lunch.stat().st_ino, inode)
+        assert_equal('name="6"' in (md_root / "2020/04" / lunch).read_text(), True)
+        assert_equal((md_root / "2020/03/frozen.json").exists(), True)
+        assert_equal(
+            json.loads((md_root / "months.json").read_text()),
+            dict(frozen_through="2020/03"),
+        )
+
+        index = (md_root / "index.html").read_text()
+        for month, info in [
+            ("2020/04", "April 2020 (1 stream, 1 message)"),
+            ("2020/01", "January 2020 (1 stream, 2 messages)"),
+        ]:
+            assert_equal(f'href="{month}/index.html"' in index, True)
+            assert_equal(info in index.replace("</a> (", " ("), True)
+
+
+def test_project_site():
+    # A GitHub Pages project site, the way the action builds it: no
+    # html_root, and no trailing slash on the site_url.
+    site_url = "https://user.github.io/repo"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir) / "json"
+        md_root = Path(tmp_dir) / "html"
+        topics = dict(lunch=[message(1, ts(2020, 1, 5))])
+        make_cache(json_root, dict(general=(1, topics)), ts(2020, 3, 10))
+        build(
+            json_root,
+            md_root,
+            site_url=site_url,
+            builder=build_partitioned_website,
+            html_root="",
+        )
+
+        month_url = "https://user.github.io/repo/2020/01"
+        page = (md_root / "2020/01/stream/1-general/topic/lunch.html").read_text()
+        assert_equal(f'"{month_url}/stream/1-general/index.html"' in page, True)
+        assert_equal(f'"{month_url}/stream/1-general/topic/lunch.html#1"' in page, True)
+        assert_equal(f'"{site_url}/style.css"' in page, True)
+        stream_page = (md_root / "2020/01/stream/1-general/index.html").read_text()
+        assert_equal(f'"{month_url}/stream/1-general/index.html"' in stream_page, True)
+
+
+if __name__ == "__main__":
+    test_months()
+    test_partitions()
+    test_project_site()
@@ -0,0 +1,98 @@
+# For convenience, just run the tests in the repo root directory.
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import SITE_URL, ZULIP_URL, FakeClient, assert_equal, build
+from lib.message_index import SHARD_DIR, SHARD_SIZE
+from lib.pipeline import PipelinedBuild
+from lib.populate import populate_all, populate_incremental
+
+BUILD_ARGS = (
+    SITE_URL,
+    "archive",
+    "Test",
+    ZULIP_URL,
+    None,
+    os.getcwd(),
+    "<html>",
+    "</html>",
+)
+
+
+def message_pages(md_root):
+    """
+    The message id index, as a dict mapping ids to pages.
+    """
+    pages = {}
+    for path in (md_root / SHARD_DIR).iterdir():
+        js = json.loads(path.read_text())
+        msg_id = int(path.stem) * SHARD_SIZE
+        for delta, ref in zip(js["ids"], js["refs"]):
+            msg_id += delta
+            pages[msg_id] = js["pages"][ref]
+    return pages
+
+
+def test_pipeline():
+    client = FakeClient()
+    client.add("general", "lunch", 1)
+    client.add("general", "dinner", 2)
+    client.add("python", "hello", 3)
+    # Far enough along to get a shard of its own.
+    client.add("python", "hello", SHARD_SIZE + 1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir) / "json"
+        md_root = Path(tmp_dir) / "html"
+        populate_all(client, json_root, lambda stream: True)
+        build(json_root, md_root)
+
+        topic_dir = md_root / "stream" / "1-general" / "topic"
+        dinner = (topic_dir / "dinner.html").read_text()
+        python_page = md_root / "stream" / "2-python" / "topic" / "hello.html"
+        python_mtime = python_page.stat().st_mtime_ns
+
+        client.add("general", "lunch", SHARD_SIZE + 2)
+        client.add("general", "breakfast", SHARD_SIZE + 3)
+
+        pipeline = PipelinedBuild(json_root, md_root, *BUILD_ARGS)
+        populate_incremental(
+            client, json_root, lambda stream: True, on_topic=pipeline.topic_updated
+        )
+        pipeline.finish()
+
+        assert_equal(
+            sorted(pipeline.rendered),
+            [
+                "stream/1-general/topic/breakfast.html",
+                "stream/1-general/topic/lunch.html",
+            ],
+        )
+        lunch = (topic_dir / "lunch.html").read_text()
+        assert_equal(
+            (f"message {SHARD_SIZE + 2}" in lunch, "message 1<" in lunch), (True, True)
+        )
+        assert_equal((topic_dir / "breakfast.html").exists(), True)
+        # The other topics' pages stay as they were.
+        assert_equal((topic_dir / "dinner.html").read_text(), dinner)
+        assert_equal(python_page.stat().st_mtime_ns, python_mtime)
+
+        stream_page = (md_root / "stream" / "1-general" / "index.html").read_text()
+        assert_equal("breakfast" in stream_page, True)
+
+        # The message id index ends up the same as after a full build.
+        full_root = Path(tmp_dir) / "full"
+        build(json_root, full_root)
+        assert_equal(message_pages(md_root), message_pages(full_root))
+        assert_equal(
+            message_pages(md_root)[SHARD_SIZE + 2], "stream/1-general/topic/lunch.html"
+        )
+
+
+if __name__ == "__main__":
+    test_pipeline()
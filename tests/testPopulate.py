@@ -0,0 +1,123 @@
+# For convenience, just run the tests in the repo root directory.
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import FakeClient, assert_equal
+from lib import cache_format
+from lib.files import (
+    read_zulip_messages_for_topic,
+    read_zulip_stream_info,
+    read_zulip_topic_data,
+)
+from lib.populate import populate_all, populate_incremental
+from lib.url import sanitize, sanitize_stream
+
+
+def shard_path(json_root, stream_name, stream_id):
+    return (
+        json_root / "stream_index" / (sanitize_stream(stream_name, stream_id) + ".json")
+    )
+
+
+def test_sharded_index():
+    client = FakeClient()
+    client.add("general", "lunch", 1)
+    client.add("general", "lunch", 2)
+    client.add("general", "dinner", 3)
+    client.add("python", "typing", 4)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir)
+        populate_all(client, json_root, lambda stream: True)
+
+        stream_info = read_zulip_stream_info(json_root)
+        general = stream_info["streams"]["general"]
+        assert_equal(general, dict(id=1, latest_id=3, num_topics=2))
+        assert_equal(
+            read_zulip_topic_data(json_root, "general", general),
+            dict(
+                dinner=dict(size=1, latest_date=1600000003),
+                lunch=dict(size=2, latest_date=1600000002),
+            ),
+        )
+
+        # Only the shard for the stream with new messages gets rewritten.
+        python_shard = shard_path(json_root, "python", 2)
+        python_shard.write_bytes(python_shard.read_bytes() + b"\n")
+        client.add("general", "lunch", 5)
+        populate_incremental(client, json_root, lambda stream: True)
+
+        assert_equal(python_shard.read_bytes().endswith(b"}\n"), True)
+        stream_info = read_zulip_stream_info(json_root)
+        general = stream_info["streams"]["general"]
+        assert_equal(general["latest_id"], 5)
+        assert_equal(
+            read_zulip_topic_data(json_root, "general", general)["lunch"],
+            dict(size=3, latest_date=1600000005),
+        )
+        messages = read_zulip_messages_for_topic(
+            json_root, sanitize_stream("general", 1), sanitize("lunch")
+        )
+        assert_equal([m["id"] for m in messages], [1, 2, 5])
+
+        # Pretend we crashed after writing the topic files, but before
+        # writing stream_index.json: we fetch message 5 again, but we
+        # shouldn't store it twice.
+        stream_index = json_root / "stream_index.json"
+        old_index = stream_index.read_bytes()
+        client.add("general", "lunch", 6)
+        populate_incremental(client, json_root, lambda stream: True)
+        stream_index.write_bytes(old_index)
+        populate_incremental(client, json_root, lambda stream: True)
+
+        messages = read_zulip_messages_for_topic(
+            json_root, sanitize_stream("general", 1), sanitize("lunch")
+        )
+        assert_equal([m["id"] for m in messages], [1, 2, 5, 6])
+        assert_equal(
+            read_zulip_stream_info(json_root)["streams"]["general"]["latest_id"], 6
+        )
+
+
+def test_legacy_index():
+    # Older caches keep all the topic info inside stream_index.json.
+    legacy = dict(
+        streams=dict(
+            general=dict(
+                id=1,
+                latest_id=2,
+                topic_data=dict(lunch=dict(size=2, latest_date=1600000002)),
+            )
+        ),
+        time=1600000010,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir)
+        (json_root / "stream_index.json").write_bytes(
+            cache_format.dumps(legacy, "json")
+        )
+
+        stream_info = read_zulip_stream_info(json_root)
+        general = stream_info["streams"]["general"]
+        assert_equal(general["num_topics"], 1)
+        assert_equal(
+            read_zulip_topic_data(json_root, "general", general),
+            legacy["streams"]["general"]["topic_data"],
+        )
+
+        # The next incremental update converts the cache.
+        populate_incremental(FakeClient(), json_root, lambda stream: True)
+        stream_info = read_zulip_stream_info(json_root)
+        assert_equal(
+            stream_info["streams"]["general"], dict(id=1, latest_id=2, num_topics=1)
+        )
+        assert_equal(shard_path(json_root, "general", 1).exists(), True)
+
+
+if __name__ == "__main__":
+    test_sharded_index()
+    test_legacy_index()
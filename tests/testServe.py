@@ -0,0 +1,105 @@
+# For convenience, just run the tests in the repo root directory.
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal, make_cache
+from lib.serve import ArchiveServer, PageCache
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return (
+                response.status,
+                response.headers["X-Cache"],
+                response.read().decode("utf-8"),
+            )
+    except urllib.error.HTTPError as e:
+        return e.code, None, None
+
+
+def test_page_cache():
+    cache = PageCache(max_bytes=10)
+    cache.put("a", 1, b"aaaa")
+    cache.put("b", 1, b"bbbb")
+    assert_equal(cache.get("a", 1), b"aaaa")
+    assert_equal(cache.get("a", 2), None)
+    # "b" is the least recently used.
+    cache.put("c", 1, b"cccc")
+    assert_equal(cache.get("b", 1), None)
+    assert_equal(cache.get("a", 1), b"aaaa")
+    assert_equal(cache.size, 8)
+    # Too big to cache at all.
+    cache.put("d", 1, b"d" * 11)
+    assert_equal(cache.get("d", 1), None)
+
+
+def test_serve():
+    topics = dict(lunch=[1, 2], dinner=[3])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir) / "json"
+        make_cache(json_root, dict(general=(1, topics)), 1600000000)
+
+        server = ArchiveServer(
+            ("127.0.0.1", 0),
+            json_root,
+            None,
+            "archive",
+            "Test",
+            "https://example.zulipchat.com/",
+            None,
+            os.getcwd(),
+            "<html>",
+            "</html>",
+        )
+        server.site_url = f"http://127.0.0.1:{server.server_address[1]}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = server.site_url + "/archive/"
+        try:
+            status, cache_status, page = get(base + "index.html")
+            assert_equal((status, cache_status), (200, "miss"))
+            assert_equal("stream/1-general/index.html" in page, True)
+            assert_equal(get(base)[1], "hit")
+
+            status, _, page = get(base + "stream/1-general/index.html")
+            assert_equal(status, 200)
+            assert_equal("topic/lunch.html" in page, True)
+
+            status, cache_status, page = get(base + "stream/1-general/topic/lunch.html")
+            assert_equal((status, cache_status), (200, "miss"))
+            assert_equal("<p>2</p>" in page, True)
+            assert_equal(get(base + "stream/1-general/topic/lunch.html")[1], "hit")
+            assert_equal(get(base + "stream/1-general/topic/dinner.html")[1], "miss")
+
+            assert_equal(get(base + "stream/1-general/topic/nope.html")[0], 404)
+            assert_equal(get(base + "stream/2-nope/index.html")[0], 404)
+            assert_equal(get(server.site_url + "/elsewhere.html")[0], 404)
+            assert_equal(get(server.site_url + "/style.css")[0], 200)
+
+            # A new message in lunch: only the pages it changes get
+            # rendered again.
+            time.sleep(0.01)
+            topics["lunch"].append(4)
+            make_cache(json_root, dict(general=(1, topics)), 1600000100)
+            status, cache_status, page = get(base + "stream/1-general/topic/lunch.html")
+            assert_equal((status, cache_status), (200, "miss"))
+            assert_equal("<p>4</p>" in page, True)
+            assert_equal(get(base + "stream/1-general/topic/dinner.html")[1], "hit")
+            assert_equal(get(base + "stream/1-general/index.html")[1], "miss")
+            assert_equal(get(base + "index.html")[1], "miss")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    test_page_cache()
+    test_serve()
@@ -0,0 +1,77 @@
+# For convenience, just run the tests in the repo root directory.
+import os
+import sys
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import SITE_URL, assert_equal, build, make_cache, message
+from lib.files import open_sink
+from lib.sitemap import build_sink_sitemap, build_sitemap
+from lib.views import Views
+
+
+def msg(msg_id):
+    return message(msg_id, 1600000000 + msg_id, sender_id=10)
+
+
+CACHE = dict(general=(1, dict(lunch=[msg(1), msg(2)], dinner=[msg(3)])))
+
+
+def directory_files(root):
+    files = {}
+    for dir_path, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = Path(dir_path) / filename
+            files[path.relative_to(root).as_posix()] = path.read_bytes()
+    return files
+
+
+def bundle_files(path):
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path) as zf:
+            return {name: zf.read(name) for name in zf.namelist()}
+    with tarfile.open(path) as tf:
+        return {
+            member.name: tf.extractfile(member).read() for member in tf.getmembers()
+        }
+
+
+def test_sink():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        make_cache(tmp_dir / "json", CACHE)
+        md_root = tmp_dir / "html"
+        md_root.mkdir()
+        build(tmp_dir / "json", md_root, views=Views(tmp_dir / "json"))
+        build_sitemap(SITE_URL, md_root.as_posix(), md_root.as_posix())
+        expected = directory_files(md_root)
+
+        for filename in ["website.tar", "website.tar.gz", "website.zip"]:
+            # Views only writes pages for messages it hasn't counted
+            # yet, so start from a fresh cache each time.
+            json_root = tmp_dir / filename.replace(".", "-")
+            make_cache(json_root, CACHE)
+            bundle_root = open_sink(tmp_dir / filename)
+            build(json_root, bundle_root, views=Views(json_root))
+            build_sink_sitemap(SITE_URL, bundle_root)
+            assert_equal((tmp_dir / filename).exists(), False)
+            bundle_root.sink.close()
+
+            files = bundle_files(tmp_dir / filename)
+            assert_equal(sorted(files), sorted(expected))
+            for name in ["index.html", "stream/1-general/topic/lunch.html"]:
+                assert_equal(files[name], expected[name])
+            assert_equal("assets/img/zulip.svg" in files, True)
+            assert_equal(b"index.html" in files["sitemap-001-pages.xml.gz"], False)
+            assert_equal(
+                os.listdir(tmp_dir).count("." + filename + ".tmp"),
+                0,
+            )
+
+
+if __name__ == "__main__":
+    test_sink()
@@ -0,0 +1,75 @@
+# For convenience, just run the tests in the repo root directory.
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal, make_cache
+from lib.common import durability_barrier
+from lib.files import (
+    read_zulip_messages_for_topic,
+    read_zulip_stream_info,
+    read_zulip_topic_data,
+)
+from lib.snapshot import open_snapshot, pack_snapshot, restore_snapshot
+from lib.url import sanitize, sanitize_stream
+
+
+def cache(lunch_ids):
+    return dict(general=(1, dict(lunch=lunch_ids, dinner=[100])))
+
+
+def lunch_ids(json_root):
+    messages = read_zulip_messages_for_topic(
+        json_root, sanitize_stream("general", 1), sanitize("lunch")
+    )
+    return [m["id"] for m in messages]
+
+
+def test_snapshot():
+    for cache_compression in [None, "gzip"]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            json_dir = tmp_dir / "json"
+            snapshot_path = tmp_dir / "cache.zip"
+            make_cache(json_dir, cache([1, 2]), cache_compression=cache_compression)
+            pack_snapshot(json_dir, snapshot_path)
+
+            # Read straight from the snapshot, with an empty directory
+            # next to it.
+            overlay_dir = tmp_dir / "overlay"
+            overlay_dir.mkdir()
+            json_root = open_snapshot(snapshot_path, overlay_dir)
+            stream_info = read_zulip_stream_info(json_root)
+            general = stream_info["streams"]["general"]
+            assert_equal(general["num_topics"], 2)
+            assert_equal(
+                sorted(read_zulip_topic_data(json_root, "general", general)),
+                ["dinner", "lunch"],
+            )
+            assert_equal(lunch_ids(json_root), [1, 2])
+
+            # Writes go to the directory, and win over the snapshot.
+            make_cache(json_root, cache([1, 2, 3]), cache_compression=cache_compression)
+            durability_barrier()
+            assert_equal(lunch_ids(json_root), [1, 2, 3])
+            assert_equal((overlay_dir / "stream_index.json").exists(), True)
+
+            pack_snapshot(json_root, snapshot_path)
+            restored_dir = tmp_dir / "restored"
+            restore_snapshot(snapshot_path, restored_dir)
+            assert_equal(lunch_ids(restored_dir), [1, 2, 3])
+            assert_equal(
+                sorted(p.name for p in restored_dir.iterdir()),
+                ["1-general", "stream_index", "stream_index.json"],
+            )
+
+            # Packing the same cache again gives the same bytes.
+            data = snapshot_path.read_bytes()
+            pack_snapshot(restored_dir, snapshot_path)
+            assert_equal(snapshot_path.read_bytes(), data)
+
+
+if __name__ == "__main__":
+    test_snapshot()
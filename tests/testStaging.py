@@ -0,0 +1,63 @@
+# For convenience, just run the tests in the repo root directory.
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal
+from lib.common import durability_barrier, open_outfile
+from lib.staging import builds_dir, finish_staging, start_staging
+
+
+def write(directory, filename, text):
+    outfile = open_outfile(directory, filename, "w")
+    outfile.write(text)
+    outfile.close()
+    durability_barrier()
+
+
+def test_staging():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        md_root = Path(tmp_dir) / "archive"
+        (md_root / "stream").mkdir(parents=True)
+        (md_root / "index.html").write_text("old index")
+        (md_root / "stream" / "page.html").write_text("old page")
+
+        staging = start_staging(md_root)
+        assert_equal((staging / "stream" / "page.html").read_text(), "old page")
+        assert_equal(
+            (staging / "index.html").stat().st_ino,
+            (md_root / "index.html").stat().st_ino,
+        )
+
+        # Rebuilding a page in staging leaves the live one alone.
+        write(staging, "index.html", "new index")
+        write(staging / "stream", "new.html", "new page")
+        assert_equal((md_root / "index.html").read_text(), "old index")
+        assert_equal((md_root / "stream" / "new.html").exists(), False)
+
+        finish_staging(md_root, staging)
+        assert_equal(md_root.is_symlink(), True)
+        assert_equal((md_root / "index.html").read_text(), "new index")
+        assert_equal((md_root / "stream" / "page.html").read_text(), "old page")
+        assert_equal((md_root / "stream" / "new.html").read_text(), "new page")
+        # The old directory is kept as the previous build.
+        assert_equal(len(list(builds_dir(md_root).iterdir())), 2)
+
+        # A build that dies halfway gets cleaned up next time.
+        start_staging(md_root)
+        staging = start_staging(md_root)
+        assert_equal(len(list(builds_dir(md_root).iterdir())), 3)
+        write(staging, "index.html", "newer index")
+        live_build = md_root.resolve()
+        finish_staging(md_root, staging)
+        assert_equal((md_root / "index.html").read_text(), "newer index")
+        assert_equal(
+            sorted(builds_dir(md_root).iterdir()),
+            sorted([live_build, md_root.resolve()]),
+        )
+
+
+if __name__ == "__main__":
+    test_staging()
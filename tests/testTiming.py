@@ -0,0 +1,72 @@
+# For convenience, just run the tests in the repo root directory.
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal, build, make_cache
+from lib import timing
+
+
+def reset_timing():
+    timing._enabled = False
+    timing._stats.clear()
+
+
+def test_nested_phases():
+    timing.enable()
+    try:
+        with timing.phase("outer"):
+            time.sleep(0.05)
+            with timing.phase("inner"):
+                time.sleep(0.1)
+            with timing.phase("inner"):
+                pass
+        phases = dict(timing.summary()["phases"])
+    finally:
+        reset_timing()
+
+    assert_equal(phases["outer"]["calls"], 1)
+    assert_equal(phases["inner"]["calls"], 2)
+    # The outer phase is paused while the inner one runs.
+    assert_equal(phases["inner"]["wall_seconds"] >= 0.1, True)
+    assert_equal(0.05 <= phases["outer"]["wall_seconds"] < 0.1, True)
+
+
+def test_build_timings():
+    cache = dict(
+        general=(1, dict(lunch=[1, 2], dinner=[3])),
+        python=(2, dict(typing=[4])),
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        make_cache(tmp_dir / "json", cache)
+        timing.enable()
+        try:
+            build(tmp_dir / "json", tmp_dir / "html")
+            timing.finish(tmp_dir / "timings.json")
+        finally:
+            reset_timing()
+        js = json.loads((tmp_dir / "timings.json").read_text())
+
+    phases = js["phases"]
+    assert_equal(
+        {"index_load", "topic_read", "page_render", "asset_copy"} <= set(phases),
+        True,
+    )
+    assert_equal(phases["asset_copy"]["calls"], 1)
+    # Time is charged to the innermost phase only, so the phases add
+    # up to no more than the whole run.
+    assert_equal(
+        sum(stats["wall_seconds"] for stats in phases.values())
+        <= js["total"]["wall_seconds"],
+        True,
+    )
+
+
+if __name__ == "__main__":
+    test_nested_phases()
+    test_build_timings()
@@ -0,0 +1,196 @@
+# For convenience, just run the tests in the repo root directory.
+import http.server
+import json
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal, build, make_cache, message
+from lib.partitions import build_partitioned_website
+from lib.uploads import JOURNAL_FILE, UPLOADS_DIR, UploadMirror, rewrite_uploads
+
+CAT = b"\x89PNG not really a cat"
+
+# Stands in for the Zulip server.
+FILES = {
+    "/user_uploads/2/ab/cat.png": CAT,
+    "/user_uploads/2/cd/same-cat.png": CAT,
+    "/thumbnail?url=user_uploads%2F2%2Fab%2Fcat.png&size=full": b"small cat",
+}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        Handler.requests.append(self.path)
+        data = FILES.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+CONTENT = (
+    '<p><a href="/user_uploads/2/ab/cat.png">cat.png</a></p>'
+    '<div class="message_inline_image"><a href="/user_uploads/2/ab/cat.png">'
+    '<img src="/thumbnail?url=user_uploads%2F2%2Fab%2Fcat.png&amp;size=full">'
+    "</a></div>"
+    '<p><a href="/user_uploads/2/cd/same-cat.png">again</a> '
+    '<a href="/user_uploads/2/ef/gone.png">gone</a> '
+    '<a href="https://example.com/x.png">elsewhere</a></p>'
+)
+CACHE = dict(general=(1, dict(cats=[message(1, content=CONTENT)])))
+
+
+def test_mirror_uploads():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    zulip_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_root = Path(tmp_dir) / "json"
+            md_root = Path(tmp_dir) / "html"
+            make_cache(json_root, CACHE)
+
+            mirror = UploadMirror(json_root, md_root, zulip_url, threads=4)
+            # We don't have anything yet, so the links stay as they are
+            # while we download them.
+            assert_equal(rewrite_uploads(CONTENT, mirror, "uploads"), CONTENT)
+            assert_equal(mirror.missed(), True)
+            assert_equal(mirror.missed(), False)
+            build(
+                json_root, md_root, mirror, site_url="http://x.org", zulip_url=zulip_url
+            )
+            assert_equal(
+                sorted(Handler.requests),
+                sorted(list(FILES) + ["/user_uploads/2/ef/gone.png"]),
+            )
+            uploads = mirror.files
+            # The same cat is only stored once.
+            assert_equal(
+                uploads["/user_uploads/2/ab/cat.png"],
+                uploads["/user_uploads/2/cd/same-cat.png"],
+            )
+            assert_equal(len(uploads), 3)
+            stored = sorted(p for p in (md_root / UPLOADS_DIR).rglob("*.*"))
+            assert_equal(len(stored), 2)
+            cat = md_root / UPLOADS_DIR / uploads["/user_uploads/2/ab/cat.png"]
+            assert_equal(cat.read_bytes(), CAT)
+            assert_equal(cat.suffix, ".png")
+
+            state = json.loads((json_root / "uploads.json").read_text())
+            assert_equal(state["failed"], {"/user_uploads/2/ef/gone.png": 1})
+
+            # The page got written again once we had the uploads.
+            page = (md_root / "stream/1-general/topic/cats.html").read_text()
+            cat_url = (
+                "http://x.org/archive/uploads/" + uploads["/user_uploads/2/ab/cat.png"]
+            )
+            assert_equal(page.count(f'href="{cat_url}"'), 3)
+            assert_equal(page.count('src="http://x.org/archive/uploads/'), 1)
+            assert_equal('href="/user_uploads/2/ef/gone.png"' in page, True)
+            assert_equal('href="https://example.com/x.png"' in page, True)
+
+            # The next run only retries the one that failed.
+            Handler.requests.clear()
+            mirror = UploadMirror(json_root, md_root, zulip_url)
+            build(
+                json_root, md_root, mirror, site_url="http://x.org", zulip_url=zulip_url
+            )
+            assert_equal(mirror.files, uploads)
+            assert_equal(Handler.requests, ["/user_uploads/2/ef/gone.png"])
+            page_again = (md_root / "stream/1-general/topic/cats.html").read_text()
+            assert_equal(page_again, page)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_interrupted_mirror():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    zulip_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_root = Path(tmp_dir) / "json"
+            md_root = Path(tmp_dir) / "html"
+            make_cache(json_root, CACHE)
+
+            # A run that dies before `finish` still leaves a record of
+            # what it downloaded.
+            mirror = UploadMirror(json_root, md_root, zulip_url)
+            rewrite_uploads(CONTENT, mirror, "uploads")
+            for future in list(mirror.downloading.values()):
+                try:
+                    future.result()
+                except OSError:
+                    pass
+            mirror.pool.shutdown()
+            mirror.journal.close()
+            assert_equal((json_root / "uploads.json").exists(), False)
+            assert_equal(len((json_root / JOURNAL_FILE).read_text().splitlines()), 3)
+            # The downloads are in place, and no temp files are left.
+            stored = [p.name for p in (md_root / UPLOADS_DIR).rglob("*") if p.is_file()]
+            assert_equal(len(stored), 2)
+            assert_equal([name for name in stored if name.startswith(".")], [])
+
+            Handler.requests.clear()
+            mirror = UploadMirror(json_root, md_root, zulip_url)
+            assert_equal(len(mirror.files), 3)
+            build(json_root, md_root, mirror, zulip_url=zulip_url)
+            assert_equal(Handler.requests, ["/user_uploads/2/ef/gone.png"])
+            assert_equal((json_root / JOURNAL_FILE).exists(), False)
+            state = json.loads((json_root / "uploads.json").read_text())
+            assert_equal(state["files"], mirror.files)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_mirror_uploads_by_month():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    zulip_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_root = Path(tmp_dir) / "json"
+            md_root = Path(tmp_dir) / "html"
+            make_cache(json_root, CACHE)
+
+            mirror = UploadMirror(json_root, md_root, zulip_url)
+            build(
+                json_root,
+                md_root,
+                mirror,
+                site_url="http://x.org",
+                zulip_url=zulip_url,
+                builder=build_partitioned_website,
+            )
+            page = (md_root / "1970/01/stream/1-general/topic/cats.html").read_text()
+            # The months share the site's uploads.
+            cat = mirror.files["/user_uploads/2/ab/cat.png"]
+            assert_equal(page.count(f'href="http://x.org/archive/uploads/{cat}"'), 3)
+            assert_equal((md_root / UPLOADS_DIR / cat).read_bytes(), CAT)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    test_mirror_uploads()
+    test_interrupted_mirror()
+    test_mirror_uploads_by_month()
@@ -0,0 +1,74 @@
+# For convenience, just run the tests in the repo root directory.
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import SITE_URL, assert_equal, build, make_cache
+from lib.verify import broken_links, verify
+
+
+def run_verify(json_root, md_root, plan_file):
+    try:
+        verify(json_root, md_root, SITE_URL, "archive", 2, plan_file)
+    except SystemExit:
+        pass
+    return json.loads(plan_file.read_text())
+
+
+def test_verify():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        json_root = tmp_dir / "json"
+        md_root = tmp_dir / "html"
+        plan_file = tmp_dir / "plan.json"
+        make_cache(json_root, dict(general=(1, dict(lunch=[1, 2, 3], dinner=[4]))))
+        build(json_root, md_root)
+
+        plan = run_verify(json_root, md_root, plan_file)
+        assert_equal(plan, dict(refetch=[], rebuild=[], delete=[]))
+
+        (json_root / "1-general" / "dinner.json").unlink()
+        (md_root / "stream" / "1-general" / "topic" / "lunch.html").unlink()
+        (json_root / "1-general" / "breakfast.json").write_text("[]")
+        # (the next run deletes these)
+        (json_root / "1-general" / ".lunch.json.tmp").write_text("[")
+
+        plan = run_verify(json_root, md_root, plan_file)
+        assert_equal(
+            plan["refetch"],
+            [dict(stream="general", topic="dinner", reason="no JSON file")],
+        )
+        assert_equal(
+            sorted(item["reason"] for item in plan["rebuild"]),
+            [
+                "broken link to topic/lunch.html",
+                "no page",
+            ],
+        )
+        assert_equal(plan["delete"], [str(json_root / "1-general" / "breakfast.json")])
+
+
+def test_broken_links():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        md_root = Path(tmp_dir)
+        (md_root / "stream").mkdir()
+        (md_root / "stream" / "a.html").write_text("")
+        page = md_root / "index.html"
+        page.write_text(
+            '<a href="stream/a.html">a</a> <a href="stream/b.html#1">b</a>\n'
+            '<a href="http://x.org/archive/stream/a.html">a</a>\n'
+            '<a href="http://x.org/archive/stream/c.html">c</a>\n'
+            '<a href="https://example.com/">elsewhere</a>\n'
+        )
+        assert_equal(
+            broken_links(page, md_root, "http://x.org/archive"),
+            ["stream/b.html#1", "http://x.org/archive/stream/c.html"],
+        )
+
+
+if __name__ == "__main__":
+    test_verify()
+    test_broken_links()
@@ -0,0 +1,68 @@
+# For convenience, just run the tests in the repo root directory.
+import json
+import sys
+import tempfile
+from calendar import timegm
+from pathlib import Path
+
+sys.path.append(".")
+
+from helpers import assert_equal, build, make_cache, message
+from lib.views import Views
+
+DAY1 = timegm((2020, 1, 5, 12, 0, 0))
+DAY2 = timegm((2020, 1, 6, 12, 0, 0))
+
+
+def msg(msg_id, sender_id, timestamp):
+    return message(
+        msg_id, timestamp, sender_id=sender_id, sender_full_name=f"User {sender_id}"
+    )
+
+
+def test_views():
+    topics = dict(
+        lunch=[msg(1, 10, DAY1), msg(2, 11, DAY1), msg(4, 10, DAY2)],
+        dinner=[msg(3, 10, DAY1)],
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_root = Path(tmp_dir) / "json"
+        md_root = Path(tmp_dir) / "html"
+        make_cache(json_root, dict(general=(1, topics)))
+        build(json_root, md_root, views=Views(json_root))
+
+        daily = json.loads((md_root / "daily.json").read_text())
+        assert_equal(daily["all"], {"2020-01-05": 3, "2020-01-06": 1})
+        state = json.loads((json_root / "views.json").read_text())
+        assert_equal(state["topics"], dict(general=dict(lunch=4, dinner=3)))
+        assert_equal(state["views"]["authors"]["10"]["count"], 3)
+        assert_equal(
+            state["views"]["topics"]["general"]["lunch"]["senders"], ["10", "11"]
+        )
+
+        # Building again doesn't count anything twice, and new
+        # messages get counted.
+        topics["lunch"].append(msg(5, 12, DAY2))
+        make_cache(json_root, dict(general=(1, topics)))
+        build(json_root, md_root, views=Views(json_root))
+        build(json_root, md_root, views=Views(json_root))
+
+        daily = json.loads((md_root / "daily.json").read_text())
+        assert_equal(daily["all"], {"2020-01-05": 3, "2020-01-06": 2})
+        assert_equal(daily["streams"]["general"], daily["all"])
+        state = json.loads((json_root / "views.json").read_text())
+        assert_equal(state["views"]["authors"]["10"]["count"], 3)
+        assert_equal(state["views"]["authors"]["12"]["months"], {"2020-01": 1})
+
+        authors = (md_root / "authors" / "index.html").read_text()
+        assert_equal(authors.index("User 10") < authors.index("User 11"), True)
+        assert_equal(
+            "3 messages" in (md_root / "authors" / "10.html").read_text(), True
+        )
+        topics_page = (md_root / "topics.html").read_text()
+        assert_equal("(3 people, 4 messages)" in topics_page, True)
+        assert_equal('href="stream/1-general/topic/lunch.html"' in topics_page, True)
+
+
+if __name__ == "__main__":
+    test_views()